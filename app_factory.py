@@ -0,0 +1,58 @@
+import logging
+from telegram.ext import Application, CommandHandler, MessageHandler, filters
+from bot_handlers import BotHandlers
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# (command, BotHandlers method)
+COMMANDS = [
+    ("start", "start_command"),
+    ("help", "help_command"),
+    ("pengeluaran", "expense_command"),
+    ("pemasukan", "income_command"),
+    ("rekapharian", "daily_summary_command"),
+    ("rekapcustom", "custom_summary_command"),
+    ("rekapbulanan", "monthly_summary_command"),
+    ("rekaptahunan", "yearly_summary_command"),
+    ("sinkronrekap", "rebuild_summary_command"),
+    ("import", "import_command"),
+    ("ekspor", "export_command"),
+    # Older names the polling scripts used to register
+    ("hari_ini", "daily_summary_command"),
+    ("bulan_ini", "monthly_summary_command"),
+    ("tahun_ini", "yearly_summary_command"),
+]
+
+# (filter, BotHandlers method), checked in order
+MESSAGES = [
+    (filters.PHOTO, "handle_photo"),
+    (filters.VOICE, "handle_voice"),
+    (filters.Document.ALL, "handle_document"),
+    (filters.TEXT & ~filters.COMMAND, "handle_text"),
+]
+
+
+def register_handlers(application, bot_handlers):
+    """Add every command and message handler of ``bot_handlers`` to ``application``"""
+    for command, method in COMMANDS:
+        application.add_handler(CommandHandler(command, getattr(bot_handlers, method)))
+    for message_filter, method in MESSAGES:
+        application.add_handler(MessageHandler(message_filter, getattr(bot_handlers, method)))
+
+
+def create_application(bot_handlers=None, builder=None, warm_up=True):
+    """Build the Telegram application used by the webhook, polling and catch-up entry points.
+
+    Returns ``(application, bot_handlers)``. Construction does no network I/O;
+    with ``warm_up`` the Gemini client and Sheets connection are set up on
+    background threads while the caller initializes the application.
+    """
+    bot_handlers = bot_handlers or BotHandlers()
+    if builder is None:
+        builder = Application.builder().token(Config.TELEGRAM_BOT_TOKEN)
+    application = builder.build()
+    register_handlers(application, bot_handlers)
+    if warm_up:
+        bot_handlers.warm_up()
+    return application, bot_handlers
@@ -0,0 +1,1243 @@
+#!/usr/bin/env python3
+"""
+Benchmark untuk jalur-jalur kritis bot, memakai layanan palsu tanpa jaringan
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+SHEET_HEADERS = ['Tanggal', 'Tipe', 'Jumlah', 'Kategori', 'Keterangan', 'Timestamp', 'ID', 'Chat']
+
+
+class FakeWorksheet:
+    """In-memory stand-in for a gspread worksheet with configurable latency"""
+
+    def __init__(self, rows=None, latency=0.0):
+        self.rows = [list(SHEET_HEADERS)] + [[str(v) for v in row] for row in (rows or [])]
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _request(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_all_values(self):
+        self._request()
+        return [list(row) for row in self.rows]
+
+    def row_values(self, row):
+        self._request()
+        return list(self.rows[row - 1]) if len(self.rows) >= row else []
+
+    def batch_get(self, ranges):
+        self._request()
+        return [[list(self.rows[0])], [[row[0]] for row in self.rows]]
+
+    def get(self, range_name=None, **kwargs):
+        self._request()
+        start, end = map(int, re.findall(r'(\d+)', range_name))
+        return [list(row) for row in self.rows[start - 1:end]]
+
+    def append_row(self, values, **kwargs):
+        return self.append_rows([values], **kwargs)
+
+    def append_rows(self, values, **kwargs):
+        self._request()
+        with self._lock:
+            first = len(self.rows) + 1
+            self.rows.extend([str(v) for v in row] for row in values)
+            last = len(self.rows)
+        return {'updates': {'updatedRange': f"Sheet1!A{first}:H{last}"}}
+
+    def update(self, values, range_name=None, **kwargs):
+        self._request()
+        self.rows[0] = list(values[0])
+
+    def clear(self):
+        self._request()
+        self.rows = []
+
+
+class FakeMessage:
+    def __init__(self, text=''):
+        self.text = text
+        self.date = datetime.now(timezone.utc)
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+
+def fake_update(text='', args=None):
+    """Build a minimal (update, context) pair for calling BotHandlers directly"""
+    message = FakeMessage(text)
+    update = SimpleNamespace(message=message, effective_message=message, effective_chat=SimpleNamespace(id=1))
+    context = SimpleNamespace(args=args or [], bot=None)
+    return update, context
+
+
+def report(title, count, elapsed):
+    print(f"{title:<28} {count:>6} ops in {elapsed:7.3f}s  -> {count / elapsed:10.1f} ops/s")
+
+
+async def _run_expense_commands(handlers, count):
+    async def one(i):
+        update, context = fake_update(args=[str(1000 + i), 'makanan', 'benchmark'])
+        await handlers.expense_command(update, context)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    return time.perf_counter() - start
+
+
+def bench_sheets(args):
+    """N concurrent /pengeluaran commands against a slow fake sheet"""
+    import tempfile
+    from bot_handlers import BotHandlers
+    from journal import TransactionJournal
+    from sheets_service import SheetsService
+
+    class BlockingSheetsService(SheetsService):
+        """Original behaviour: one append_row per transaction, run on the event loop"""
+
+        async def add_expense(self, date, amount, category, description, type="pengeluaran", chat_id=None):
+            self.sheet.append_row([date.strftime('%Y-%m-%d'), type, amount, category, description, '', '', chat_id])
+            return True
+
+    print(f"{args.count} concurrent /pengeluaran, sheet latency {args.latency * 1000:.0f} ms")
+    with tempfile.TemporaryDirectory() as tmp:
+        for title, service_class in (('blocking (before)', BlockingSheetsService), ('write-behind (after)', SheetsService)):
+            sheet = FakeWorksheet(latency=args.latency)
+            journal = TransactionJournal(f"{tmp}/{service_class.__name__}.db")
+            service = service_class(worksheet=sheet, journal=journal)
+            handlers = BotHandlers(gemini_service=object(), sheets_service=service)
+            elapsed = asyncio.run(_run_expense_commands(handlers, args.count))
+            report(title, args.count, elapsed)
+            service.buffer.close()
+            print(f"{'':<28} sheet API calls: {sheet.calls}, rows in sheet: {len(sheet.rows) - 1}")
+            metrics = service.buffer.get_metrics()
+            if metrics['batches']:
+                print(f"{'':<28} batches: {metrics['batches']}, mean size {metrics['mean_batch_size']}, "
+                      f"flush p50 {metrics['flush_latency']['p50_ms']} ms")
+
+
+def _synthetic_rows(count, years=5, seed=7, tenants=0):
+    """Random ledger rows; with ``tenants`` they are spread over that many chat IDs"""
+    from datetime import date, timedelta
+    rng = random.Random(seed)
+    start = date.today() - timedelta(days=365 * years)
+    categories = ['makanan', 'transportasi', 'belanja', 'tagihan', 'hiburan', 'gaji']
+    rows = []
+    for i in range(count):
+        day = start + timedelta(days=rng.randrange(365 * years))
+        type = 'pemasukan' if rng.random() < 0.1 else 'pengeluaran'
+        chat = str(100000 + rng.randrange(tenants)) if tenants else ''
+        rows.append([day.isoformat(), type, rng.randrange(1, 500) * 1000, rng.choice(categories), 'bench', '', f"id{i}", chat])
+    return rows
+
+
+def _time_query(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def bench_storage(args):
+    """Summary latency of the Sheets (cached) and SQLite backends at several ledger sizes"""
+    import tempfile
+    from datetime import date
+    from ledger_cache import LedgerCache
+    from storage import SheetsStorage, SQLiteStorage
+
+    today = date.today()
+    month_start = today.replace(day=1)
+    queries = (
+        ('custom 1 bulan', lambda s: s.get_totals(None, month_start, today)),
+        ('bulanan', lambda s: s.get_month_totals(None, today.year, today.month)),
+        ('tahunan', lambda s: s.get_year_totals(None, today.year)),
+    )
+    print(f"{'rows':>9} {'backend':<8} {'load s':>8} " + ' '.join(f"{title + ' ms':>16}" for title, _ in queries))
+    for size in [int(value) for value in args.sizes.split(',')]:
+        rows = _synthetic_rows(size)
+        with tempfile.TemporaryDirectory() as tmp:
+            sheet = FakeWorksheet(rows)
+            started = time.perf_counter()
+            cache = LedgerCache(sheet, ttl=3600)
+            cache.sync()
+            backends = [('sheets', SheetsStorage(sheet, cache), time.perf_counter() - started)]
+
+            started = time.perf_counter()
+            sqlite_storage = SQLiteStorage(f"{tmp}/ledger.db")
+            sqlite_storage.add_rows(rows)
+            backends.append(('sqlite', sqlite_storage, time.perf_counter() - started))
+
+            for name, storage, load in backends:
+                timings = [_time_query(lambda: query(storage), args.repeat) for _, query in queries]
+                print(f"{size:>9} {name:<8} {load:>8.2f} " + ' '.join(f"{t:>16.3f}" for t in timings))
+
+
+def bench_export(args):
+    """Rows/second and peak Python memory of /ekspor over a multi-year ledger"""
+    import os
+    import tempfile
+    import tracemalloc
+    from datetime import date
+    from ledger_cache import LedgerCache
+    from ledger_export import EXPORT_FORMATS, write_export
+    from storage import SheetsStorage, SQLiteStorage
+
+    rows = _synthetic_rows(args.rows, years=args.years)
+    start, end = date(1900, 1, 1), date.today()
+    with tempfile.TemporaryDirectory() as tmp:
+        sheet = FakeWorksheet(rows)
+        cache = LedgerCache(sheet, ttl=3600)
+        cache.sync()
+        sqlite_storage = SQLiteStorage(f"{tmp}/ledger.db")
+        sqlite_storage.add_rows(rows)
+        del rows
+
+        print(f"{args.rows} rows over {args.years} years")
+        for name, storage in (('sheets', SheetsStorage(sheet, cache)), ('sqlite', sqlite_storage)):
+            for format in EXPORT_FORMATS:
+                path = f"{tmp}/export.{format}"
+                tracemalloc.start()
+                started = time.perf_counter()
+                count = write_export(storage.iter_records(None, start, end), path, format)
+                elapsed = time.perf_counter() - started
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                report(f"{name} -> {format}", count, elapsed)
+                print(f"{'':<28} file {os.path.getsize(path) / 1024 / 1024:.1f} MiB, "
+                      f"peak Python memory {peak / 1024 / 1024:.1f} MiB")
+
+
+def bench_tenants(args):
+    """Per-chat summary latency with many tenants: partitioned index vs shared full scan"""
+    import tempfile
+    from datetime import date
+    from ledger_cache import LedgerCache
+    from rollups import summarize_records
+    from storage import SheetsStorage, SQLiteStorage
+
+    rows = _synthetic_rows(args.rows, years=args.years, tenants=args.tenants)
+    today = date.today()
+    month_start = today.replace(day=1)
+    year_start = today.replace(month=1, day=1)
+    rng = random.Random(11)
+    chats = [str(100000 + rng.randrange(args.tenants)) for _ in range(args.repeat)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sheet = FakeWorksheet(rows)
+        cache = LedgerCache(sheet, ttl=3600)
+        started = time.perf_counter()
+        cache.sync()
+        print(f"{args.rows} rows, {cache.tenant_count} chats; cache load {time.perf_counter() - started:.2f}s")
+        sqlite_storage = SQLiteStorage(f"{tmp}/ledger.db")
+        sqlite_storage.add_rows(rows)
+
+        def shared_scan(chat, start, end):
+            # What a single shared ledger needs: walk every row, keep this chat's range
+            start_iso, end_iso = start.isoformat(), end.isoformat()
+            return summarize_records(
+                record for record in cache.records
+                if str(record.get('Chat')) == chat and start_iso <= str(record.get('Tanggal'))[:10] <= end_iso
+            )
+
+        backends = (
+            ('shared full scan', shared_scan),
+            ('sheets per-chat index', SheetsStorage(sheet, cache).get_totals),
+            ('sqlite per-chat index', sqlite_storage.get_totals),
+        )
+        print(f"{'backend':<24} {'bulan ms':>10} {'tahun ms':>10}")
+        for name, get_totals in backends:
+            timings = []
+            for start in (month_start, year_start):
+                started = time.perf_counter()
+                for chat in chats:
+                    get_totals(chat, start, today)
+                timings.append((time.perf_counter() - started) / len(chats) * 1000)
+            print(f"{name:<24} {timings[0]:>10.3f} {timings[1]:>10.3f}")
+
+
+SAMPLE_MESSAGES = [
+    "beli kopi 25 ribu", "gaji 5 juta", "parkir 5000", "makan siang 25rb", "bensin 30k",
+    "bayar listrik 350.000", "bonus 1,5jt", "nonton bioskop 50rb", "beli obat di apotek 45.000",
+    "2 porsi bakso 15rb", "kemarin ke rumah budi", "transfer ke adik 200rb", "jual motor 12 jt",
+    "isi pertalite rp25.000", "tadi belanja sayur sama beras 120 ribu", "ongkos 10",
+    "bayar gaji karyawan 5jt", "bayar thr karyawan 3jt", "kasih bonus ke supir 500rb",
+]
+
+# Transaction type each sample must get if the fast path takes it
+SAMPLE_TYPES = {
+    "gaji 5 juta": 'pemasukan', "bonus 1,5jt": 'pemasukan', "jual motor 12 jt": 'pemasukan',
+    "bayar gaji karyawan 5jt": 'pengeluaran', "bayar thr karyawan 3jt": 'pengeluaran',
+    "kasih bonus ke supir 500rb": 'pengeluaran',
+}
+
+
+def bench_parser(args):
+    """Fast-path hit rate and latency of the local text parser"""
+    from config import Config
+    from expense_parser import ExpenseParser
+    from metrics import LatencyStats
+
+    parser = ExpenseParser()
+    stats = LatencyStats(window=len(SAMPLE_MESSAGES) * args.repeat)
+    hits = 0
+    for _ in range(args.repeat):
+        for text in SAMPLE_MESSAGES:
+            with stats.time():
+                result = parser.parse(text)
+            if result and result['confidence'] >= Config.FAST_PARSER_MIN_CONFIDENCE:
+                hits += 1
+    total = len(SAMPLE_MESSAGES) * args.repeat
+    snapshot = stats.snapshot()
+    print(f"fast path hit rate: {hits / total:.1%} of {len(SAMPLE_MESSAGES)} sample messages")
+    print(f"parse latency: p50 {snapshot['p50_ms'] * 1000:.1f} us, p99 {snapshot['p99_ms'] * 1000:.1f} us")
+    wrong = 0
+    for text in SAMPLE_MESSAGES:
+        result = parser.parse(text)
+        path = 'fast' if result and result['confidence'] >= Config.FAST_PARSER_MIN_CONFIDENCE else 'model'
+        expected = SAMPLE_TYPES.get(text, 'pengeluaran')
+        mark = ''
+        if path == 'fast' and result['type'] != expected:
+            wrong += 1
+            mark = f"  WRONG TYPE, expected {expected}"
+        print(f"  [{path:>5}] {text!r} -> "
+              f"{result and (result['type'], result['amount'], result['category'], result['confidence'])}{mark}")
+    print(f"fast-path results with the wrong type: {wrong}")
+
+
+def _telegram_sizes(data):
+    """Re-create the PhotoSize ladder Telegram sends (long side 90/320/800/1280 plus original)"""
+    from image_preprocess import Image
+
+    if Image is None:
+        return [SimpleNamespace(width=10**6, height=10**6, data=data)]
+    import io
+    with Image.open(io.BytesIO(data)) as source:
+        image = source.convert('RGB')
+    sizes = []
+    for side in (90, 320, 800, 1280):
+        if side >= max(image.size):
+            break
+        copy = image.copy()
+        copy.thumbnail((side, side))
+        output = io.BytesIO()
+        copy.save(output, format='JPEG', quality=87)
+        sizes.append(SimpleNamespace(width=copy.width, height=copy.height, data=output.getvalue()))
+    sizes.append(SimpleNamespace(width=image.width, height=image.height, data=data))
+    return sizes
+
+
+def _synthetic_receipts(count, seed=5, template=False, totals=None):
+    """Phone-camera-sized JPEG photos of a printed receipt on a noisy background.
+
+    With ``template`` every receipt has the same size, background, items and
+    angle (one shop's printer) and only the prices differ. Each receipt's sum
+    is appended to ``totals`` when given.
+    """
+    import io
+    from image_preprocess import Image
+    from PIL import ImageDraw, ImageFilter
+
+    rng = random.Random(seed)
+    photos = []
+    for i in range(count):
+        layout = random.Random(seed) if template else rng
+        width, height = layout.choice([(3024, 4032), (2448, 3264), (1920, 2560)])
+        background = tuple(layout.randint(90, 160) for _ in range(3))
+        image = Image.effect_noise((width, height), 40).convert('RGB')
+        image = Image.blend(image, Image.new('RGB', (width, height), background), 0.6)
+        paper = Image.new('RGB', (width * 2 // 3, height * 5 // 6), (246, 244, 238))
+        draw = ImageDraw.Draw(paper)
+        step = max(paper.height // 40, 12)
+        total = 0
+        for line in range(2, 38):
+            item = layout.choice(SAMPLE_MESSAGES)
+            price = rng.randint(1, 999) * 500
+            total += price
+            draw.text((paper.width // 12, line * step), f"{item.upper()[:24]:<26}{price:>10,}",
+                      fill=(30, 30, 30), font_size=step * 2 // 3)
+        if totals is not None:
+            totals.append(total)
+        paper = paper.rotate(layout.uniform(-6, 6), expand=True, fillcolor=background)
+        image.paste(paper, ((width - paper.width) // 2, (height - paper.height) // 2))
+        image = image.filter(ImageFilter.GaussianBlur(0.8))
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=92)
+        photos.append(output.getvalue())
+    return photos
+
+
+def bench_photos(args):
+    """Bytes uploaded and OCR latency with and without receipt preprocessing"""
+    import os
+    from image_preprocess import Image, detect_mime_type, preprocess_image, select_photo_size
+
+    if args.fixtures:
+        paths = sorted(
+            os.path.join(args.fixtures, name) for name in os.listdir(args.fixtures)
+            if name.lower().endswith(('.jpg', '.jpeg', '.png', '.webp'))
+        )
+        if not paths:
+            raise SystemExit(f"Tidak ada gambar di {args.fixtures}")
+        photos = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                photos.append(f.read())
+    elif Image is None:
+        raise SystemExit("Pillow tidak terpasang: berikan --fixtures untuk membandingkan tanpa preprocessing")
+    else:
+        photos = _synthetic_receipts(args.count)
+        print(f"{len(photos)} foto struk sintetis (pakai --fixtures untuk foto asli)")
+    if Image is None:
+        print("Pillow tidak terpasang: hanya deteksi mime, tanpa downscale/re-encode")
+
+    async def stub_model(data, mime_type):
+        # Upload time plus a fixed model latency
+        await asyncio.sleep(args.model_latency + len(data) / args.upload_rate)
+
+    async def run(preprocess):
+        total_bytes = 0
+        started = time.perf_counter()
+        for photo in photos:
+            sizes = _telegram_sizes(photo)
+            if preprocess:
+                data, mime_type = preprocess_image(select_photo_size(sizes).data)
+            else:
+                data, mime_type = sizes[-1].data, 'image/jpeg'
+            await stub_model(data, mime_type)
+            total_bytes += len(data)
+        return total_bytes, time.perf_counter() - started
+
+    raw_bytes, raw_elapsed = asyncio.run(run(False))
+    new_bytes, new_elapsed = asyncio.run(run(True))
+    count = len(photos)
+    print(f"{'largest size, raw':<28} {raw_bytes / 1024:>10.1f} KiB  {raw_elapsed / count * 1000:8.1f} ms/foto")
+    print(f"{'selected size, preprocessed':<28} {new_bytes / 1024:>10.1f} KiB  {new_elapsed / count * 1000:8.1f} ms/foto")
+    print(f"bytes uploaded: -{1 - new_bytes / raw_bytes:.1%}, latency: {raw_elapsed / new_elapsed:.2f}x")
+    mimes = {}
+    for photo in photos:
+        mime_type = detect_mime_type(photo[:16])
+        mimes[mime_type] = mimes.get(mime_type, 0) + 1
+    print(f"detected mime types: {mimes}")
+
+
+def bench_photo_dedup(args):
+    """Receipts printed from one template: how many image matches the dedup cache turns away by amount"""
+    import io
+    from image_preprocess import Image
+    from photo_cache import PhotoDedupCache
+
+    if Image is None:
+        raise SystemExit("Pillow tidak terpasang: tanpa Pillow hanya byte yang identik dianggap sama")
+    totals = []
+    receipts = _synthetic_receipts(args.count, template=True, totals=totals)
+    cache = PhotoDedupCache(max_entries=args.count * 2, ttl=3600, max_distance=args.distance)
+    fingerprints = [cache.fingerprint(photo) for photo in receipts]
+    distances = [
+        [bin(fingerprints[i] ^ fingerprints[j]).count('1') for j in range(i)]
+        for i in range(len(receipts))
+    ]
+    pairs = [distance for row in distances for distance in row]
+    close = sum(distance <= cache.max_distance for distance in pairs)
+    print(f"{len(receipts)} struk berbeda dari satu template, jarak dHash {min(pairs)}-{max(pairs)} bit; "
+          f"{close}/{len(pairs)} pasangan dalam {cache.max_distance} bit")
+
+    # Without the amount check, a receipt close to an earlier one would be answered as its duplicate
+    image_only = sum(any(distance <= cache.max_distance for distance in row) for row in distances)
+    false_duplicates = 0
+    for i, (fingerprint, total) in enumerate(zip(fingerprints, totals)):
+        expense = {'amount': total, 'category': 'makanan'}
+        if cache.lookup_image(1, fingerprint, expense):
+            false_duplicates += 1
+        else:
+            cache.add(1, f'receipt-{i}', fingerprint, expense)
+    print(f"dianggap duplikat hanya dari gambar: {image_only}, dengan cek jumlah: {false_duplicates}")
+
+    resent = 0
+    for photo, total in zip(receipts, totals):
+        # The same receipt sent again as a new file: downscaled and re-compressed
+        with Image.open(io.BytesIO(photo)) as image:
+            image = image.convert('RGB')
+            image.thumbnail((1280, 1280))
+            output = io.BytesIO()
+            image.save(output, format='JPEG', quality=75)
+        if cache.lookup_image(1, cache.fingerprint(output.getvalue()), {'amount': total}):
+            resent += 1
+    print(f"kiriman ulang yang dikenali: {resent}/{len(receipts)}")
+    print(f"metrics: {cache.get_metrics()}")
+    if false_duplicates:
+        raise SystemExit("Struk berbeda dianggap duplikat")
+
+
+class FakeGeminiModels:
+    """Stands in for client.models / client.aio.models; every call sleeps ``latency``"""
+
+    def __init__(self, latency, blocking=False, malformed_rate=0.0):
+        self.latency = latency
+        self.blocking = blocking
+        self.malformed_rate = malformed_rate
+        self.calls = 0
+        self.random = random.Random(3)
+
+    async def generate_content(self, **kwargs):
+        self.calls += 1
+        if self.blocking:
+            # What the synchronous client did inside ``async def``
+            time.sleep(self.latency)
+        else:
+            await asyncio.sleep(self.latency)
+        contents = str(kwargs.get('contents'))
+        results = [
+            {"type": "pengeluaran", "amount": int(amount), "category": "makanan"}
+            for amount in re.findall(r'(\d+)"', contents)
+        ]
+        if 'JSON array' not in contents:
+            return SimpleNamespace(text=json.dumps(results[0]))
+        if self.random.random() < self.malformed_rate:
+            return SimpleNamespace(text=json.dumps(results[:-1]))
+        return SimpleNamespace(text=json.dumps(results))
+
+
+def bench_gemini(args):
+    """Concurrent Gemini extraction throughput and event loop lag with a sleeping fake model"""
+    from config import Config
+    Config.GEMINI_API_KEY = Config.GEMINI_API_KEY or 'benchmark'
+    Config.GEMINI_CACHE_PATH = ''
+
+    async def run(blocking, batching):
+        Config.GEMINI_BATCH_ENABLED = batching
+        from openai_service import GeminiService
+        service = GeminiService()
+        service.timeout = args.timeout
+        models = FakeGeminiModels(args.latency, blocking, args.malformed_rate)
+        service.client = SimpleNamespace(aio=SimpleNamespace(models=models))
+        lag = []
+        done = asyncio.Event()
+
+        async def heartbeat():
+            # Stand-in for a /rekapharian reply: how long does a 10ms tick actually take?
+            while not done.is_set():
+                started = time.perf_counter()
+                await asyncio.sleep(0.01)
+                lag.append(time.perf_counter() - started - 0.01)
+
+        async def one(i):
+            # Messages trickle in over the first ~100ms, like a busy second
+            await asyncio.sleep(i * 0.1 / args.count)
+            return await service.extract_expense_from_text(f"beli sesuatu {1000 + i}")
+
+        ticker = asyncio.create_task(heartbeat())
+        started = time.perf_counter()
+        results = await asyncio.gather(*(one(i) for i in range(args.count)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await ticker
+        correct = sum(1 for i, result in enumerate(results) if result and result['amount'] == 1000 + i)
+        return correct, elapsed, max(lag) if lag else elapsed, service, models
+
+    variants = (
+        ("sync client (blocking)", True, False),
+        ("async client + semaphore", False, False),
+        ("async + micro-batching", False, True),
+    )
+    for title, blocking, batching in variants:
+        correct, elapsed, max_lag, service, models = asyncio.run(run(blocking, batching))
+        report(title, args.count, elapsed)
+        print(f"{'':<28} correct {correct}, model calls {models.calls}, timeouts {service.timeouts}, "
+              f"batch fallbacks {service.batch_fallbacks}, max event loop lag {max_lag * 1000:.0f} ms")
+
+
+class FakeApplication:
+    """Stand-in for telegram.ext.Application that sleeps per update and records latency by kind"""
+
+    def __init__(self, slow_latency, fast_latency):
+        self.slow_latency = slow_latency
+        self.fast_latency = fast_latency
+        self.latencies = {}
+        self.processed = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def process_update(self, update):
+        from dispatcher import SLOW_LANE, update_lane
+        await asyncio.sleep(self.slow_latency if update_lane(update) == SLOW_LANE else self.fast_latency)
+        self.latencies.setdefault(update.kind, []).append(time.perf_counter() - update.submitted_at)
+        self.processed += 1
+
+
+def _scheduling_workload(args):
+    """One chat dumps a burst of receipts at t=0; quiet chats send a receipt and a /help meanwhile"""
+    rng = random.Random(5)
+
+    def update(chat, kind):
+        command = kind == 'help'
+        message = SimpleNamespace(text='/help' if command else None, photo=None if command else [1],
+                                  voice=None, document=None)
+        return SimpleNamespace(kind=kind, submitted_at=None, effective_message=message,
+                               effective_chat=SimpleNamespace(id=chat))
+
+    workload = [(0.0, update(1, 'noisy')) for _ in range(args.burst_size)]
+    for chat in range(2, args.chats + 2):
+        workload.append((rng.uniform(0, args.spread), update(chat, 'photo')))
+        workload.append((rng.uniform(0, args.spread), update(chat, 'help')))
+    workload.sort(key=lambda item: item[0])
+    return workload
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))] if values else 0.0
+
+
+def _dispatch_fifo(application, workload, workers):
+    """Replay a timed workload through the previous dispatcher: one queue, one pool, no ordering"""
+    async def run():
+        queue = asyncio.Queue()
+
+        async def worker():
+            while True:
+                update = await queue.get()
+                try:
+                    await application.process_update(update)
+                finally:
+                    queue.task_done()
+
+        tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+        started = time.perf_counter()
+        for offset, update in workload:
+            await asyncio.sleep(max(0.0, started + offset - time.perf_counter()))
+            update.submitted_at = time.perf_counter()
+            queue.put_nowait(update)
+        await queue.join()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run(run())
+
+
+def _dispatch_lanes(application, workload, **kwargs):
+    """Replay a timed workload through UpdateDispatcher; returns its metrics"""
+    from dispatcher import UpdateDispatcher
+
+    dispatcher = UpdateDispatcher(application, queue_size=1000000, max_pending_per_chat=1000000, **kwargs)
+    dispatcher.start()
+    started = time.perf_counter()
+    for offset, update in workload:
+        time.sleep(max(0.0, started + offset - time.perf_counter()))
+        update.submitted_at = time.perf_counter()
+        dispatcher.submit(update)
+    while application.processed < len(workload):
+        time.sleep(0.01)
+    metrics = dispatcher.get_metrics()
+    dispatcher.stop()
+    return metrics
+
+
+def bench_scheduling(args):
+    """Queue wait for quiet chats and /help while one chat floods receipts: FIFO vs fair lanes"""
+    from dispatcher import FAST_LANE, SLOW_LANE
+
+    def run_fifo():
+        application = FakeApplication(args.slow_latency, args.fast_latency)
+        _dispatch_fifo(application, _scheduling_workload(args), args.workers + args.fast_workers)
+        return application, None
+
+    def run_fair():
+        application = FakeApplication(args.slow_latency, args.fast_latency)
+        metrics = _dispatch_lanes(
+            application, _scheduling_workload(args), workers=args.workers, fast_workers=args.fast_workers,
+            rate_limits={FAST_LANE: (args.rate * 4, args.burst * 2), SLOW_LANE: (args.rate, args.burst)},
+        )
+        return application, metrics
+
+    print(f"{args.burst_size} receipts from one chat, {args.chats} quiet chats; "
+          f"slow lane limit {args.rate}/s burst {args.burst}")
+    print(f"{'dispatcher':<16} {'receipt p50':>12} {'receipt p95':>12} {'/help p95':>10} {'flood done':>11}")
+    for name, run in (('fifo', run_fifo), ('fair lanes', run_fair)):
+        application, metrics = run()
+        latencies = application.latencies
+        print(f"{name:<16} {_percentile(latencies['photo'], 50) * 1000:>10.0f}ms "
+              f"{_percentile(latencies['photo'], 95) * 1000:>10.0f}ms "
+              f"{_percentile(latencies['help'], 95) * 1000:>8.0f}ms "
+              f"{max(latencies['noisy']):>10.2f}s")
+        if metrics:
+            for lane, lane_metrics in metrics['lanes'].items():
+                print(f"{'':<16} {lane} lane: queue wait p95 {lane_metrics['queue_wait']['p95_ms']:.0f} ms, "
+                      f"throttled {lane_metrics['throttled']}")
+
+
+class FakeLedgerApplication:
+    """Fake application where writes append to a per-chat ledger after a random delay and reads count it"""
+
+    def __init__(self, max_slow_latency, max_fast_latency, seed=3):
+        self.max_slow_latency = max_slow_latency
+        self.max_fast_latency = max_fast_latency
+        self.rng = random.Random(seed)
+        self.ledgers = {}
+        self.executed = {}
+        self.stale_reads = 0
+        self.reads = 0
+        self.processed = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def process_update(self, update):
+        from dispatcher import SLOW_LANE, update_lane
+        chat = update.effective_chat.id
+        slow = update_lane(update) == SLOW_LANE
+        await asyncio.sleep(self.rng.uniform(0, self.max_slow_latency if slow else self.max_fast_latency))
+        if update.kind == 'write':
+            self.ledgers[chat] = self.ledgers.get(chat, 0) + 1
+        else:
+            self.reads += 1
+            if self.ledgers.get(chat, 0) != update.writes_before:
+                self.stale_reads += 1
+        self.executed.setdefault(chat, []).append(update.sequence)
+        self.processed += 1
+
+
+def _ordering_workload(args):
+    """Per chat, a random interleaving of writes (/pengeluaran or a receipt) and /rekapharian reads"""
+    rng = random.Random(9)
+    workload = []
+    for chat in range(1, args.chats + 1):
+        writes = 0
+        offset = 0.0
+        for sequence in range(args.per_chat):
+            offset += rng.expovariate(1 / args.gap)
+            kind = 'write' if rng.random() < 0.6 else 'read'
+            if kind == 'write':
+                text, photo = (None, [1]) if rng.random() < 0.3 else ('/pengeluaran 1000 makanan', None)
+            else:
+                text, photo = '/rekapharian', None
+            message = SimpleNamespace(text=text, photo=photo, voice=None, document=None)
+            workload.append((offset, SimpleNamespace(
+                kind=kind, sequence=sequence, writes_before=writes, submitted_at=None,
+                effective_message=message, effective_chat=SimpleNamespace(id=chat),
+            )))
+            writes += kind == 'write'
+    workload.sort(key=lambda item: item[0])
+    return workload
+
+
+def bench_ordering(args):
+    """Stress test: interleaved writes and summaries per chat must run in arrival order"""
+    from dispatcher import FAST_LANE, SLOW_LANE
+
+    unlimited = {FAST_LANE: (0, 1), SLOW_LANE: (0, 1)}
+    variants = (
+        ('fifo pool', lambda app, workload: _dispatch_fifo(app, workload, args.workers + args.fast_workers)),
+        ('per-chat serial', lambda app, workload: _dispatch_lanes(
+            app, workload, workers=args.workers, fast_workers=args.fast_workers, rate_limits=unlimited)),
+    )
+    total = args.chats * args.per_chat
+    failures = []
+    print(f"{args.chats} chats x {args.per_chat} updates, receipts up to {args.slow_latency * 1000:.0f} ms, "
+          f"commands up to {args.fast_latency * 1000:.0f} ms")
+    for name, dispatch in variants:
+        application = FakeLedgerApplication(args.slow_latency, args.fast_latency)
+        started = time.perf_counter()
+        dispatch(application, _ordering_workload(args))
+        elapsed = time.perf_counter() - started
+        reordered = sum(1 for order in application.executed.values() if order != sorted(order))
+        report(name, total, elapsed)
+        print(f"{'':<28} chats reordered {reordered}, stale summaries {application.stale_reads}/{application.reads}")
+        if name != 'fifo pool' and (reordered or application.stale_reads):
+            failures.append(name)
+    if failures:
+        raise SystemExit(f"GAGAL: urutan per chat tidak terjaga ({', '.join(failures)})")
+    print("OK: setiap chat diproses berurutan")
+
+
+def _fake_telegram_request_class():
+    from catch_up import OfflineRequest
+
+    class FakeTelegramRequest(OfflineRequest):
+        """Offline Bot API with latency that serves ``updates`` via getUpdates and timestamps sendMessage"""
+
+        def __init__(self, latency=0.0, updates=()):
+            super().__init__()
+            self.latency = latency
+            self.sent = []
+            self.updates = deque(updates)
+            self.confirmed_offset = 0
+
+        async def do_request(self, url, method, request_data=None, **kwargs):
+            await asyncio.sleep(self.latency)
+            endpoint = url.rsplit('/', 1)[-1]
+            params = request_data.parameters if request_data else {}
+            if endpoint == 'getUpdates':
+                # Like Telegram: an offset confirms (and forgets) every update below it
+                offset = params.get('offset') or 0
+                self.confirmed_offset = max(self.confirmed_offset, offset)
+                while self.updates and self.updates[0]['update_id'] < offset:
+                    self.updates.popleft()
+                result = [update for _, update in zip(range(params.get('limit', 100)), self.updates)]
+                if not result and params.get('timeout'):
+                    await asyncio.sleep(min(params['timeout'], 0.05))
+                return 200, json.dumps({'ok': True, 'result': result}).encode()
+            if endpoint == 'sendMessage':
+                self.sent.append((time.perf_counter(), params))
+            return await super().do_request(url, method, request_data, **kwargs)
+
+    return FakeTelegramRequest
+
+
+def _command_update(command, update_id, chat_id=42):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id, 'date': int(time.time()), 'text': command,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Benchmark'},
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command.split()[0])}],
+        },
+    }
+
+
+def bench_startup(args):
+    """Import time of main.py and time to the first /help and /rekapharian replies: eager vs lazy startup"""
+    import os
+    import subprocess
+    import sys
+    import tempfile
+
+    env = dict(os.environ, GEMINI_API_KEY=os.environ.get('GEMINI_API_KEY') or 'benchmark',
+               TELEGRAM_BOT_TOKEN=os.environ.get('TELEGRAM_BOT_TOKEN') or '123:benchmark')
+    probe = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    imports = [
+        float(subprocess.run([sys.executable, '-c', probe], env=env, capture_output=True, text=True,
+                             check=True).stdout.strip().splitlines()[-1])
+        for _ in range(args.repeat)
+    ]
+    print(f"import main: min {min(imports):.3f}s, max {max(imports):.3f}s over {args.repeat} runs")
+
+    os.environ.update(GEMINI_API_KEY=env['GEMINI_API_KEY'], GEMINI_CACHE_PATH='')
+    from config import Config
+    Config.GEMINI_API_KEY = env['GEMINI_API_KEY']
+    Config.GEMINI_CACHE_PATH = ''
+    from telegram import Update
+    from telegram.ext import Application
+    from app_factory import create_application
+    from bot_handlers import BotHandlers
+    from journal import TransactionJournal
+    from sheets_service import SheetsService
+
+    class SlowSheetsService(SheetsService):
+        """Connecting takes ``--sheets-latency`` seconds, like opening the spreadsheet over the network"""
+
+        def _init_sheets(self):
+            time.sleep(args.sheets_latency)
+            self._attach_sheet(FakeWorksheet(_synthetic_rows(1000, years=1)))
+
+    FakeTelegramRequest = _fake_telegram_request_class()
+
+    async def first_replies(eager, tmp):
+        started = time.perf_counter()
+        request = FakeTelegramRequest(args.telegram_latency)
+        sheets = SlowSheetsService(journal=TransactionJournal(f"{tmp}/{eager}.db"), connect=eager)
+        handlers = BotHandlers(sheets_service=sheets)
+        if eager:
+            # What the constructors used to do before the first update could be handled
+            handlers.gemini_service.warm_up()
+        builder = Application.builder().token('123:benchmark').request(request).get_updates_request(request)
+        application, _ = create_application(handlers, builder=builder, warm_up=not eager)
+        await application.initialize()
+        initialized = time.perf_counter() - started
+        replies = []
+        for update_id, command in enumerate(('/help', '/rekapharian'), start=1):
+            update = Update.de_json(_command_update(command, update_id), application.bot)
+            await application.process_update(update)
+            replies.append(request.sent[-1][0] - started)
+        await application.shutdown()
+        sheets.buffer.close()
+        return initialized, replies
+
+    print(f"sheets connect {args.sheets_latency:.1f}s, Telegram API latency {args.telegram_latency * 1000:.0f} ms")
+    print(f"{'startup':<16} {'initialized':>12} {'first /help':>12} {'first rekap':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, eager in (('eager (before)', True), ('lazy factory', False)):
+            initialized, (help_reply, summary_reply) = asyncio.run(first_replies(eager, tmp))
+            print(f"{name:<16} {initialized:>11.3f}s {help_reply:>11.3f}s {summary_reply:>11.3f}s")
+
+
+def _text_update(text, update_id, chat_id):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id, 'date': int(time.time()), 'text': text,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Benchmark'},
+        },
+    }
+
+
+def bench_polling(args):
+    """Recovering a backlog of pending updates: sequential getUpdates loop vs PollingRunner vs catch-up"""
+    import tempfile
+    from telegram import Update
+    from telegram.ext import Application, TypeHandler
+    from catch_up import CatchUp, UpdateCheckpoint, UpdateDump
+    from dispatcher import FAST_LANE, SLOW_LANE, UpdateDispatcher
+    from polling import PollingRunner
+
+    FakeTelegramRequest = _fake_telegram_request_class()
+    rng = random.Random(13)
+    first_id = 500000
+    backlog = [
+        _text_update(f"beli kopi {1000 + i}", first_id + i, 1000 + rng.randrange(args.chats))
+        for i in range(args.updates)
+    ]
+    unlimited = {FAST_LANE: (0, 1), SLOW_LANE: (0, 1)}
+    handled = Counter()
+    order = {}
+
+    def build(updates):
+        request = FakeTelegramRequest(updates=updates)
+        application = Application.builder().token('123:benchmark').request(request).get_updates_request(request).build()
+        latency = random.Random(17)
+
+        async def handle(update, context):
+            # Stand-in for a handler waiting on Gemini/Sheets
+            await asyncio.sleep(latency.uniform(0, 2 * args.latency))
+            handled[update.update_id] += 1
+            order.setdefault(update.effective_chat.id, []).append(update.update_id)
+
+        application.add_handler(TypeHandler(Update, handle))
+        return application, request
+
+    def run_sequential():
+        application, request = build(backlog)
+
+        async def run():
+            # What manual_process.py and the default run_polling did: one update at a time
+            await application.initialize()
+            offset = None
+            while len(handled) < args.updates:
+                updates = await application.bot.get_updates(offset=offset, limit=100, timeout=0)
+                for update in updates:
+                    await application.process_update(update)
+                if updates:
+                    offset = updates[-1].update_id + 1
+            await application.bot.get_updates(offset=offset, limit=1, timeout=0)
+            await application.shutdown()
+
+        asyncio.run(run())
+        return request
+
+    def run_runner(default_limits=False):
+        application, request = build(backlog)
+        if default_limits:
+            # What test_bot.py runs: the live queue size and per-chat token buckets
+            dispatcher = UpdateDispatcher(application, workers=args.workers)
+        else:
+            dispatcher = UpdateDispatcher(application, workers=args.workers, queue_size=args.updates,
+                                          rate_limits=unlimited)
+        dispatcher.start()
+        request.dispatcher = dispatcher
+        runner = PollingRunner(dispatcher, poll_timeout=1)
+
+        def stop_when_done():
+            while len(handled) < args.updates:
+                time.sleep(0.01)
+            runner.stop()
+
+        threading.Thread(target=stop_when_done, daemon=True).start()
+        runner.run(install_signal_handlers=False)
+        return request
+
+    def run_catch_up(tmp, updates, crash_after=None):
+        application, request = build(updates)
+        dispatcher = UpdateDispatcher(application, workers=args.workers, rate_limits=unlimited)
+        dispatcher.start()
+        checkpoint = UpdateCheckpoint(f"{tmp}/checkpoint.txt")
+        catch_up = CatchUp(dispatcher, checkpoint, UpdateDump(f"{tmp}/dump.jsonl"), report=lambda line: None)
+        future = asyncio.run_coroutine_threadsafe(catch_up.run(), dispatcher.loop)
+        if crash_after:
+            while len(handled) < crash_after:
+                time.sleep(0.001)
+            # Stop fetching; whatever is still queued finishes or is left for the rerun
+            future.cancel()
+        else:
+            future.result()
+        dispatcher.stop(timeout=0.1)
+        checkpoint.close()
+        return request
+
+    def summarize(name, started, request, already_handled=0):
+        # Counts carry over from an interrupted first run so duplicates across runs show up
+        report(name, sum(handled.values()) - already_handled, time.perf_counter() - started)
+        duplicates = sum(count - 1 for count in handled.values())
+        reordered = sum(1 for ids in order.values() if ids != sorted(ids))
+        confirmed = (f"confirmed offset {request.confirmed_offset - first_id}/{args.updates}"
+                     if request.confirmed_offset else "no offset confirmed")
+        print(f"{'':<28} {confirmed}, duplicates {duplicates}, chats reordered {reordered}")
+        dispatcher = getattr(request, 'dispatcher', None)
+        if dispatcher:
+            print(f"{'':<28} dispatcher rejected {dispatcher.rejected}, rate_limited {dispatcher.rate_limited}")
+        handled.clear()
+        order.clear()
+
+    print(f"backlog of {args.updates} updates from {args.chats} chats, handler latency ~{args.latency * 1000:.0f} ms")
+    for name, run in (('sequential loop', run_sequential), ('PollingRunner', run_runner),
+                      ('PollingRunner, live limits', lambda: run_runner(default_limits=True))):
+        started = time.perf_counter()
+        summarize(name, started, run())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        started = time.perf_counter()
+        summarize('manual_process catch-up', started, run_catch_up(tmp, backlog))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        import logging
+        # The simulated crash abandons queued work on purpose; keep its teardown quiet
+        for name in ('asyncio', 'dispatcher'):
+            logging.getLogger(name).setLevel(logging.CRITICAL)
+        first = run_catch_up(tmp, backlog, crash_after=args.updates // 2)
+        first_handled = sum(handled.values())
+        print(f"{'':<28} interrupted after {first_handled} handled, rerunning")
+        # Telegram only still has what the first run never confirmed; the dump has the rest
+        print(f"{'':<28} {len(first.updates)} updates still pending at Telegram, the rest comes from the dump")
+        started = time.perf_counter()
+        rerun = run_catch_up(tmp, list(first.updates))
+        summarize('catch-up, rerun', started, rerun, already_handled=first_handled)
+
+
+def _webhook_payloads(count, seed=21):
+    """Representative webhook bodies: free text, commands, photos with four sizes, documents"""
+    rng = random.Random(seed)
+
+    def file_id(prefix):
+        return prefix + ''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_-')
+                                for _ in range(70))
+
+    payloads = []
+    for i in range(count):
+        update_id = 700000 + i
+        chat_id = 1000 + rng.randrange(300)
+        kind = rng.random()
+        if kind < 0.5:
+            payload = _text_update(rng.choice(SAMPLE_MESSAGES), update_id, chat_id)
+        elif kind < 0.7:
+            payload = _command_update(rng.choice(('/rekapharian', '/pengeluaran 25000 makanan bakso', '/help')),
+                                      update_id, chat_id)
+        elif kind < 0.95:
+            payload = _text_update('', update_id, chat_id)
+            del payload['message']['text']
+            payload['message']['caption'] = 'struk belanja'
+            payload['message']['photo'] = [
+                {'file_id': file_id('AgAC'), 'file_unique_id': file_id('AQAD')[:16], 'width': width,
+                 'height': width * 4 // 3, 'file_size': width * width // 6}
+                for width in (90, 320, 800, 1280)
+            ]
+        else:
+            payload = _text_update('', update_id, chat_id)
+            del payload['message']['text']
+            payload['message']['document'] = {'file_id': file_id('BQAC'), 'file_unique_id': file_id('AgAD')[:16],
+                                              'file_name': 'transaksi.csv', 'mime_type': 'text/csv',
+                                              'file_size': 20480}
+        payloads.append(payload)
+    return payloads
+
+
+def _webhook_deliveries(payloads, retry_rate, seed=23):
+    """Delivery order with Telegram-style retries: some updates arrive again a little later"""
+    rng = random.Random(seed)
+    deliveries = [[i, payload] for i, payload in enumerate(payloads)]
+    for i, payload in enumerate(payloads):
+        if rng.random() < retry_rate:
+            for _ in range(rng.randint(1, 3)):
+                deliveries.append([i + rng.uniform(1, 50), payload])
+    deliveries.sort(key=lambda item: item[0])
+    return [json.dumps(payload) for _, payload in deliveries]
+
+
+class CountingDispatcher:
+    """Stand-in for UpdateDispatcher that only counts what the webhook hands it"""
+
+    running = True
+
+    def __init__(self, parse=False):
+        self.application = SimpleNamespace(bot=None)
+        self.parse = parse
+        self.dispatched = Counter()
+
+    def submit(self, update, on_done=None):
+        if self.parse:
+            # What the webhook used to do on the request thread
+            from telegram import Update
+            update = Update.de_json(update, None)
+        update_id = update['update_id'] if isinstance(update, dict) else update.update_id
+        self.dispatched[update_id] += 1
+        return True
+
+
+def bench_webhook(args):
+    """/webhook requests per second: payload logging, parsing and Telegram retries"""
+    import logging
+    import os
+    os.environ.setdefault('GEMINI_API_KEY', 'benchmark')
+    import main
+    from config import Config
+    from update_dedup import UpdateDeduplicator
+
+    # Keep main.py's log formatting on the measured path, but write it nowhere
+    devnull = open(os.devnull, 'w')
+    for handler in logging.getLogger().handlers:
+        handler.setStream(devnull)
+
+    payloads = _webhook_payloads(args.updates)
+    bodies = _webhook_deliveries(payloads, args.retry_rate)
+    print(f"{len(bodies)} deliveries of {len(payloads)} updates ({len(bodies) - len(payloads)} retries), "
+          f"mean body {sum(map(len, bodies)) / len(bodies):.0f} bytes")
+    client = main.app.test_client()
+    secret = 'benchmark-secret'
+    saved = (Config.WEBHOOK_LOG_PAYLOADS, Config.WEBHOOK_SECRET_TOKEN)
+    # (name, full payload log, parse on request thread, dedup, secret token)
+    setups = [
+        ('full log, parse in request', True, True, False, False),
+        ('full log, deferred parse', True, False, False, False),
+        ('sampled log, deferred parse', False, False, False, False),
+        ('+ update_id dedup', False, False, True, False),
+        ('+ secret token', False, False, True, True),
+    ]
+    for name, log_payloads, parse, dedup, token in setups:
+        Config.WEBHOOK_LOG_PAYLOADS = log_payloads
+        Config.WEBHOOK_SECRET_TOKEN = secret if token else ''
+        headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if token else {}
+        dispatcher = CountingDispatcher(parse=parse)
+        deduplicator = UpdateDeduplicator(window=3600 if dedup else 0)
+        main.update_dispatcher = dispatcher
+        main.update_deduplicator = deduplicator
+        started = time.perf_counter()
+        for body in bodies:
+            client.post('/webhook', data=body, content_type='application/json', headers=headers)
+        report(name, len(bodies), time.perf_counter() - started)
+        duplicates = sum(count - 1 for count in dispatcher.dispatched.values())
+        print(f"{'':<28} dispatched {sum(dispatcher.dispatched.values())}, duplicate dispatches {duplicates}, "
+              f"dropped {deduplicator.duplicates}")
+    forged = client.post('/webhook', data=bodies[0], content_type='application/json',
+                         headers={'X-Telegram-Bot-Api-Secret-Token': 'wrong'})
+    print(f"wrong secret token -> HTTP {forged.status_code}")
+    Config.WEBHOOK_LOG_PAYLOADS, Config.WEBHOOK_SECRET_TOKEN = saved
+    main.update_dispatcher = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    sheets = subparsers.add_parser('sheets', help=bench_sheets.__doc__)
+    sheets.add_argument('--count', type=int, default=50)
+    sheets.add_argument('--latency', type=float, default=0.2)
+    sheets.set_defaults(func=bench_sheets)
+
+    storage = subparsers.add_parser('storage', help=bench_storage.__doc__)
+    storage.add_argument('--sizes', default='1000,100000,1000000')
+    storage.add_argument('--repeat', type=int, default=20)
+    storage.set_defaults(func=bench_storage)
+
+    text_parser = subparsers.add_parser('parser', help=bench_parser.__doc__)
+    text_parser.add_argument('--repeat', type=int, default=1000)
+    text_parser.set_defaults(func=bench_parser)
+
+    photos = subparsers.add_parser('photos', help=bench_photos.__doc__)
+    photos.add_argument('--fixtures', help='directory of receipt images (default: synthetic receipts)')
+    photos.add_argument('--count', type=int, default=12, help='synthetic receipts when --fixtures is not given')
+    photos.add_argument('--model-latency', type=float, default=0.5)
+    photos.add_argument('--upload-rate', type=float, default=1_000_000, help='bytes per second')
+    photos.set_defaults(func=bench_photos)
+
+    photo_dedup = subparsers.add_parser('photo-dedup', help=bench_photo_dedup.__doc__)
+    photo_dedup.add_argument('--count', type=int, default=8)
+    photo_dedup.add_argument('--distance', type=int, default=None, help='default: PHOTO_HASH_DISTANCE')
+    photo_dedup.set_defaults(func=bench_photo_dedup)
+
+    gemini = subparsers.add_parser('gemini', help=bench_gemini.__doc__)
+    gemini.add_argument('--count', type=int, default=40)
+    gemini.add_argument('--latency', type=float, default=0.5)
+    gemini.add_argument('--timeout', type=float, default=20)
+    gemini.add_argument('--malformed-rate', type=float, default=0.0)
+    gemini.set_defaults(func=bench_gemini)
+
+    export = subparsers.add_parser('export', help=bench_export.__doc__)
+    export.add_argument('--rows', type=int, default=500000)
+    export.add_argument('--years', type=int, default=5)
+    export.set_defaults(func=bench_export)
+
+    tenants = subparsers.add_parser('tenants', help=bench_tenants.__doc__)
+    tenants.add_argument('--tenants', type=int, default=1000)
+    tenants.add_argument('--rows', type=int, default=500000)
+    tenants.add_argument('--years', type=int, default=3)
+    tenants.add_argument('--repeat', type=int, default=200)
+    tenants.set_defaults(func=bench_tenants)
+
+    scheduling = subparsers.add_parser('scheduling', help=bench_scheduling.__doc__)
+    scheduling.add_argument('--burst-size', type=int, default=60)
+    scheduling.add_argument('--chats', type=int, default=20)
+    scheduling.add_argument('--spread', type=float, default=1.0)
+    scheduling.add_argument('--slow-latency', type=float, default=0.1)
+    scheduling.add_argument('--fast-latency', type=float, default=0.002)
+    scheduling.add_argument('--workers', type=int, default=8)
+    scheduling.add_argument('--fast-workers', type=int, default=2)
+    scheduling.add_argument('--rate', type=float, default=10)
+    scheduling.add_argument('--burst', type=int, default=5)
+    scheduling.set_defaults(func=bench_scheduling)
+
+    ordering = subparsers.add_parser('ordering', help=bench_ordering.__doc__)
+    ordering.add_argument('--chats', type=int, default=50)
+    ordering.add_argument('--per-chat', type=int, default=40)
+    ordering.add_argument('--gap', type=float, default=0.02, help='mean seconds between updates of one chat')
+    ordering.add_argument('--slow-latency', type=float, default=0.05)
+    ordering.add_argument('--fast-latency', type=float, default=0.002)
+    ordering.add_argument('--workers', type=int, default=8)
+    ordering.add_argument('--fast-workers', type=int, default=2)
+    ordering.set_defaults(func=bench_ordering)
+
+    startup = subparsers.add_parser('startup', help=bench_startup.__doc__)
+    startup.add_argument('--repeat', type=int, default=3)
+    startup.add_argument('--sheets-latency', type=float, default=2.0)
+    startup.add_argument('--telegram-latency', type=float, default=0.1)
+    startup.set_defaults(func=bench_startup)
+
+    polling = subparsers.add_parser('polling', help=bench_polling.__doc__)
+    polling.add_argument('--updates', type=int, default=2000)
+    polling.add_argument('--chats', type=int, default=200)
+    polling.add_argument('--latency', type=float, default=0.01)
+    polling.add_argument('--workers', type=int, default=16)
+    polling.set_defaults(func=bench_polling)
+
+    webhook = subparsers.add_parser('webhook', help=bench_webhook.__doc__)
+    webhook.add_argument('--updates', type=int, default=5000)
+    webhook.add_argument('--retry-rate', type=float, default=0.2)
+    webhook.set_defaults(func=bench_webhook)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
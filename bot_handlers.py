@@ -1,22 +1,150 @@
 import os
 import logging
 import io
+import asyncio
 import tempfile
+import threading
+import time
 from datetime import datetime
 from telegram import Update
 from telegram.ext import ContextTypes
+from telegram.helpers import escape_markdown
 from openai_service import GeminiService
 from sheets_service import SheetsService
 from date_utils import DateUtils
+from expense_parser import ExpenseParser
+from photo_cache import PhotoDedupCache
+from image_preprocess import select_photo_size, preprocess_image
+from metrics import LatencyStats
+from circuit_breaker import CircuitOpenError
+from bulk_entry import split_entries, is_bulk_entry, iter_csv_entries, chunked
+from ledger_export import EXPORT_FORMATS
 from config import Config
 
 logger = logging.getLogger(__name__)
 
 class BotHandlers:
-    def __init__(self):
-        self.gemini_service = GeminiService()
-        self.sheets_service = SheetsService()
+    def __init__(self, gemini_service=None, sheets_service=None):
+        # Services are cheap to construct; their network setup happens in warm_up()
+        self.gemini_service = gemini_service or GeminiService()
+        self.sheets_service = sheets_service or SheetsService(connect=False)
+        self.warm_up_seconds = {}
         self.date_utils = DateUtils()
+        self.expense_parser = ExpenseParser()
+        self.fast_path_latency = LatencyStats()
+        self.model_path_latency = LatencyStats()
+        self.fast_path_hits = 0
+        self.breaker_fallbacks = 0
+        self.photo_cache = PhotoDedupCache()
+        self.photo_latency = LatencyStats()
+        self.photo_bytes_downloaded = 0
+        self.photo_bytes_uploaded = 0
+    
+    def warm_up(self):
+        """Set up the Gemini client and the Sheets connection in parallel on background threads.
+        
+        Returns the started threads. Handlers that need a service before its warm-up
+        finished wait for it; handlers that need neither (``/help``) never do.
+        """
+        threads = []
+        for name, service in (('gemini', self.gemini_service), ('sheets', self.sheets_service)):
+            warm_up = getattr(service, 'warm_up', None)
+            if warm_up is None:
+                continue
+            thread = threading.Thread(target=self._warm_up_service, args=(name, warm_up),
+                                      name=f"warm-up-{name}", daemon=True)
+            thread.start()
+            threads.append(thread)
+        return threads
+    
+    def _warm_up_service(self, name, warm_up):
+        started = time.perf_counter()
+        try:
+            warm_up()
+        except Exception as e:
+            logger.error(f"Error warming up {name}: {e}")
+        self.warm_up_seconds[name] = round(time.perf_counter() - started, 3)
+        logger.info(f"{name} ready in {self.warm_up_seconds[name]:.2f}s")
+    
+    def get_metrics(self):
+        """Return text parser hit rate and latency, photo dedup counters and OCR upload size"""
+        parsed = self.fast_path_latency.count
+        return {
+            'warm_up_seconds': dict(self.warm_up_seconds),
+            'text_parser': {
+                'messages': parsed,
+                'fast_path_hits': self.fast_path_hits,
+                'breaker_fallbacks': self.breaker_fallbacks,
+                'hit_rate': round(self.fast_path_hits / parsed, 3) if parsed else 0.0,
+                'fast_path_latency': self.fast_path_latency.snapshot(),
+                'model_latency': self.model_path_latency.snapshot(),
+            },
+            'photo_cache': self.photo_cache.get_metrics(),
+            'photo_ocr': {
+                'photos': self.photo_latency.count,
+                'bytes_downloaded': self.photo_bytes_downloaded,
+                'bytes_uploaded': self.photo_bytes_uploaded,
+                'latency': self.photo_latency.snapshot(),
+            }
+        }
+    
+    async def _extract_expense_from_text(self, text):
+        """Parse text locally, falling back to Gemini when the parser isn't confident.
+        
+        Raises CircuitOpenError when Gemini is unavailable and the parser found nothing.
+        """
+        with self.fast_path_latency.time():
+            expense_data = self.expense_parser.parse(text)
+        if expense_data and expense_data['confidence'] >= Config.FAST_PARSER_MIN_CONFIDENCE:
+            self.fast_path_hits += 1
+            return expense_data
+        
+        try:
+            with self.model_path_latency.time():
+                return await self.gemini_service.extract_expense_from_text(text)
+        except CircuitOpenError:
+            # Gemini is down: accept a weaker local parse, but not an ambiguous one
+            if not expense_data or expense_data['confidence'] < Config.FAST_PARSER_FALLBACK_CONFIDENCE:
+                raise
+            self.breaker_fallbacks += 1
+            return expense_data
+    
+    async def _extract_expenses_from_lines(self, lines):
+        """Parse each line locally and send the rest to Gemini in a single request"""
+        parsed = []
+        for line in lines:
+            with self.fast_path_latency.time():
+                parsed.append(self.expense_parser.parse(line))
+        results = [
+            expense_data if expense_data and expense_data['confidence'] >= Config.FAST_PARSER_MIN_CONFIDENCE else None
+            for expense_data in parsed
+        ]
+        self.fast_path_hits += sum(1 for result in results if result)
+        
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            try:
+                with self.model_path_latency.time():
+                    generated = await self.gemini_service.extract_expenses_from_texts([lines[i] for i in missing])
+            except CircuitOpenError:
+                generated = [
+                    parsed[i] if parsed[i] and parsed[i]['confidence'] >= Config.FAST_PARSER_FALLBACK_CONFIDENCE else None
+                    for i in missing
+                ]
+                self.breaker_fallbacks += sum(1 for result in generated if result)
+            for i, result in zip(missing, generated):
+                results[i] = result
+        return results
+    
+    async def _reply_model_unavailable(self, update):
+        """Tell the user Gemini is unavailable and how to record manually"""
+        await update.message.reply_text(
+            "⚠️ Layanan AI sedang gangguan, jadi pesan ini belum bisa dibaca otomatis.\n\n"
+            "Catat manual dengan:\n"
+            "`/pengeluaran [jumlah] [kategori] [keterangan]`\n"
+            "`/pemasukan [jumlah] [kategori] [keterangan]`",
+            parse_mode='Markdown'
+        )
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command"""
@@ -30,12 +158,16 @@ Saya dapat membantu Anda melacak pengeluaran dan pemasukan dengan berbagai cara:
 💬 *Gunakan perintah teks*:
    • /pengeluaran [jumlah] [kategori] [keterangan]
    • /pemasukan [jumlah] [kategori] [keterangan]
+📝 *Kirim banyak transaksi sekaligus* - Satu transaksi per baris
+📥 *Impor CSV* - Kirim file CSV dengan caption /import
 
 📊 *Lihat rekap*:
    • /rekapharian [tanggal] - Rekap hari tertentu
    • /rekapcustom [rentang tanggal] - Rekap periode custom
    • /rekapbulanan [bulan tahun] - Rekap bulanan
    • /rekaptahunan [tahun] - Rekap tahunan
+   • /sinkronrekap - Bangun ulang rekap chat ini dari Google Sheets
+📤 *Ekspor data*: /ekspor [periode] [csv|xlsx]
 
 Ketik /help untuk panduan lengkap.
         """
@@ -58,6 +190,16 @@ Ketik /help untuk panduan lengkap.
    `/pengeluaran 25000 makanan Makan siang di warteg`
    `/pemasukan 500000 gaji Gaji bulan ini`
 
+4️⃣ *Banyak Transaksi Sekaligus*
+   Satu transaksi per baris dalam satu pesan:
+   `kopi 20rb`
+   `parkir 5rb`
+   `makan siang 35rb`
+
+5️⃣ *Impor CSV*
+   Kirim file CSV dengan caption `/import`
+   Kolom: Tanggal, Tipe, Jumlah, Kategori, Keterangan
+
 *🔸 Cara Melihat Rekap:*
 
 📅 `/rekapharian 12 Agustus 2025` - Rekap tanggal tertentu
@@ -65,6 +207,8 @@ Ketik /help untuk panduan lengkap.
 📊 `/rekapcustom 29 Juli 2025 - 2 Agustus 2025` - Rekap lintas bulan
 📈 `/rekapbulanan Agustus 2025` - Rekap bulan
 📊 `/rekaptahunan 2025` - Rekap tahun
+🔄 `/sinkronrekap` - Periksa dan bangun ulang rekap chat ini dari Google Sheets
+📤 `/ekspor Agustus 2025` - Unduh transaksi sebagai CSV (tambahkan `xlsx` untuk Excel)
 
 *🔸 Format Tanggal yang Didukung:*
 • 12 Agustus 2025
@@ -94,12 +238,14 @@ Semua data akan tersimpan otomatis di Google Sheets Anda! 📊
             description = " ".join(context.args[2:]) if len(context.args) > 2 else ""
             
             # Save to Google Sheets
+            entry_date = self._entry_date(update)
             result = await self.sheets_service.add_expense(
-                date=datetime.now(),
+                date=entry_date,
                 amount=amount,
                 category=category,
                 description=description,
-                type="pengeluaran"
+                type="pengeluaran",
+                chat_id=update.effective_chat.id
             )
             
             if result:
@@ -108,7 +254,7 @@ Semua data akan tersimpan otomatis di Google Sheets Anda! 📊
                     f"💰 Jumlah: Rp {amount:,.0f}\n"
                     f"🏷️ Kategori: {category}\n"
                     f"📝 Keterangan: {description}\n"
-                    f"📅 Tanggal: {datetime.now().strftime('%d %B %Y')}",
+                    f"📅 Tanggal: {entry_date.strftime('%d %B %Y')}",
                     parse_mode='Markdown'
                 )
             else:
@@ -137,12 +283,14 @@ Semua data akan tersimpan otomatis di Google Sheets Anda! 📊
             description = " ".join(context.args[2:]) if len(context.args) > 2 else ""
             
             # Save to Google Sheets
+            entry_date = self._entry_date(update)
             result = await self.sheets_service.add_expense(
-                date=datetime.now(),
+                date=entry_date,
                 amount=amount,
                 category=category,
                 description=description,
-                type="pemasukan"
+                type="pemasukan",
+                chat_id=update.effective_chat.id
             )
             
             if result:
@@ -151,7 +299,7 @@ Semua data akan tersimpan otomatis di Google Sheets Anda! 📊
                     f"💰 Jumlah: Rp {amount:,.0f}\n"
                     f"🏷️ Kategori: {category}\n"
                     f"📝 Keterangan: {description}\n"
-                    f"📅 Tanggal: {datetime.now().strftime('%d %B %Y')}",
+                    f"📅 Tanggal: {entry_date.strftime('%d %B %Y')}",
                     parse_mode='Markdown'
                 )
             else:
@@ -179,7 +327,7 @@ Semua data akan tersimpan otomatis di Google Sheets Anda! 📊
                     )
                     return
             
-            summary = await self.sheets_service.get_daily_summary(date)
+            summary = await self.sheets_service.get_daily_summary(date, chat_id=update.effective_chat.id)
             formatted_summary = self._format_summary(summary, f"Rekap Harian - {self.date_utils.format_indonesian_date(date)}")
             await update.message.reply_text(formatted_summary, parse_mode='Markdown')
             
@@ -213,7 +361,7 @@ Semua data akan tersimpan otomatis di Google Sheets Anda! 📊
                 )
                 return
             
-            summary = await self.sheets_service.get_custom_summary(start_date, end_date)
+            summary = await self.sheets_service.get_custom_summary(start_date, end_date, chat_id=update.effective_chat.id)
             period_str = f"{self.date_utils.format_indonesian_date(start_date)} - {self.date_utils.format_indonesian_date(end_date)}"
             formatted_summary = self._format_summary(summary, f"Rekap Custom - {period_str}")
             await update.message.reply_text(formatted_summary, parse_mode='Markdown')
@@ -238,7 +386,7 @@ Semua data akan tersimpan otomatis di Google Sheets Anda! 📊
                     )
                     return
             
-            summary = await self.sheets_service.get_monthly_summary(date)
+            summary = await self.sheets_service.get_monthly_summary(date, chat_id=update.effective_chat.id)
             formatted_summary = self._format_summary(summary, f"Rekap Bulanan - {self.date_utils.format_month_year(date)}")
             await update.message.reply_text(formatted_summary, parse_mode='Markdown')
             
@@ -262,7 +410,7 @@ Semua data akan tersimpan otomatis di Google Sheets Anda! 📊
                     )
                     return
             
-            summary = await self.sheets_service.get_yearly_summary(year)
+            summary = await self.sheets_service.get_yearly_summary(year, chat_id=update.effective_chat.id)
             formatted_summary = self._format_summary(summary, f"Rekap Tahunan - {year}")
             await update.message.reply_text(formatted_summary, parse_mode='Markdown')
             
@@ -273,10 +421,22 @@ Semua data akan tersimpan otomatis di Google Sheets Anda! 📊
     async def handle_photo(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle photo messages (receipt OCR)"""
         try:
+            if not self.gemini_service.available:
+                await self._reply_model_unavailable(update)
+                return
+            
             await update.message.reply_text("📸 Sedang memproses foto struk...")
             
-            # Get the largest photo
-            photo = update.message.photo[-1]
+            # Smallest size that keeps the receipt legible
+            photo = select_photo_size(update.message.photo)
+            chat_id = update.effective_chat.id
+            
+            # Resent or forwarded photo: answer from the cache without downloading
+            duplicate = self.photo_cache.lookup_file(chat_id, photo.file_unique_id)
+            if duplicate:
+                await self._reply_duplicate_photo(update, duplicate)
+                return
+            
             file = await context.bot.get_file(photo.file_id)
             
             # Download image
@@ -284,26 +444,42 @@ Semua data akan tersimpan otomatis di Google Sheets Anda! 📊
             await file.download_to_memory(image_data)
             image_data.seek(0)
             
+            # Hash and downscale/re-encode in one trip off the event loop; both decode the image
+            started = time.perf_counter()
+            fingerprint, image_bytes, mime_type = await asyncio.to_thread(self._prepare_photo, image_data.getvalue())
+            
             # Process with Gemini Vision
-            expense_data = await self.gemini_service.extract_expense_from_image(image_data.getvalue())
+            expense_data = await self.gemini_service.extract_expense_from_image(image_bytes, mime_type)
+            self.photo_latency.record(time.perf_counter() - started)
+            self.photo_bytes_downloaded += len(image_data.getvalue())
+            self.photo_bytes_uploaded += len(image_bytes)
             
             if expense_data:
+                # Same receipt sent as a different file (re-upload, second angle): the image and the amount match
+                duplicate = self.photo_cache.lookup_image(chat_id, fingerprint, expense_data)
+                if duplicate:
+                    await self._reply_duplicate_photo(update, duplicate)
+                    return
+                
                 # Save to Google Sheets
+                entry_date = self._entry_date(update)
                 result = await self.sheets_service.add_expense(
-                    date=datetime.now(),
+                    date=entry_date,
                     amount=expense_data['amount'],
                     category=expense_data['category'],
                     description=expense_data['description'],
-                    type="pengeluaran"
+                    type="pengeluaran",
+                    chat_id=update.effective_chat.id
                 )
                 
                 if result:
+                    self.photo_cache.add(chat_id, photo.file_unique_id, fingerprint, expense_data)
                     await update.message.reply_text(
                         f"✅ *Pengeluaran dari foto tercatat!*\n\n"
                         f"💰 Jumlah: Rp {expense_data['amount']:,.0f}\n"
                         f"🏷️ Kategori: {expense_data['category']}\n"
                         f"📝 Keterangan: {expense_data['description']}\n"
-                        f"📅 Tanggal: {datetime.now().strftime('%d %B %Y')}",
+                        f"📅 Tanggal: {entry_date.strftime('%d %B %Y')}",
                         parse_mode='Markdown'
                     )
                 else:
@@ -311,10 +487,39 @@ Semua data akan tersimpan otomatis di Google Sheets Anda! 📊
             else:
                 await update.message.reply_text("❌ Tidak dapat membaca informasi pengeluaran dari foto. Pastikan foto struk jelas dan terbaca.")
                 
+        except CircuitOpenError:
+            await self._reply_model_unavailable(update)
         except Exception as e:
             logger.error(f"Error in handle_photo: {e}")
             await update.message.reply_text("❌ Terjadi kesalahan saat memproses foto. Silakan coba lagi.")
     
+    @staticmethod
+    def _entry_date(update):
+        """Local time the message was sent, so replayed and backlogged updates keep their own day"""
+        message = update.effective_message
+        if message is None or message.date is None:
+            return datetime.now()
+        return message.date.astimezone().replace(tzinfo=None)
+    
+    def _prepare_photo(self, image_data):
+        """Perceptual hash plus the bytes and mime type to send for OCR (blocking, CPU-bound)"""
+        image_bytes, mime_type = preprocess_image(image_data)
+        return self.photo_cache.fingerprint(image_data), image_bytes, mime_type
+    
+    async def _reply_duplicate_photo(self, update, duplicate):
+        """Warn that a receipt photo was already recorded instead of saving it again"""
+        expense_data = duplicate['expense']
+        recorded_at = datetime.fromtimestamp(duplicate['recorded_at'])
+        await update.message.reply_text(
+            f"⚠️ *Struk ini sepertinya sudah tercatat*\n\n"
+            f"💰 Jumlah: Rp {expense_data['amount']:,.0f}\n"
+            f"🏷️ Kategori: {expense_data['category']}\n"
+            f"📝 Keterangan: {expense_data['description']}\n"
+            f"🕒 Dicatat: {recorded_at.strftime('%d %B %Y %H:%M')}\n\n"
+            f"Tidak disimpan ulang. Jika memang transaksi berbeda, gunakan `/pengeluaran`.",
+            parse_mode='Markdown'
+        )
+    
     async def handle_voice(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle voice messages"""
         try:
@@ -335,16 +540,18 @@ Semua data akan tersimpan otomatis di Google Sheets Anda! 📊
                 
                 if transcription:
                     # Process transcription to extract expense data
-                    expense_data = await self.gemini_service.extract_expense_from_text(transcription)
+                    expense_data = await self._extract_expense_from_text(transcription)
                     
                     if expense_data:
                         # Save to Google Sheets
+                        entry_date = self._entry_date(update)
                         result = await self.sheets_service.add_expense(
-                            date=datetime.now(),
+                            date=entry_date,
                             amount=expense_data['amount'],
                             category=expense_data['category'],
                             description=expense_data['description'],
-                            type=expense_data['type']
+                            type=expense_data['type'],
+                            chat_id=update.effective_chat.id
                         )
                         
                         if result:
@@ -355,7 +562,7 @@ Semua data akan tersimpan otomatis di Google Sheets Anda! 📊
                                 f"💰 Jumlah: Rp {expense_data['amount']:,.0f}\n"
                                 f"🏷️ Kategori: {expense_data['category']}\n"
                                 f"📝 Keterangan: {expense_data['description']}\n"
-                                f"📅 Tanggal: {datetime.now().strftime('%d %B %Y')}",
+                                f"📅 Tanggal: {entry_date.strftime('%d %B %Y')}",
                                 parse_mode='Markdown'
                             )
                         else:
@@ -373,6 +580,8 @@ Semua data akan tersimpan otomatis di Google Sheets Anda! 📊
                 if os.path.exists(temp_path):
                     os.unlink(temp_path)
                 
+        except CircuitOpenError:
+            await self._reply_model_unavailable(update)
         except Exception as e:
             logger.error(f"Error in handle_voice: {e}")
             await update.message.reply_text("❌ Terjadi kesalahan saat memproses voice note. Silakan coba lagi.")
@@ -382,17 +591,25 @@ Semua data akan tersimpan otomatis di Google Sheets Anda! 📊
         try:
             text = update.message.text
             
+            # Several lines that each have an amount: bulk entry, one transaction per line
+            lines = split_entries(text)
+            if len(lines) > 1 and is_bulk_entry(lines, self.expense_parser):
+                await self._handle_bulk_text(update, lines)
+                return
+            
             # Try to extract expense data from text
-            expense_data = await self.gemini_service.extract_expense_from_text(text)
+            expense_data = await self._extract_expense_from_text(text)
             
             if expense_data:
                 # Save to Google Sheets
+                entry_date = self._entry_date(update)
                 result = await self.sheets_service.add_expense(
-                    date=datetime.now(),
+                    date=entry_date,
                     amount=expense_data['amount'],
                     category=expense_data['category'],
                     description=expense_data['description'],
-                    type=expense_data['type']
+                    type=expense_data['type'],
+                    chat_id=update.effective_chat.id
                 )
                 
                 if result:
@@ -402,7 +619,7 @@ Semua data akan tersimpan otomatis di Google Sheets Anda! 📊
                         f"💰 Jumlah: Rp {expense_data['amount']:,.0f}\n"
                         f"🏷️ Kategori: {expense_data['category']}\n"
                         f"📝 Keterangan: {expense_data['description']}\n"
-                        f"📅 Tanggal: {datetime.now().strftime('%d %B %Y')}",
+                        f"📅 Tanggal: {entry_date.strftime('%d %B %Y')}",
                         parse_mode='Markdown'
                     )
                 else:
@@ -412,54 +629,253 @@ Semua data akan tersimpan otomatis di Google Sheets Anda! 📊
                     "❓ Saya tidak mengerti pesan Anda. Gunakan /help untuk melihat panduan penggunaan."
                 )
                 
+        except CircuitOpenError:
+            await self._reply_model_unavailable(update)
         except Exception as e:
             logger.error(f"Error in handle_text: {e}")
             await update.message.reply_text("❌ Terjadi kesalahan. Silakan coba lagi.")
     
+    async def _handle_bulk_text(self, update, lines):
+        """Record one transaction per line with a single batched write and one confirmation"""
+        if len(lines) > Config.BULK_MAX_LINES:
+            await update.message.reply_text(
+                f"❌ Terlalu banyak baris ({len(lines)}). Maksimal {Config.BULK_MAX_LINES} transaksi per pesan, "
+                f"atau kirim file CSV dengan caption /import."
+            )
+            return
+        
+        results = await self._extract_expenses_from_lines(lines)
+        recorded = [expense_data for expense_data in results if expense_data]
+        unreadable = [line for line, expense_data in zip(lines, results) if not expense_data]
+        if not recorded:
+            await update.message.reply_text(
+                "❓ Tidak ada transaksi yang terbaca. Tulis satu transaksi per baris, misalnya `kopi 20rb`.",
+                parse_mode='Markdown'
+            )
+            return
+        
+        entry_date = self._entry_date(update)
+        result = await self.sheets_service.add_expenses([
+            dict(expense_data, date=entry_date, chat_id=update.effective_chat.id) for expense_data in recorded
+        ])
+        if not result:
+            await update.message.reply_text("❌ Gagal menyimpan data. Silakan coba lagi.")
+            return
+        
+        message = f"✅ *{len(recorded)} transaksi tercatat!*\n\n"
+        for expense_data in recorded:
+            sign = "➖" if expense_data['type'] == "pengeluaran" else "➕"
+            description = escape_markdown(str(expense_data['description']))
+            category = escape_markdown(str(expense_data['category']))
+            message += f"{sign} Rp {expense_data['amount']:,.0f} - {description} \\[{category}]\n"
+        expenses = sum(e['amount'] for e in recorded if e['type'] == "pengeluaran")
+        income = sum(e['amount'] for e in recorded if e['type'] != "pengeluaran")
+        message += f"\n💸 Total pengeluaran: Rp {expenses:,.0f}"
+        if income:
+            message += f"\n💰 Total pemasukan: Rp {income:,.0f}"
+        message += f"\n📅 Tanggal: {entry_date.strftime('%d %B %Y')}"
+        if unreadable:
+            # User text goes into a Markdown reply sent after the rows are saved; it must not break parsing
+            message += f"\n\n⚠️ {len(unreadable)} baris tidak terbaca:\n" + "\n".join(
+                f"• {escape_markdown(line)}" for line in unreadable
+            )
+        await update.message.reply_text(message, parse_mode='Markdown')
+    
+    async def import_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /import command (as a reply to a CSV file)"""
+        reply = update.message.reply_to_message
+        if reply and reply.document:
+            await self._import_csv(update, context, reply.document)
+            return
+        await update.message.reply_text(
+            "📥 *Impor CSV*\n\n"
+            "Kirim file CSV dengan caption `/import`, atau balas file CSV dengan `/import`.\n\n"
+            "Kolom yang dikenali: Tanggal, Tipe, Jumlah, Kategori, Keterangan.\n"
+            "Hanya kolom Jumlah yang wajib.",
+            parse_mode='Markdown'
+        )
+    
+    async def handle_document(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle documents; CSV files captioned /import are imported"""
+        caption = (update.message.caption or '').strip().lower()
+        if caption.startswith('/import'):
+            await self._import_csv(update, context, update.message.document)
+        else:
+            await update.message.reply_text("📥 Untuk mengimpor transaksi, kirim file CSV dengan caption /import.")
+    
+    async def _import_csv(self, update, context, document):
+        """Stream a CSV attachment into the ledger in chunks"""
+        try:
+            if document.file_size and document.file_size > Config.IMPORT_MAX_BYTES:
+                await update.message.reply_text(
+                    f"❌ File terlalu besar. Maksimal {Config.IMPORT_MAX_BYTES // (1024 * 1024)} MB."
+                )
+                return
+            
+            progress = await update.message.reply_text("📥 Sedang mengimpor CSV...")
+            file = await context.bot.get_file(document.file_id)
+            with tempfile.NamedTemporaryFile(suffix='.csv', delete=False) as temp_file:
+                await file.download_to_path(temp_file.name)
+                temp_path = temp_file.name
+            
+            imported = 0
+            errors = []
+            failed = False
+            try:
+                with open(temp_path, encoding='utf-8-sig', newline='') as f:
+                    entries = iter_csv_entries(f, self.expense_parser, self.date_utils, self._entry_date(update))
+                    chunks = chunked(entries, Config.IMPORT_CHUNK_SIZE)
+                    while True:
+                        # Reading and parsing runs off the event loop, one chunk at a time
+                        chunk = await asyncio.to_thread(next, chunks, None)
+                        if chunk is None:
+                            break
+                        entries = [dict(entry, chat_id=update.effective_chat.id) for _, entry, _ in chunk if entry]
+                        errors.extend(f"baris {line_number}: {error}" for line_number, _, error in chunk if error)
+                        if entries and not await self.sheets_service.add_expenses(entries):
+                            failed = True
+                            break
+                        imported += len(entries)
+                        if imported and progress:
+                            await progress.edit_text(f"📥 Sedang mengimpor CSV... {imported:,} transaksi")
+            finally:
+                os.unlink(temp_path)
+            
+            if failed:
+                message = f"❌ *Impor terhenti:* gagal menyimpan data setelah {imported:,} transaksi"
+            else:
+                message = f"✅ *Impor selesai:* {imported:,} transaksi tercatat"
+            if errors:
+                # Error texts quote the CSV; escape them so the Markdown reply can't fail after the import
+                message += f"\n\n⚠️ {len(errors):,} baris dilewati:\n" + "\n".join(
+                    f"• {escape_markdown(error)}" for error in errors[:10]
+                )
+                if len(errors) > 10:
+                    message += f"\n• ... dan {len(errors) - 10:,} lainnya"
+            await update.message.reply_text(message, parse_mode='Markdown')
+            
+        except ValueError as e:
+            await update.message.reply_text(f"❌ {e}")
+        except Exception as e:
+            logger.error(f"Error importing CSV: {e}")
+            await update.message.reply_text("❌ Terjadi kesalahan saat mengimpor CSV. Silakan coba lagi.")
+    
+    async def export_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /ekspor command"""
+        try:
+            args = list(context.args)
+            format = 'csv'
+            if args and args[-1].lower() in ('csv', 'xlsx'):
+                format = args.pop().lower()
+            if format not in EXPORT_FORMATS:
+                await update.message.reply_text("❌ Ekspor XLSX belum tersedia di server ini. Gunakan CSV.")
+                return
+            
+            if args:
+                start_date, end_date = self.date_utils.parse_period(" ".join(args))
+            else:
+                today = datetime.now()
+                start_date, end_date = self.date_utils.parse_period(self.date_utils.format_month_year(today))
+            if not start_date or not end_date:
+                await update.message.reply_text(
+                    "❌ Format rentang tanggal salah!\n\n"
+                    "Contoh yang benar:\n"
+                    "• `/ekspor` - Bulan ini\n"
+                    "• `/ekspor Agustus 2025`\n"
+                    "• `/ekspor 2025 xlsx`\n"
+                    "• `/ekspor 29 Juli 2025 - 2 Agustus 2025`",
+                    parse_mode='Markdown'
+                )
+                return
+            
+            await update.message.reply_text("📤 Sedang menyiapkan file ekspor...")
+            with tempfile.NamedTemporaryFile(suffix=f'.{format}', delete=False) as temp_file:
+                temp_path = temp_file.name
+            try:
+                result = await self.sheets_service.export_records(
+                    start_date, end_date, temp_path, format, chat_id=update.effective_chat.id
+                )
+                if result is None:
+                    await update.message.reply_text("❌ Penyimpanan data belum terhubung, ekspor tidak dapat dibuat.")
+                    return
+                rows, elapsed = result
+                if not rows:
+                    await update.message.reply_text("📭 Tidak ada transaksi pada periode tersebut.")
+                    return
+                if os.path.getsize(temp_path) > Config.EXPORT_MAX_BYTES:
+                    await update.message.reply_text("❌ File ekspor terlalu besar untuk Telegram. Coba rentang yang lebih pendek.")
+                    return
+                
+                filename = f"transaksi_{start_date.strftime('%Y%m%d')}_{end_date.strftime('%Y%m%d')}.{format}"
+                with open(temp_path, 'rb') as f:
+                    await update.message.reply_document(
+                        document=f,
+                        filename=filename,
+                        caption=f"📤 {rows:,} transaksi ({rows / max(elapsed, 1e-9):,.0f} baris/detik)"
+                    )
+            finally:
+                os.unlink(temp_path)
+            
+        except Exception as e:
+            logger.error(f"Error in export_command: {e}")
+            await update.message.reply_text("❌ Terjadi kesalahan saat membuat ekspor. Silakan coba lagi.")
+    
+    async def rebuild_summary_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /sinkronrekap command"""
+        try:
+            await update.message.reply_text("🔄 Sedang memeriksa dan membangun ulang rekap chat ini...")
+            
+            result = await self.sheets_service.rebuild_rollups(update.effective_chat.id)
+            if result is None:
+                await update.message.reply_text("❌ Google Sheets belum terhubung, rekap tidak dapat dibangun ulang.")
+                return
+            if not result['rebuilt']:
+                await update.message.reply_text(
+                    f"ℹ️ Rekap dihitung langsung dari {result['rows']:,} baris data chat ini di database lokal "
+                    f"setiap kali diminta, jadi tidak ada rekap yang perlu dibangun ulang."
+                )
+                return
+            
+            if result['mismatches']:
+                status = f"⚠️ Ditemukan {len(result['mismatches'])} selisih pada rekap chat ini sebelumnya."
+            else:
+                status = "✅ Rekap chat ini sebelumnya sudah konsisten."
+            await update.message.reply_text(
+                f"{status}\n\n📊 Rekap dibangun ulang dari {result['rows']:,} baris data chat ini."
+            )
+            
+        except Exception as e:
+            logger.error(f"Error in rebuild_summary_command: {e}")
+            await update.message.reply_text("❌ Terjadi kesalahan saat membangun ulang rekap. Silakan coba lagi.")
+    
     def _format_summary(self, summary, title):
         """Format summary data for display"""
-        if not summary or (not summary.get('expenses') and not summary.get('income')):
+        totals = self._summary_totals(summary)
+        income_by_category = totals.get('pemasukan', {})
+        expenses_by_category = totals.get('pengeluaran', {})
+        
+        if not income_by_category and not expenses_by_category:
             return f"📊 *{title}*\n\n❌ Tidak ada data untuk periode ini."
         
         message = f"📊 *{title}*\n\n"
+        total_income = sum(income_by_category.values())
+        total_expenses = sum(expenses_by_category.values())
         
         # Income summary
-        if summary.get('income'):
-            total_income = sum(item['amount'] for item in summary['income'])
+        if income_by_category:
             message += f"💰 *Total Pemasukan: Rp {total_income:,.0f}*\n"
-            
-            # Group by category
-            income_by_category = {}
-            for item in summary['income']:
-                category = item['category']
-                if category not in income_by_category:
-                    income_by_category[category] = 0
-                income_by_category[category] += item['amount']
-            
             for category, amount in income_by_category.items():
                 message += f"  • {category}: Rp {amount:,.0f}\n"
             message += "\n"
         
         # Expense summary
-        if summary.get('expenses'):
-            total_expenses = sum(item['amount'] for item in summary['expenses'])
+        if expenses_by_category:
             message += f"💸 *Total Pengeluaran: Rp {total_expenses:,.0f}*\n"
-            
-            # Group by category
-            expenses_by_category = {}
-            for item in summary['expenses']:
-                category = item['category']
-                if category not in expenses_by_category:
-                    expenses_by_category[category] = 0
-                expenses_by_category[category] += item['amount']
-            
             for category, amount in expenses_by_category.items():
                 message += f"  • {category}: Rp {amount:,.0f}\n"
             message += "\n"
         
         # Net summary
-        total_income = sum(item['amount'] for item in summary.get('income', []))
-        total_expenses = sum(item['amount'] for item in summary.get('expenses', []))
         net = total_income - total_expenses
         
         if net > 0:
@@ -470,3 +886,17 @@ Semua data akan tersimpan otomatis di Google Sheets Anda! 📊
             message += f"⚖️ *Saldo Bersih: Rp 0*"
         
         return message
+    
+    def _summary_totals(self, summary):
+        """Return {type: {category: total}}, using pre-aggregated totals when present"""
+        if not summary:
+            return {}
+        if 'totals' in summary:
+            return summary['totals']
+        
+        totals = {}
+        for type, key in (('pemasukan', 'income'), ('pengeluaran', 'expenses')):
+            for item in summary.get(key, []):
+                by_category = totals.setdefault(type, {})
+                by_category[item['category']] = by_category.get(item['category'], 0) + item['amount']
+        return totals
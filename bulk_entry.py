@@ -0,0 +1,128 @@
+import csv
+import re
+from datetime import datetime
+from date_utils import DateUtils
+from expense_parser import ExpenseParser
+
+# CSV header names accepted by /import, mapped to add_expenses fields
+CSV_COLUMNS = {
+    'tanggal': 'date', 'date': 'date',
+    'tipe': 'type', 'type': 'type',
+    'jumlah': 'amount', 'amount': 'amount', 'nominal': 'amount',
+    'kategori': 'category', 'category': 'category',
+    'keterangan': 'description', 'description': 'description', 'deskripsi': 'description',
+}
+CSV_DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%Y/%m/%d')
+INCOME_TYPES = {'pemasukan', 'income', 'masuk'}
+
+_list_marker = re.compile(r'^\s*(?:[-*•]|\d{1,3}[.)])\s+')
+
+
+def split_entries(text):
+    """Split a pasted list into one transaction per non-empty line, dropping bullets/numbering"""
+    lines = []
+    for line in text.splitlines():
+        line = _list_marker.sub('', line).strip()
+        if line:
+            lines.append(line)
+    return lines
+
+
+def is_bulk_entry(lines, parser=None):
+    """True when at least two lines carry an amount of their own.
+
+    "Beli makan siang\n25 ribu" is one transaction written over two lines, so
+    it must go down the single-entry path as a whole.
+    """
+    parser = parser or ExpenseParser()
+    with_amount = 0
+    for line in lines:
+        if parser.parse(line):
+            with_amount += 1
+            if with_amount >= 2:
+                return True
+    return False
+
+
+def iter_csv_entries(lines, parser=None, date_utils=None, default_date=None):
+    """Yield (line_number, entry, error) for each data row of a CSV stream.
+
+    ``entry`` is a dict ready for SheetsService.add_expenses, or None with an
+    error message for rows that cannot be imported. Rows are read lazily, so
+    large files never have to be held in memory.
+    """
+    parser = parser or ExpenseParser()
+    date_utils = date_utils or DateUtils()
+    default_date = default_date or datetime.now()
+
+    reader = csv.reader(lines, _sniff_dialect(lines))
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = {}
+    for i, name in enumerate(header):
+        field = CSV_COLUMNS.get(name.strip().lower())
+        if field and field not in columns:
+            columns[field] = i
+    if 'amount' not in columns:
+        raise ValueError("Kolom 'Jumlah' tidak ditemukan di baris header")
+
+    for values in reader:
+        line_number = reader.line_num
+        if not any(value.strip() for value in values):
+            continue
+        row = {field: values[i].strip() if i < len(values) else '' for field, i in columns.items()}
+
+        amount = parser.parse_amount(row['amount'])
+        if not amount:
+            yield line_number, None, f"jumlah tidak valid: {row['amount']!r}"
+            continue
+
+        date = default_date
+        if row.get('date'):
+            date = _parse_date(row['date'], date_utils)
+            if date is None:
+                yield line_number, None, f"tanggal tidak valid: {row['date']!r}"
+                continue
+
+        yield line_number, {
+            'date': date,
+            'type': 'pemasukan' if row.get('type', '').lower() in INCOME_TYPES else 'pengeluaran',
+            'amount': float(amount),
+            'category': row.get('category', '').lower() or 'lainnya',
+            'description': row.get('description', '') or 'Impor CSV',
+        }, None
+
+
+def chunked(items, size):
+    """Yield lists of up to ``size`` items from any iterable"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _sniff_dialect(lines):
+    # Spreadsheet exports in Indonesian locales often use ';' as separator
+    if hasattr(lines, 'seek'):
+        sample = lines.read(4096)
+        lines.seek(0)
+        try:
+            return csv.Sniffer().sniff(sample, delimiters=',;\t')
+        except csv.Error:
+            pass
+    return csv.excel
+
+
+def _parse_date(value, date_utils):
+    value = value.strip()
+    for date_format in CSV_DATE_FORMATS:
+        try:
+            return datetime.strptime(value[:10], date_format)
+        except ValueError:
+            continue
+    return date_utils.parse_indonesian_date(value)
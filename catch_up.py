@@ -0,0 +1,229 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from telegram import Update
+from telegram.request import BaseRequest
+
+logger = logging.getLogger(__name__)
+
+def needs_file_download(update):
+    """Whether handling the update downloads a photo, voice note or document from Telegram"""
+    message = update.effective_message
+    if message is None:
+        return False
+    if message.photo or message.voice or message.document:
+        return True
+    # /import sent as a reply to a CSV file
+    reply = message.reply_to_message
+    return bool(reply and reply.document and (message.text or '').startswith('/import'))
+
+
+class UpdateCheckpoint:
+    """Append-only file of handled update_ids, so a rerun never handles an update twice"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._ids = set()
+        self._file = None
+        if path:
+            if os.path.exists(path):
+                with open(path) as f:
+                    self._ids = {int(line) for line in f if line.strip()}
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(path, 'a')
+
+    def __contains__(self, update_id):
+        return update_id in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, update_id):
+        self._ids.add(update_id)
+        if self._file:
+            self._file.write(f"{update_id}\n")
+            self._file.flush()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+class UpdateDump:
+    """JSON-lines file of raw updates, written before Telegram is allowed to forget them"""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def read(self):
+        """Yield saved update dicts in the order they were fetched"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def append(self, updates):
+        """Persist a page of updates (blocking; fsynced so a crash cannot lose it)"""
+        with open(self.path, 'a') as f:
+            for update in updates:
+                f.write(json.dumps(update, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class OfflineRequest(BaseRequest):
+    """Bot API stand-in for replaying a dump without Telegram: answers getMe and swallows replies.
+
+    There are no files to download, so ``getFile`` fails instead of pretending to succeed.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        self.calls += 1
+        if url.endswith('/getFile'):
+            return 400, json.dumps({'ok': False, 'error_code': 400,
+                                    'description': 'Bad Request: file downloads are not available offline'}).encode()
+        return 200, json.dumps({'ok': True, 'result': self.respond(url.rsplit('/', 1)[-1],
+                                                                   request_data.parameters if request_data else {})}).encode()
+
+    def respond(self, endpoint, params):
+        if endpoint == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Offline', 'username': 'offline_bot'}
+        if endpoint in ('sendMessage', 'editMessageText'):
+            return {'message_id': self.calls, 'date': int(time.time()), 'text': params.get('text', ''),
+                    'chat': {'id': params.get('chat_id', 0), 'type': 'private'}}
+        if endpoint == 'getUpdates':
+            return []
+        return True
+
+
+class CatchUp:
+    """Work through a backlog of updates with the dispatcher's bounded worker pool.
+
+    Updates left in the dump by an interrupted run are replayed first. Then, unless
+    ``fetch`` is off, ``getUpdates`` is paged until Telegram has nothing left. Every
+    page is written to the dump before the next call moves the offset past it, so a
+    crash never loses a confirmed update. Each handled update_id goes into the
+    checkpoint, and updates already in it are skipped, so a rerun is idempotent.
+    The dispatcher keeps each chat's updates in order while chats run in parallel.
+
+    With ``skip_files`` (offline replays), updates that would download a file are
+    left out and kept out of the checkpoint, so a later online run handles them;
+    their ids are collected in ``skipped_files``.
+    """
+
+    def __init__(self, dispatcher, checkpoint, dump, page_size=100, progress_interval=1.0, report=print,
+                 skip_files=False):
+        self.dispatcher = dispatcher
+        self.checkpoint = checkpoint
+        self.dump = dump
+        self.page_size = page_size
+        self.progress_interval = progress_interval
+        self.report = report
+        self.skip_files = skip_files
+        self.skipped_files = []
+        self._seen = set()
+        self._progress = None
+        self.started_at = None
+        self.fetched = 0
+        self.replayed = 0
+        self.skipped = 0
+        self.submitted = 0
+        self.handled = 0
+
+    async def run(self, fetch=True):
+        """Process the backlog and wait for every submitted update to finish (dispatcher loop)"""
+        self._progress = asyncio.Event()
+        self.started_at = time.perf_counter()
+        reporter = asyncio.create_task(self._report_progress())
+        bot = self.dispatcher.application.bot
+        try:
+            for data in await asyncio.to_thread(list, self.dump.read()):
+                self.replayed += 1
+                await self._submit(Update.de_json(data, bot))
+            if fetch:
+                await self._fetch(bot)
+            await self.dispatcher.join()
+        finally:
+            reporter.cancel()
+        self.report(self._progress_line() + " - done")
+        return self.handled
+
+    async def _fetch(self, bot):
+        offset = None
+        while True:
+            # The offset of this call confirms the previous page, which is already in the dump
+            updates = await bot.get_updates(
+                offset=offset, limit=self.page_size, timeout=0, allowed_updates=Update.ALL_TYPES
+            )
+            if not updates:
+                return
+            self.fetched += len(updates)
+            fresh = [update for update in updates if update.update_id not in self._seen]
+            await asyncio.to_thread(self.dump.append, [update.to_dict() for update in fresh])
+            for update in fresh:
+                await self._submit(update)
+            offset = updates[-1].update_id + 1
+
+    async def _submit(self, update):
+        if update.update_id in self._seen:
+            return
+        self._seen.add(update.update_id)
+        if update.update_id in self.checkpoint:
+            self.skipped += 1
+            return
+        if self.skip_files and needs_file_download(update):
+            self.skipped_files.append(update.update_id)
+            return
+        # The dispatcher queue is bounded; wait for room instead of dropping (and without
+        # bumping its rejected/rate_limited counters on every retry)
+        while not (self.dispatcher.has_room(update) and self.dispatcher.submit(update, on_done=self._handled)):
+            if not self.dispatcher.running:
+                raise RuntimeError("Update dispatcher stopped during catch-up")
+            self._progress.clear()
+            try:
+                await asyncio.wait_for(self._progress.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+        self.submitted += 1
+
+    def _handled(self, update):
+        self.checkpoint.add(update.update_id)
+        self.handled += 1
+        self._progress.set()
+
+    async def _report_progress(self):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            self.report(self._progress_line())
+
+    def _progress_line(self):
+        elapsed = time.perf_counter() - self.started_at
+        rate = self.handled / elapsed if elapsed else 0.0
+        line = (f"fetched {self.fetched}, replayed {self.replayed}, skipped {self.skipped}, "
+                f"handled {self.handled}/{self.submitted} ({rate:.0f}/s, {elapsed:.1f}s)")
+        if self.skip_files:
+            line += f", needing files {len(self.skipped_files)}"
+        return line
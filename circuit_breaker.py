@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import deque
+from config import Config
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit is open"""
+
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker over a rolling window of call outcomes.
+
+    A call fails if it raised or took longer than ``slow_call_threshold``
+    seconds. Once the window holds ``min_calls`` outcomes and the failure rate
+    reaches ``failure_rate``, the circuit opens and ``allow`` refuses calls. After
+    ``reset_timeout`` seconds it goes half-open and lets one probe through at a
+    time: a success closes it again, a failure reopens it.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_rate=None, slow_call_threshold=None, window=None,
+                 min_calls=None, reset_timeout=None):
+        self.name = name
+        self.failure_rate = failure_rate or Config.BREAKER_FAILURE_RATE
+        self.slow_call_threshold = slow_call_threshold or Config.BREAKER_SLOW_CALL_SECONDS
+        self.min_calls = min_calls or Config.BREAKER_MIN_CALLS
+        self.reset_timeout = reset_timeout or Config.BREAKER_RESET_TIMEOUT
+        self._outcomes = deque(maxlen=window or Config.BREAKER_WINDOW)
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._opened_at = None
+        self._probe_in_flight = False
+        self.successes = 0
+        self.failures = 0
+        self.slow_calls = 0
+        self.rejected = 0
+        self.times_opened = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def allow(self):
+        """Return True if a call may proceed; half-open admits a single probe"""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self, elapsed):
+        """Record a completed call; slow calls count as failures"""
+        if elapsed > self.slow_call_threshold:
+            with self._lock:
+                self.slow_calls += 1
+            self.record_failure()
+            return
+        with self._lock:
+            self.successes += 1
+            if self._state == self.HALF_OPEN:
+                self._state = self.CLOSED
+                self._outcomes.clear()
+                self._probe_in_flight = False
+            self._outcomes.append(True)
+
+    def record_failure(self):
+        """Record a failed call, opening the circuit past the threshold"""
+        with self._lock:
+            self.failures += 1
+            if self._state == self.HALF_OPEN:
+                self._open()
+                return
+            self._outcomes.append(False)
+            if len(self._outcomes) >= self.min_calls:
+                failed = self._outcomes.count(False)
+                if failed / len(self._outcomes) >= self.failure_rate:
+                    self._open()
+
+    def record_cancelled(self):
+        """Forget a call cancelled by its caller, freeing the half-open probe slot"""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._probe_in_flight = False
+
+    def get_metrics(self):
+        """Return state, window failure rate and counters"""
+        with self._lock:
+            self._maybe_half_open()
+            window = len(self._outcomes)
+            return {
+                'state': self._state,
+                'window_calls': window,
+                'window_failure_rate': round(self._outcomes.count(False) / window, 3) if window else 0.0,
+                'opened_seconds_ago': round(time.monotonic() - self._opened_at, 1) if self._opened_at else None,
+                'times_opened': self.times_opened,
+                'successes': self.successes,
+                'failures': self.failures,
+                'slow_calls': self.slow_calls,
+                'rejected': self.rejected,
+            }
+
+    def _open(self):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+        self._outcomes.clear()
+        self.times_opened += 1
+
+    def _maybe_half_open(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
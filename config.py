@@ -10,15 +10,103 @@ class Config:
     
     # Gemini AI Configuration
     GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', '')
+    # Local parser results below this confidence are sent to Gemini instead
+    FAST_PARSER_MIN_CONFIDENCE = float(os.getenv('FAST_PARSER_MIN_CONFIDENCE', '0.75'))
+    # Lower bar used while the Gemini circuit breaker is open
+    FAST_PARSER_FALLBACK_CONFIDENCE = float(os.getenv('FAST_PARSER_FALLBACK_CONFIDENCE', '0.5'))
+    # In-flight model request cap and per-request deadlines (seconds)
+    GEMINI_MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', '8'))
+    GEMINI_TIMEOUT = float(os.getenv('GEMINI_TIMEOUT', '20'))
+    GEMINI_IMAGE_TIMEOUT = float(os.getenv('GEMINI_IMAGE_TIMEOUT', '45'))
+    # Circuit breaker: open when this share of the last BREAKER_WINDOW calls failed or
+    # took longer than BREAKER_SLOW_CALL_SECONDS, probe again after BREAKER_RESET_TIMEOUT
+    BREAKER_FAILURE_RATE = float(os.getenv('BREAKER_FAILURE_RATE', '0.5'))
+    BREAKER_SLOW_CALL_SECONDS = float(os.getenv('BREAKER_SLOW_CALL_SECONDS', '15'))
+    BREAKER_WINDOW = int(os.getenv('BREAKER_WINDOW', '20'))
+    BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', '5'))
+    BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', '30'))
+    # Micro-batching: text extractions arriving within the window share one request
+    GEMINI_BATCH_ENABLED = os.getenv('GEMINI_BATCH_ENABLED', 'false').lower() == 'true'
+    GEMINI_BATCH_WINDOW = float(os.getenv('GEMINI_BATCH_WINDOW', '0.03'))
+    GEMINI_BATCH_MAX = int(os.getenv('GEMINI_BATCH_MAX', '16'))
+    GEMINI_CACHE_MAX_ENTRIES = int(os.getenv('GEMINI_CACHE_MAX_ENTRIES', '5000'))
+    GEMINI_CACHE_MAX_BYTES = int(os.getenv('GEMINI_CACHE_MAX_BYTES', '2000000'))
+    GEMINI_CACHE_TTL = float(os.getenv('GEMINI_CACHE_TTL', '604800'))
+    GEMINI_CACHE_PATH = os.getenv('GEMINI_CACHE_PATH', 'data/gemini_text_cache.json')
+    PHOTO_CACHE_MAX_ENTRIES = int(os.getenv('PHOTO_CACHE_MAX_ENTRIES', '500'))
+    PHOTO_CACHE_TTL = float(os.getenv('PHOTO_CACHE_TTL', '604800'))
+    PHOTO_HASH_DISTANCE = int(os.getenv('PHOTO_HASH_DISTANCE', '6'))
+    
+    # Receipt image preprocessing before vision OCR
+    RECEIPT_MIN_SIDE = int(os.getenv('RECEIPT_MIN_SIDE', '720'))
+    RECEIPT_MAX_SIDE = int(os.getenv('RECEIPT_MAX_SIDE', '1600'))
+    RECEIPT_GRAYSCALE = os.getenv('RECEIPT_GRAYSCALE', 'true').lower() == 'true'
+    RECEIPT_AUTOCROP = os.getenv('RECEIPT_AUTOCROP', 'false').lower() == 'true'
+    RECEIPT_JPEG_QUALITY = int(os.getenv('RECEIPT_JPEG_QUALITY', '80'))
+    
+    # Bulk entry (one transaction per line), /import CSV and /ekspor
+    BULK_MAX_LINES = int(os.getenv('BULK_MAX_LINES', '50'))
+    IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', '500'))
+    IMPORT_MAX_BYTES = int(os.getenv('IMPORT_MAX_BYTES', str(20 * 1024 * 1024)))
+    EXPORT_TIMEOUT = float(os.getenv('EXPORT_TIMEOUT', '300'))
+    EXPORT_MAX_BYTES = int(os.getenv('EXPORT_MAX_BYTES', str(50 * 1024 * 1024)))
     
     # Google Sheets Configuration
     GOOGLE_SHEETS_CREDENTIALS = os.getenv('GOOGLE_SHEETS_CREDENTIALS', '')
     GOOGLE_SHEETS_NAME = os.getenv('GOOGLE_SHEETS_NAME', 'Expense Tracker')
+    LEDGER_CACHE_TTL = float(os.getenv('LEDGER_CACHE_TTL', '30'))
+    LEDGER_FULL_RELOAD_INTERVAL = float(os.getenv('LEDGER_FULL_RELOAD_INTERVAL', '600'))
+    SHEETS_MAX_WORKERS = int(os.getenv('SHEETS_MAX_WORKERS', '8'))
+    SHEETS_TIMEOUT = float(os.getenv('SHEETS_TIMEOUT', '20'))
+    SHEETS_BATCH_SIZE = int(os.getenv('SHEETS_BATCH_SIZE', '50'))
+    SHEETS_BATCH_DELAY = float(os.getenv('SHEETS_BATCH_DELAY', '2'))
+    SHEETS_RETRY_BASE = float(os.getenv('SHEETS_RETRY_BASE', '2'))
+    SHEETS_RETRY_MAX = float(os.getenv('SHEETS_RETRY_MAX', '300'))
+    JOURNAL_PATH = os.getenv('JOURNAL_PATH', 'data/ledger_journal.db')
+    
+    # Storage Backend Configuration ('sheets' or 'sqlite')
+    STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'sheets').lower()
+    SQLITE_PATH = os.getenv('SQLITE_PATH', 'data/ledger.db')
+    SHEETS_MIRROR = os.getenv('SHEETS_MIRROR', 'True').lower() == 'true'
+    # Rows recorded before per-chat ledgers belong to this chat (see migrate_tenants.py)
+    LEGACY_CHAT_ID = os.getenv('LEGACY_CHAT_ID', '')
     
     # Flask Configuration
     SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-here')
     DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
     
+    # Webhook Dispatcher Configuration
+    WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '8'))
+    WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '256'))
+    # Telegram retries webhook deliveries; remember dispatched update_ids for this many
+    # seconds / entries (0 disables), optionally in a file so restarts keep them
+    UPDATE_DEDUP_WINDOW = float(os.getenv('UPDATE_DEDUP_WINDOW', '3600'))
+    UPDATE_DEDUP_MAX_ENTRIES = int(os.getenv('UPDATE_DEDUP_MAX_ENTRIES', '50000'))
+    UPDATE_DEDUP_PATH = os.getenv('UPDATE_DEDUP_PATH', '')
+    # Must match the secret_token given to setWebhook; empty accepts any request
+    WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN', '')
+    # Share of webhook updates logged as one summary line; debug logs every full payload
+    WEBHOOK_LOG_SAMPLE_RATE = float(os.getenv('WEBHOOK_LOG_SAMPLE_RATE', '0.01'))
+    WEBHOOK_LOG_PAYLOADS = os.getenv('WEBHOOK_LOG_PAYLOADS', 'false').lower() == 'true'
+    # Workers reserved for commands, so they never wait behind OCR jobs
+    WEBHOOK_FAST_WORKERS = int(os.getenv('WEBHOOK_FAST_WORKERS', '2'))
+    # Per-chat token bucket (updates per second, burst) for the slow and fast lanes; rate 0 disables
+    RATE_LIMIT_RATE = float(os.getenv('RATE_LIMIT_RATE', '0.5'))
+    RATE_LIMIT_BURST = int(os.getenv('RATE_LIMIT_BURST', '5'))
+    RATE_LIMIT_FAST_RATE = float(os.getenv('RATE_LIMIT_FAST_RATE', '2'))
+    RATE_LIMIT_FAST_BURST = int(os.getenv('RATE_LIMIT_FAST_BURST', '10'))
+    RATE_LIMIT_MAX_PENDING = int(os.getenv('RATE_LIMIT_MAX_PENDING', '50'))
+    
+    # Long polling (test_bot.py): getUpdates batch size and long-poll seconds, cap on
+    # fetched-but-unhandled updates, and how long SIGTERM waits for in-flight work
+    POLLING_BATCH_SIZE = int(os.getenv('POLLING_BATCH_SIZE', '100'))
+    POLLING_TIMEOUT = int(os.getenv('POLLING_TIMEOUT', '30'))
+    POLLING_MAX_IN_FLIGHT = int(os.getenv('POLLING_MAX_IN_FLIGHT', '1000'))
+    POLLING_DRAIN_TIMEOUT = float(os.getenv('POLLING_DRAIN_TIMEOUT', '30'))
+    # Backlog catch-up (manual_process.py): handled update_ids and the saved update dump
+    CATCH_UP_CHECKPOINT = os.getenv('CATCH_UP_CHECKPOINT', 'data/processed_updates.txt')
+    CATCH_UP_DUMP = os.getenv('CATCH_UP_DUMP', 'data/pending_updates.jsonl')
+    
     @classmethod
     def validate_config(cls):
         """Validate that all required configuration is present"""
@@ -113,6 +113,27 @@ class DateUtils:
             logger.error(f"Error parsing month year '{date_str}': {e}")
             return None
     
+    def parse_period(self, date_str):
+        """Parse any supported period (range, date, month or year) into a (start, end) pair"""
+        start_date, end_date = self.parse_date_range(date_str)
+        if start_date and end_date:
+            return start_date, end_date
+        
+        date = self.parse_indonesian_date(date_str)
+        if date:
+            return date, date
+        
+        month = self.parse_month_year(date_str)
+        if month:
+            next_month = (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+            return month, next_month - timedelta(days=1)
+        
+        if re.fullmatch(r'\d{4}', date_str.strip()):
+            year = int(date_str)
+            return datetime(year, 1, 1), datetime(year, 12, 31)
+        
+        return None, None
+    
     def format_indonesian_date(self, date):
         """Format datetime to Indonesian date string"""
         try:
@@ -0,0 +1,340 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from telegram import Update
+from config import Config
+from fair_scheduler import FairScheduler
+from metrics import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+FAST_LANE = 'fast'
+SLOW_LANE = 'slow'
+# Commands that read or write the whole ledger; everything else that is a command is cheap
+SLOW_COMMANDS = {'import', 'ekspor', 'sinkronrekap'}
+# Raw update keys that carry a message, in the order Update.effective_message checks them
+MESSAGE_KEYS = ('message', 'edited_message', 'channel_post', 'edited_channel_post',
+                'business_message', 'edited_business_message')
+
+
+def _lane_for(text, has_media):
+    """Lane rule shared by Update objects and raw update dicts"""
+    if has_media:
+        return SLOW_LANE
+    text = text or ''
+    if text.startswith('/'):
+        command = text[1:].split(maxsplit=1)[0].split('@')[0].lower() if len(text) > 1 else ''
+        return SLOW_LANE if command in SLOW_COMMANDS else FAST_LANE
+    return SLOW_LANE
+
+
+def update_lane(update):
+    """Commands go to the fast lane; photos, voice, documents and free text may hit Gemini"""
+    message = update.effective_message
+    if message is None:
+        return FAST_LANE
+    return _lane_for(message.text, bool(message.photo or message.voice or message.document))
+
+
+def update_chat_id(update):
+    chat = update.effective_chat
+    return chat.id if chat else None
+
+
+def payload_type(data):
+    """The kind of a raw update dict, e.g. ``message`` or ``callback_query``"""
+    return next((key for key in data if key != 'update_id'), None)
+
+
+def payload_message(data):
+    """The message of a raw update dict, without building telegram objects"""
+    for key in MESSAGE_KEYS:
+        if key in data:
+            return data[key]
+    callback_query = data.get('callback_query')
+    if callback_query:
+        return callback_query.get('message')
+    return None
+
+
+def payload_lane(data):
+    """``update_lane`` for a raw update dict"""
+    message = payload_message(data)
+    if message is None:
+        return FAST_LANE
+    return _lane_for(message.get('text'),
+                     bool(message.get('photo') or message.get('voice') or message.get('document')))
+
+
+def payload_chat_id(data):
+    """``update_chat_id`` for a raw update dict"""
+    message = payload_message(data)
+    if message is None:
+        # chat_member, chat_join_request, message_reaction, chat_boost, ...
+        message = data.get(payload_type(data))
+    chat = message.get('chat') if isinstance(message, dict) else None
+    return chat.get('id') if chat else None
+
+
+class UpdateDispatcher:
+    """Feed Telegram updates to a bot application running on one long-lived event loop.
+
+    The webhook thread only enqueues; worker coroutines on the dispatcher loop call
+    ``application.process_update``. Updates are split into a fast lane (commands)
+    and a slow lane (OCR, voice, free text, import/export), each with its own
+    workers, so a queue of receipts never delays ``/help``. Within a lane chats are
+    served round-robin and throttled by a per-chat token bucket. Updates from one
+    chat run strictly one at a time in arrival order, across both lanes, so a
+    summary always sees the expense sent before it; different chats still run in
+    parallel. The queue is
+    bounded overall and per chat so a burst is rejected early instead of piling up
+    unbounded work.
+    """
+
+    def __init__(self, application, workers=None, queue_size=None, fast_workers=None,
+                 rate_limits=None, max_pending_per_chat=None):
+        self.application = application
+        self.workers = workers or Config.WEBHOOK_WORKERS
+        self.fast_workers = fast_workers or Config.WEBHOOK_FAST_WORKERS
+        self.queue_size = queue_size or Config.WEBHOOK_QUEUE_SIZE
+        self.max_pending_per_chat = max_pending_per_chat or Config.RATE_LIMIT_MAX_PENDING
+        self.rate_limits = rate_limits or {
+            FAST_LANE: (Config.RATE_LIMIT_FAST_RATE, Config.RATE_LIMIT_FAST_BURST),
+            SLOW_LANE: (Config.RATE_LIMIT_RATE, Config.RATE_LIMIT_BURST),
+        }
+        self.loop = None
+        self._lanes = {}
+        self._pending = {}
+        self._chat_order = {}
+        self._sequence = 0
+        self._thread = None
+        self._worker_tasks = []
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._running = False
+        self._depth = 0
+        self._in_flight = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.rate_limited = 0
+        self.failed = 0
+        self.queue_wait = LatencyStats()
+        self.latency = LatencyStats()
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self, timeout=30):
+        """Start the dispatcher thread and wait until the application is initialized"""
+        if self._running:
+            return
+        self._ready.clear()
+        self._thread = threading.Thread(target=self._run_loop, name="update-dispatcher", daemon=True)
+        self._thread.start()
+        if not self._ready.wait(timeout):
+            raise RuntimeError("Update dispatcher did not start in time")
+        if not self._running:
+            raise RuntimeError("Update dispatcher failed to start")
+        logger.info(
+            f"Update dispatcher started with {self.workers} slow / {self.fast_workers} fast workers, "
+            f"queue size {self.queue_size}"
+        )
+
+    def stop(self, timeout=30):
+        """Drain queued updates, shut the application down and stop the loop"""
+        if not self._running:
+            return
+        future = asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop)
+        try:
+            future.result(timeout)
+        except Exception as e:
+            logger.error(f"Error stopping update dispatcher: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        logger.info("Update dispatcher stopped")
+
+    def drain(self):
+        """Lift per-chat throttling so queued updates finish as fast as the workers allow"""
+        if self._running:
+            for scheduler in self._lanes.values():
+                self.loop.call_soon_threadsafe(scheduler.drain)
+
+    def resume_throttling(self):
+        """Undo ``drain``: throttle each chat by its token bucket again"""
+        if self._running:
+            for scheduler in self._lanes.values():
+                self.loop.call_soon_threadsafe(scheduler.resume)
+
+    def has_room(self, update):
+        """True if ``submit`` would accept the update now; unlike ``submit`` it counts nothing"""
+        _, key = self._route(update)
+        with self._lock:
+            return (self._running and self._depth < self.queue_size
+                    and self._pending.get(key, 0) < self.max_pending_per_chat)
+
+    def submit(self, update, on_done=None):
+        """Enqueue an update from any thread; returns False when the queue or the chat's share is full.
+        
+        ``update`` may also be the raw dict from Telegram; it is then routed by its
+        fields and only turned into an ``Update`` by the worker that handles it.
+        ``on_done(update)`` is called on the dispatcher loop once the update has been handled.
+        """
+        lane, key = self._route(update)
+        with self._lock:
+            if not self._running:
+                return False
+            if self._depth >= self.queue_size:
+                self.rejected += 1
+                return False
+            if self._pending.get(key, 0) >= self.max_pending_per_chat:
+                self.rate_limited += 1
+                return False
+            self._pending[key] = self._pending.get(key, 0) + 1
+            self._depth += 1
+            self.accepted += 1
+            sequence = self._sequence
+            self._sequence += 1
+            if key[1] is not None:
+                self._chat_order.setdefault(key[1], deque()).append(sequence)
+            # Scheduled under the lock so the loop sees each chat's updates in sequence order
+            self.loop.call_soon_threadsafe(
+                self._lanes[lane].put, key[1], (update, time.perf_counter(), sequence, on_done)
+            )
+        return True
+
+    @staticmethod
+    def _route(update):
+        """(lane, (lane, chat_id)) for an Update or a raw update dict"""
+        if isinstance(update, dict):
+            lane = payload_lane(update)
+            return lane, (lane, payload_chat_id(update))
+        lane = update_lane(update)
+        return lane, (lane, update_chat_id(update))
+
+    def get_metrics(self):
+        """Return queue depth, counters and latency percentiles"""
+        with self._lock:
+            return {
+                'running': self._running,
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'queue_depth': self._depth,
+                'in_flight': self._in_flight,
+                'active_chats': len(self._chat_order),
+                'accepted': self.accepted,
+                'rejected': self.rejected,
+                'rate_limited': self.rate_limited,
+                'failed': self.failed,
+                'queue_wait': self.queue_wait.snapshot(),
+                'latency': self.latency.snapshot(),
+                'lanes': {
+                    lane: {
+                        'workers': self.fast_workers if lane == FAST_LANE else self.workers,
+                        'rate': scheduler.rate,
+                        'burst': scheduler.burst,
+                        **scheduler.get_metrics(),
+                    }
+                    for lane, scheduler in self._lanes.items()
+                },
+            }
+
+    def _run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._startup())
+        except Exception as e:
+            logger.error(f"Error initializing bot application: {e}")
+            self._ready.set()
+            self.loop.close()
+            return
+        self._running = True
+        self._ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self._running = False
+            self.loop.close()
+
+    async def _startup(self):
+        self._lanes = {
+            lane: FairScheduler(rate, burst, is_ready=self._is_next)
+            for lane, (rate, burst) in self.rate_limits.items()
+        }
+        await self.application.initialize()
+        self._worker_tasks = [
+            asyncio.create_task(self._worker(lane), name=f"update-worker-{lane}-{i}")
+            for lane, count in ((FAST_LANE, self.fast_workers), (SLOW_LANE, self.workers))
+            for i in range(count)
+        ]
+
+    async def _shutdown(self):
+        with self._lock:
+            self._running = False
+        for scheduler in self._lanes.values():
+            scheduler.drain()
+        await self.join()
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        await self.application.shutdown()
+
+    async def join(self):
+        """Wait on the dispatcher loop until every accepted update has been handled"""
+        await asyncio.gather(*(scheduler.join() for scheduler in self._lanes.values()))
+
+    async def _worker(self, lane):
+        scheduler = self._lanes[lane]
+        while True:
+            chat_id, (update, enqueued_at, sequence, on_done) = await scheduler.get()
+            started_at = time.perf_counter()
+            with self._lock:
+                self._depth -= 1
+                self._in_flight += 1
+                key = (lane, chat_id)
+                self._pending[key] -= 1
+                if not self._pending[key]:
+                    del self._pending[key]
+            self.queue_wait.record(started_at - enqueued_at)
+            scheduler.queue_wait.record(started_at - enqueued_at)
+            try:
+                if isinstance(update, dict):
+                    update = Update.de_json(update, self.application.bot)
+                await self.application.process_update(update)
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                logger.error(f"Error in background processing: {e}")
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                self.latency.record(time.perf_counter() - enqueued_at)
+                self._finish(chat_id, sequence)
+                scheduler.task_done()
+                if on_done:
+                    try:
+                        on_done(update)
+                    except Exception as e:
+                        logger.error(f"Error in update completion callback: {e}")
+
+    def _is_next(self, chat_id, item):
+        """True when no earlier update from this chat is queued or running"""
+        if chat_id is None:
+            return True
+        with self._lock:
+            return self._chat_order[chat_id][0] == item[2]
+
+    def _finish(self, chat_id, sequence):
+        if chat_id is None:
+            return
+        with self._lock:
+            order = self._chat_order[chat_id]
+            order.remove(sequence)
+            if not order:
+                del self._chat_order[chat_id]
+        # The chat's next update may be waiting in either lane
+        for scheduler in self._lanes.values():
+            scheduler.notify()
@@ -0,0 +1,183 @@
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ExpenseParser:
+    """Deterministic parser for short Indonesian expense/income messages.
+
+    Handles the common shapes ("beli kopi 25 ribu", "gaji 5 juta", "parkir 5.000")
+    locally and attaches a confidence score so callers can fall back to Gemini
+    for anything ambiguous.
+    """
+
+    def __init__(self):
+        # Amount multipliers for Indonesian shorthand
+        self.multipliers = {
+            'rb': 1_000, 'ribu': 1_000, 'k': 1_000,
+            'jt': 1_000_000, 'juta': 1_000_000,
+            'miliar': 1_000_000_000, 'milyar': 1_000_000_000
+        }
+
+        self.income_keywords = {
+            'gaji', 'gajian', 'terima', 'diterima', 'dapat', 'dapet', 'bonus', 'thr',
+            'untung', 'masuk', 'pemasukan', 'dividen', 'komisi', 'cashback', 'refund', 'jual'
+        }
+        self.expense_keywords = {
+            'beli', 'bayar', 'buat', 'spend', 'keluar', 'pengeluaran', 'jajan', 'isi',
+            'topup', 'top up', 'sewa', 'langganan', 'kasih'
+        }
+
+        # Category keyword dictionary (same categories as the Gemini prompt)
+        self.category_keywords = {
+            'makanan': [
+                'makan', 'sarapan', 'kopi', 'nasi', 'bakso', 'mie', 'ayam', 'sate', 'roti',
+                'minum', 'teh', 'jus', 'snack', 'jajan', 'warteg', 'resto', 'restoran',
+                'cafe', 'kafe', 'gofood', 'grabfood', 'shopeefood', 'martabak', 'gorengan'
+            ],
+            'transportasi': [
+                'bensin', 'pertalite', 'pertamax', 'solar', 'parkir', 'ojek', 'ojol', 'gojek',
+                'grab', 'taksi', 'taxi', 'tol', 'bus', 'busway', 'kereta', 'krl', 'mrt',
+                'angkot', 'transport', 'tiket pesawat', 'servis motor', 'servis mobil'
+            ],
+            'belanja': [
+                'belanja', 'baju', 'celana', 'sepatu', 'tas', 'indomaret', 'alfamart',
+                'supermarket', 'minimarket', 'pasar', 'sabun', 'shampo', 'shopee',
+                'tokopedia', 'lazada', 'sayur', 'beras', 'galon', 'gas elpiji'
+            ],
+            'kesehatan': [
+                'obat', 'dokter', 'apotek', 'vitamin', 'rumah sakit', 'klinik', 'periksa',
+                'gigi', 'masker'
+            ],
+            'hiburan': [
+                'nonton', 'bioskop', 'film', 'game', 'netflix', 'spotify', 'youtube',
+                'karaoke', 'liburan', 'wisata', 'konser'
+            ],
+            'pendidikan': [
+                'buku', 'kursus', 'sekolah', 'kuliah', 'spp', 'les', 'seminar', 'ukt'
+            ],
+            'tagihan': [
+                'listrik', 'pln', 'pdam', 'internet', 'wifi', 'indihome', 'pulsa', 'kuota',
+                'token', 'cicilan', 'kos', 'kost', 'kontrakan', 'bpjs', 'asuransi', 'iuran'
+            ],
+            'gaji': ['gaji', 'gajian', 'salary'],
+            'bonus': ['bonus', 'thr', 'komisi', 'cashback'],
+            'investasi': ['investasi', 'saham', 'reksadana', 'dividen', 'deposito', 'emas', 'crypto']
+        }
+        self.income_categories = {'gaji', 'bonus'}
+
+        self.amount_pattern = re.compile(
+            r'(?<![\w.,])(?:rp\.?\s*)?(\d+(?:[.,]\d+)*)\s*'
+            r'(ribu|rb|k|juta|jt|miliar|milyar)?(?![\w])',
+            re.IGNORECASE
+        )
+        self._keyword_patterns = {
+            keyword: re.compile(r'\b' + re.escape(keyword) + r'\b')
+            for keywords in list(self.category_keywords.values())
+                + [self.income_keywords, self.expense_keywords]
+            for keyword in keywords
+        }
+
+    def parse(self, text):
+        """Parse text into expense data with a 'confidence' in [0, 1], or None if no amount"""
+        try:
+            lowered = ' '.join(text.lower().split())
+            matches = list(self.amount_pattern.finditer(lowered))
+            if not matches:
+                return None
+
+            amounts = [(match, self._parse_amount(match.group(1), match.group(2))) for match in matches]
+            amounts = [(match, amount) for match, amount in amounts if amount]
+            if not amounts:
+                return None
+            match, amount = amounts[0]
+
+            has_unit = bool(match.group(2)) or match.group(0).startswith('rp') or bool(re.search(r'\d[.,]\d{3}', match.group(1)))
+            category = self._find_category(lowered)
+            is_income = self._has_keyword(lowered, self.income_keywords)
+            is_expense = self._has_keyword(lowered, self.expense_keywords)
+
+            # An explicit expense verb wins over income words: "bayar gaji karyawan" is paid out
+            if is_expense:
+                type = 'pengeluaran'
+            elif category in self.income_categories or is_income:
+                type = 'pemasukan'
+            else:
+                type = 'pengeluaran'
+
+            confidence = 0.5
+            if category:
+                confidence += 0.25
+            if is_income or is_expense:
+                confidence += 0.15
+            if has_unit:
+                confidence += 0.1
+            if len(amounts) > 1:
+                # Several numbers ("2 porsi 15rb") are ambiguous; let the model decide
+                confidence = min(confidence, 0.4)
+            if amount < 100 and not has_unit:
+                confidence = min(confidence, 0.4)
+            if is_expense and (is_income or category in self.income_categories):
+                # Both directions are mentioned; let the model decide
+                confidence = min(confidence, 0.4)
+
+            return {
+                'type': type,
+                'amount': float(amount),
+                'category': category or 'lainnya',
+                'description': self._description(lowered, match) or 'Transaksi',
+                'confidence': round(confidence, 2)
+            }
+
+        except Exception as e:
+            logger.error(f"Error parsing expense text '{text}': {e}")
+            return None
+
+    def parse_amount(self, text):
+        """Parse a standalone amount such as '25000', 'Rp25.000' or '1,5jt'; None if invalid"""
+        match = self.amount_pattern.fullmatch(' '.join(str(text).lower().split()))
+        if not match:
+            return None
+        return self._parse_amount(match.group(1), match.group(2))
+
+    def normalize(self, text):
+        """Canonical form for cache keys: lowercase, single spaces, amounts as plain rupiah"""
+        lowered = ' '.join(text.lower().split()).strip(' .!?')
+
+        def canonical(match):
+            amount = self._parse_amount(match.group(1), match.group(2))
+            return str(amount) if amount else match.group(0)
+
+        return self.amount_pattern.sub(canonical, lowered)
+
+    def _parse_amount(self, number, unit):
+        """Convert '25', '25.000', '2,5' plus an optional unit into rupiah"""
+        if re.fullmatch(r'\d{1,3}([.,])\d{3}(\1\d{3})*', number):
+            # Thousands separators: 25.000 / 1,250,000
+            value = float(re.sub(r'[.,]', '', number))
+        elif re.fullmatch(r'\d+[.,]\d+', number):
+            # Decimal with a unit: 2,5 juta / 1.5jt
+            value = float(number.replace(',', '.'))
+        elif re.fullmatch(r'\d+', number):
+            value = float(number)
+        else:
+            return None
+
+        if unit:
+            value *= self.multipliers[unit.lower()]
+        return round(value)
+
+    def _find_category(self, text):
+        for category, keywords in self.category_keywords.items():
+            if self._has_keyword(text, keywords):
+                return category
+        return None
+
+    def _has_keyword(self, text, keywords):
+        return any(self._keyword_patterns[keyword].search(text) for keyword in keywords)
+
+    def _description(self, text, match):
+        """Message text without the amount expression, first letter capitalized"""
+        description = (text[:match.start()] + ' ' + text[match.end():]).strip(' ,.-:')
+        description = ' '.join(description.split())
+        return description[:1].upper() + description[1:]
@@ -0,0 +1,164 @@
+import asyncio
+import time
+from collections import deque
+from metrics import LatencyStats
+
+
+class TokenBucket:
+    """Classic token bucket: ``rate`` tokens per second up to ``burst``; rate 0 means unlimited"""
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic() if now is None else now
+
+    def delay(self, now):
+        """Seconds until one token is available (0 when one is available now)"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        if self.rate <= 0:
+            return
+        self._refill(now)
+        self.tokens -= 1
+
+    @property
+    def full(self):
+        return self.rate <= 0 or self.tokens >= self.burst
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+
+class FairScheduler:
+    """Per-chat FIFO queues served round-robin, each chat throttled by its own token bucket.
+
+    One chat sending dozens of updates only ever gets one turn per round, and
+    once its burst is spent it waits for tokens while other chats are served.
+    ``is_ready(chat_id, item)`` can hold back a chat's head item (e.g. while an
+    earlier update from that chat is still running); call ``notify`` when that may
+    have changed. Must only be used from the event loop that owns it.
+    """
+
+    MAX_IDLE_BUCKETS = 10000
+
+    def __init__(self, rate, burst, is_ready=None):
+        self.rate = rate
+        self.burst = burst
+        self.is_ready = is_ready
+        self.draining = False
+        self._queues = {}
+        self._buckets = {}
+        self._ready = deque()
+        self._deferred = set()
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._unfinished = 0
+        self.depth = 0
+        self.throttled = 0
+        self.queue_wait = LatencyStats()
+
+    def put(self, chat_id, item):
+        """Queue an item behind any others from the same chat"""
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+            self._ready.append(chat_id)
+        queue.append(item)
+        self.depth += 1
+        self._unfinished += 1
+        self._idle.clear()
+        self._wakeup.set()
+
+    async def get(self):
+        """Wait for the next (chat_id, item) whose chat has a token, rotating across chats"""
+        while True:
+            now = time.monotonic()
+            wait = None
+            for _ in range(len(self._ready)):
+                chat_id = self._ready.popleft()
+                if self.is_ready and not self.is_ready(chat_id, self._queues[chat_id][0]):
+                    self._ready.append(chat_id)
+                    continue
+                bucket = self._bucket(chat_id, now)
+                delay = 0.0 if self.draining else bucket.delay(now)
+                if delay > 0:
+                    self._deferred.add(chat_id)
+                    self._ready.append(chat_id)
+                    wait = delay if wait is None else min(wait, delay)
+                    continue
+                if not self.draining:
+                    # Drained turns are free, so a chat isn't left in debt once throttling resumes
+                    bucket.take(now)
+                if chat_id in self._deferred:
+                    self._deferred.discard(chat_id)
+                    self.throttled += 1
+                queue = self._queues[chat_id]
+                item = queue.popleft()
+                if queue:
+                    self._ready.append(chat_id)
+                else:
+                    del self._queues[chat_id]
+                self.depth -= 1
+                return chat_id, item
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def task_done(self):
+        self._unfinished -= 1
+        if self._unfinished <= 0:
+            self._unfinished = 0
+            self._idle.set()
+
+    async def join(self):
+        """Wait until every queued item has been taken and marked done"""
+        await self._idle.wait()
+
+    def notify(self):
+        """Re-check held-back chats"""
+        self._wakeup.set()
+
+    def drain(self):
+        """Stop throttling so queued items are released as fast as workers take them"""
+        self.draining = True
+        self._wakeup.set()
+
+    def resume(self):
+        """Throttle chats by their token buckets again after ``drain``"""
+        self.draining = False
+
+    def get_metrics(self):
+        return {
+            'queue_depth': self.depth,
+            'chats_waiting': len(self._queues),
+            'throttled': self.throttled,
+            'queue_wait': self.queue_wait.snapshot(),
+        }
+
+    def _bucket(self, chat_id, now):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= self.MAX_IDLE_BUCKETS:
+                self._prune(now)
+            bucket = self._buckets[chat_id] = TokenBucket(self.rate, self.burst, now)
+        return bucket
+
+    def _prune(self, now):
+        # A refilled bucket with nothing queued is the same as a fresh one
+        for chat_id, bucket in list(self._buckets.items()):
+            bucket.delay(now)
+            if bucket.full and chat_id not in self._queues:
+                del self._buckets[chat_id]
@@ -0,0 +1,90 @@
+import io
+import logging
+from config import Config
+
+try:
+    from PIL import Image, ImageChops, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+def select_photo_size(photos, min_side=None):
+    """Pick the smallest Telegram PhotoSize whose short side reaches ``min_side``.
+
+    Telegram sends every photo in several sizes; receipts stay legible well below
+    the largest one. Falls back to the largest size when none is big enough.
+    """
+    min_side = min_side or Config.RECEIPT_MIN_SIDE
+    ordered = sorted(photos, key=lambda photo: photo.width * photo.height)
+    for photo in ordered:
+        if min(photo.width, photo.height) >= min_side:
+            return photo
+    return ordered[-1]
+
+
+def detect_mime_type(data):
+    """Detect the image mime type from magic bytes, defaulting to JPEG"""
+    if data[:3] == b'\xff\xd8\xff':
+        return 'image/jpeg'
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'image/png'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if data[4:8] == b'ftyp' and data[8:12] in (b'heic', b'heix', b'mif1'):
+        return 'image/heic'
+    return 'image/jpeg'
+
+
+def preprocess_image(data, max_side=None, grayscale=None, autocrop=None, quality=None):
+    """Downscale, optionally grayscale/crop, and re-encode a receipt image.
+
+    Returns ``(bytes, mime_type)``. The re-encoded JPEG is only used when it is
+    smaller than the input; without Pillow the original bytes are returned.
+    """
+    mime_type = detect_mime_type(data)
+    if Image is None:
+        return data, mime_type
+
+    max_side = max_side or Config.RECEIPT_MAX_SIDE
+    grayscale = Config.RECEIPT_GRAYSCALE if grayscale is None else grayscale
+    autocrop = Config.RECEIPT_AUTOCROP if autocrop is None else autocrop
+    quality = quality or Config.RECEIPT_JPEG_QUALITY
+
+    try:
+        with Image.open(io.BytesIO(data)) as source:
+            image = ImageOps.exif_transpose(source)
+            image = image.convert('L' if grayscale else 'RGB')
+            if autocrop:
+                image = _crop_border(image)
+            if max(image.size) > max_side:
+                image.thumbnail((max_side, max_side))
+
+            output = io.BytesIO()
+            image.save(output, format='JPEG', quality=quality, optimize=True)
+    except Exception as e:
+        logger.warning(f"Could not preprocess image, sending original: {e}")
+        return data, mime_type
+
+    processed = output.getvalue()
+    if len(processed) >= len(data):
+        return data, mime_type
+    return processed, 'image/jpeg'
+
+
+def _crop_border(image):
+    """Trim a uniform border (table, background) matching the top-left pixel"""
+    background = Image.new(image.mode, image.size, image.getpixel((0, 0)))
+    difference = ImageChops.difference(image, background)
+    if difference.mode != 'L':
+        difference = difference.convert('L')
+    box = difference.point(lambda value: 255 if value > 24 else 0).getbbox()
+    if not box:
+        return image
+    # Only crop when it removes a meaningful margin
+    width, height = image.size
+    if (box[2] - box[0]) * (box[3] - box[1]) > 0.9 * width * height:
+        return image
+    return image.crop(box)
@@ -0,0 +1,86 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class TransactionJournal:
+    """Append-only local journal of ledger rows, backed by SQLite in WAL mode.
+
+    Every row is stored under its transaction ID and committed to disk before
+    the bot acknowledges it. Rows stay pending until ``mark_sent`` records that they
+    reached Google Sheets, so anything unsent survives a crash or restart.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or Config.JOURNAL_PATH
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS transactions ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " id TEXT NOT NULL UNIQUE,"
+            " row TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " sent_at REAL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS transactions_pending ON transactions (sent_at, seq)"
+        )
+
+    def append(self, entries):
+        """Durably record (id, row) pairs; IDs already present are ignored"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO transactions (id, row, created_at) VALUES (?, ?, ?)",
+                    [(entry_id, json.dumps(row), now) for entry_id, row in entries]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def mark_sent(self, ids):
+        """Mark rows as written to Google Sheets"""
+        if not ids:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE transactions SET sent_at = ? WHERE id = ?",
+                [(now, entry_id) for entry_id in ids]
+            )
+
+    def pending(self, limit=None):
+        """Return unsent (id, row) pairs in journal order"""
+        query = "SELECT id, row FROM transactions WHERE sent_at IS NULL ORDER BY seq"
+        params = ()
+        if limit:
+            query += " LIMIT ?"
+            params = (limit,)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [(entry_id, json.loads(row)) for entry_id, row in rows]
+
+    def pending_count(self):
+        """Return the number of rows not yet written to Google Sheets"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM transactions WHERE sent_at IS NULL"
+            ).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,68 @@
+import json
+import os
+import tempfile
+import threading
+
+class AtomicJsonFile:
+    """JSON file that is only ever replaced whole, for caches persisted from several threads.
+
+    ``save`` writes to a fresh temp file next to ``path`` and renames it over the
+    old one, so readers never see a torn file. Saves run one at a time and take
+    their snapshot inside that turn, so an older snapshot can't land after a newer one.
+    """
+
+    def __init__(self, path, ensure_ascii=True):
+        self.path = path
+        self.ensure_ascii = ensure_ascii
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Return the decoded contents, or None if the file doesn't exist yet"""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, snapshot):
+        """Write ``snapshot()`` atomically unless it returns None; returns True if written"""
+        with self._lock:
+            data = snapshot()
+            if data is None:
+                return False
+            directory = os.path.dirname(self.path) or '.'
+            os.makedirs(directory, exist_ok=True)
+            temp_path = None
+            try:
+                with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory, delete=False,
+                                                 prefix=f"{os.path.basename(self.path)}.", suffix='.tmp') as f:
+                    temp_path = f.name
+                    json.dump(data, f, ensure_ascii=self.ensure_ascii)
+                os.replace(temp_path, self.path)
+            except BaseException:
+                if temp_path and os.path.exists(temp_path):
+                    os.unlink(temp_path)
+                raise
+            return True
+
+
+class PeriodicSaver:
+    """Daemon thread that calls ``save`` every ``interval`` seconds.
+
+    Caches only mark themselves dirty on the hot path; serializing and writing
+    happens here, off the event loop and request threads.
+    """
+
+    def __init__(self, save, interval, name):
+        self.save = save
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.save()
@@ -0,0 +1,258 @@
+import logging
+import re
+import threading
+import time
+from gspread.utils import numericise_all
+from config import Config
+from ledger_index import LedgerIndex, record_tenant, tenant_key
+from rollups import RollupStore, add_totals
+
+logger = logging.getLogger(__name__)
+
+class LedgerCache:
+    """In-memory copy of the ledger worksheet with incremental refresh.
+
+    Rows are kept as header-keyed dicts, the same shape ``get_all_records`` returns.
+    Once loaded, a refresh only reads the header row and column A to learn the row
+    count, then fetches rows past the last known one. A full reload happens when
+    the header changes, the sheet shrinks, an append lands somewhere unexpected,
+    or ``full_reload_interval`` elapses (which also picks up in-place edits).
+
+    Rows are partitioned by their ``Chat`` column: each tenant has its own
+    ``LedgerIndex`` and ``RollupStore``, kept in step with the rows, so a query for
+    one chat only touches that chat's rows.
+    """
+
+    def __init__(self, sheet, ttl=None, full_reload_interval=None):
+        self.sheet = sheet
+        self.ttl = Config.LEDGER_CACHE_TTL if ttl is None else ttl
+        self.full_reload_interval = (
+            Config.LEDGER_FULL_RELOAD_INTERVAL if full_reload_interval is None else full_reload_interval
+        )
+        self.header = None
+        self.records = []
+        self.indexes = {}
+        self.rollups = {}
+        self.ids = set()
+        self.last_sync = 0.0
+        self.last_full_reload = 0.0
+        self.full_reloads = 0
+        self.incremental_syncs = 0
+        self._stale = True
+        self._lock = threading.RLock()
+
+    def get_records(self):
+        """Return cached ledger records, refreshing them first if the TTL has expired"""
+        self.sync()
+        return self.records
+
+    def get_day(self, chat_id, target_date):
+        """Return one chat's cached records for one day"""
+        self.sync()
+        with self._lock:
+            return self._index(chat_id).day(target_date)
+
+    def get_range(self, chat_id, start_date, end_date, unsent=()):
+        """Return one chat's cached records between two dates inclusive, plus its ``unsent`` rows in range"""
+        self.sync()
+        with self._lock:
+            records = self._index(chat_id).range(start_date, end_date)
+            extra = self._unsent_records(chat_id, unsent)
+            if not extra:
+                return records
+            return LedgerIndex(records + extra).range(start_date, end_date)
+
+    def get_month(self, chat_id, year, month):
+        """Return one chat's cached records for a calendar month"""
+        self.sync()
+        with self._lock:
+            return list(self._index(chat_id).month(year, month))
+
+    def get_year(self, chat_id, year):
+        """Return one chat's cached records for a calendar year"""
+        self.sync()
+        with self._lock:
+            return list(self._index(chat_id).year(year))
+
+    def get_month_totals(self, chat_id, year, month, unsent=()):
+        """Return one chat's pre-aggregated {type: {category: total}} for a month, counting its ``unsent`` rows"""
+        self.sync()
+        with self._lock:
+            totals = self._rollups(chat_id).month_totals(year, month)
+            extra = self._unsent_records(chat_id, unsent)
+            if extra:
+                add_totals(totals, RollupStore(extra).month_totals(year, month))
+            return totals
+
+    def get_year_totals(self, chat_id, year, unsent=()):
+        """Return one chat's pre-aggregated {type: {category: total}} for a year, counting its ``unsent`` rows"""
+        self.sync()
+        with self._lock:
+            totals = self._rollups(chat_id).year_totals(year)
+            extra = self._unsent_records(chat_id, unsent)
+            if extra:
+                add_totals(totals, RollupStore(extra).year_totals(year))
+            return totals
+
+    @property
+    def tenant_count(self):
+        with self._lock:
+            return len(self.indexes)
+
+    def verify_rollups(self, chat_id):
+        """Compare one chat's running rollups with a fresh read of its rows, then rebuild that chat from them.
+
+        Returns the chat's mismatches and its row count. The sheet is read once;
+        only the chat's own rows are parsed, and other chats are left as they are.
+        """
+        with self._lock:
+            self.sync()
+            values = self.sheet.get_all_values()
+            header = values[0] if values else []
+            tenant = tenant_key(chat_id)
+            column = header.index('Chat') if 'Chat' in header else None
+            fresh = [
+                self._to_record(header, row) for row in values[1:]
+                if tenant_key(row[column] if column is not None and column < len(row) else '') == tenant
+            ]
+            mismatches = self._rollups(chat_id).verify(fresh)
+            if header != self.header or len(values) - 1 != len(self.records):
+                # Rows were added or removed elsewhere; the next sync reloads everything
+                self._stale = True
+            self.indexes[tenant] = LedgerIndex(fresh)
+            self.rollups[tenant] = RollupStore(fresh)
+            self.ids.update(str(record['ID']) for record in fresh if record.get('ID'))
+            return mismatches, len(fresh)
+
+    def existing_ids(self, ids):
+        """Return which of the given transaction IDs are already in the sheet"""
+        with self._lock:
+            self.sync(max_age=0)
+            return self.ids.intersection(ids)
+
+    def invalidate(self):
+        """Force a full reload on the next sync"""
+        with self._lock:
+            self._stale = True
+
+    def sync(self, force=False, max_age=None):
+        """Bring the cache up to date with the sheet"""
+        with self._lock:
+            now = time.monotonic()
+            max_age = self.ttl if max_age is None else max_age
+            if not force and not self._stale and now - self.last_sync < max_age:
+                return
+            if force or self._stale or now - self.last_full_reload >= self.full_reload_interval:
+                self._full_reload()
+            else:
+                self._incremental_sync()
+            self.last_sync = time.monotonic()
+
+    def append(self, rows, append_response=None):
+        """Record rows that were just appended to the sheet by this process"""
+        with self._lock:
+            if self._stale or self.header is None:
+                return
+            row_number = self._appended_row_number(append_response)
+            if row_number != len(self.records) + 2:
+                # Someone else wrote in between; let the next sync reconcile
+                self._stale = True
+                return
+            for row_data in rows:
+                self._add_record(self._to_record(self.header, [str(v) for v in row_data]))
+
+    def _read_all(self):
+        values = self.sheet.get_all_values()
+        header = values[0] if values else []
+        return header, [self._to_record(header, row) for row in values[1:]]
+
+    def _full_reload(self):
+        self._load(*self._read_all())
+
+    def _load(self, header, records):
+        self.header, self.records = header, records
+        self.ids = {str(record['ID']) for record in self.records if record.get('ID')}
+        partitions = self._partition(self.records)
+        self.indexes = {tenant: LedgerIndex(records) for tenant, records in partitions.items()}
+        self.rollups = {tenant: RollupStore(records) for tenant, records in partitions.items()}
+        self.last_full_reload = time.monotonic()
+        self._stale = False
+        self.full_reloads += 1
+        logger.info(f"Ledger cache reloaded: {len(self.records)} rows, {len(self.indexes)} chats")
+
+    def _incremental_sync(self):
+        header_rows, first_column = self.sheet.batch_get(['1:1', 'A:A'])
+        header = header_rows[0] if header_rows else []
+        row_count = max(len(first_column) - 1, 0)
+
+        if header != self.header or row_count < len(self.records):
+            logger.info("Ledger sheet changed shape, reloading cache")
+            self._full_reload()
+            return
+
+        if row_count > len(self.records):
+            start_row = len(self.records) + 2
+            end_row = row_count + 1
+            new_rows = self.sheet.get(f"A{start_row}:{self._last_column()}{end_row}")
+            for row in new_rows:
+                self._add_record(self._to_record(header, row))
+            # The API omits trailing blank rows; keep the row count aligned
+            while len(self.records) < row_count:
+                self.records.append(self._to_record(header, []))
+        self.incremental_syncs += 1
+
+    def _add_record(self, record):
+        self.records.append(record)
+        tenant = record_tenant(record)
+        self.indexes.setdefault(tenant, LedgerIndex()).add(record)
+        self.rollups.setdefault(tenant, RollupStore()).add(record)
+        if record.get('ID'):
+            self.ids.add(str(record['ID']))
+
+    def _unsent_records(self, chat_id, entries):
+        # Rows still on their way to the sheet; once one lands in the cache its ID is known and it's skipped.
+        # Callers hold the lock so a row can't be missed or counted twice while a flush appends it.
+        tenant = tenant_key(chat_id)
+        records = []
+        for entry_id, row in entries:
+            if str(entry_id) in self.ids:
+                continue
+            record = self._to_record(self.header or [], [str(v) for v in row])
+            if record_tenant(record) == tenant:
+                records.append(record)
+        return records
+
+    def _index(self, chat_id):
+        return self.indexes.get(tenant_key(chat_id)) or LedgerIndex()
+
+    def _rollups(self, chat_id):
+        return self.rollups.get(tenant_key(chat_id)) or RollupStore()
+
+    @staticmethod
+    def _partition(records):
+        partitions = {}
+        for record in records:
+            partitions.setdefault(record_tenant(record), []).append(record)
+        return partitions
+
+    def _last_column(self):
+        count = max(len(self.header), 1)
+        letters = ''
+        while count:
+            count, remainder = divmod(count - 1, 26)
+            letters = chr(ord('A') + remainder) + letters
+        return letters
+
+    @staticmethod
+    def _appended_row_number(append_response):
+        try:
+            updated_range = append_response['updates']['updatedRange']
+        except (TypeError, KeyError):
+            return None
+        match = re.search(r'![A-Z]+(\d+)', updated_range)
+        return int(match.group(1)) if match else None
+
+    @staticmethod
+    def _to_record(header, row):
+        values = numericise_all(list(row) + [''] * (len(header) - len(row)))
+        return dict(zip(header, values))
@@ -0,0 +1,52 @@
+import csv
+import logging
+
+try:
+    from openpyxl import Workbook
+except ImportError:
+    Workbook = None
+
+logger = logging.getLogger(__name__)
+
+EXPORT_HEADERS = ['Tanggal', 'Tipe', 'Jumlah', 'Kategori', 'Keterangan', 'Timestamp', 'ID']
+EXPORT_FORMATS = ('csv', 'xlsx') if Workbook else ('csv',)
+
+
+def export_rows(records):
+    """Turn header-keyed ledger records into rows in export column order, lazily"""
+    for record in records:
+        yield [record.get(header, '') for header in EXPORT_HEADERS]
+
+
+def write_export(records, path, format='csv'):
+    """Stream records into a CSV or XLSX file at ``path``; returns the row count (blocking)"""
+    if format == 'xlsx':
+        return _write_xlsx(export_rows(records), path)
+    return _write_csv(export_rows(records), path)
+
+
+def _write_csv(rows, path):
+    count = 0
+    # utf-8-sig so spreadsheet apps detect the encoding of Indonesian descriptions
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(EXPORT_HEADERS)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def _write_xlsx(rows, path):
+    if Workbook is None:
+        raise RuntimeError("openpyxl is not installed")
+    # Write-only mode streams rows to disk instead of keeping cell objects around
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Ledger')
+    sheet.append(EXPORT_HEADERS)
+    count = 0
+    for row in rows:
+        sheet.append(row)
+        count += 1
+    workbook.save(path)
+    return count
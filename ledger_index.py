@@ -0,0 +1,100 @@
+import bisect
+import logging
+from datetime import date
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+def tenant_key(chat_id):
+    """Partition key for a Telegram chat; rows without one belong to ``LEGACY_CHAT_ID``"""
+    if chat_id is None or chat_id == '':
+        return str(Config.LEGACY_CHAT_ID)
+    return str(chat_id)
+
+
+def record_tenant(record):
+    """Partition key of a header-keyed ledger record"""
+    return tenant_key(record.get('Chat'))
+
+
+class LedgerIndex:
+    """Date index over ledger records.
+
+    Records are kept sorted by the ordinal of their ``Tanggal`` so a date range is
+    two bisects plus a slice, and month/year buckets answer calendar queries
+    directly. Records whose date cannot be parsed are left out of the index.
+    """
+
+    def __init__(self, records=None):
+        self.ordinals = []
+        self.records = []
+        self.by_month = {}
+        self.by_year = {}
+        if records:
+            self.rebuild(records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def rebuild(self, records):
+        """Replace the index contents with the given records"""
+        entries = []
+        for record in records:
+            record_date = self._record_date(record)
+            if record_date:
+                entries.append((record_date.toordinal(), record))
+        entries.sort(key=lambda entry: entry[0])
+
+        self.ordinals = [ordinal for ordinal, _ in entries]
+        self.records = [record for _, record in entries]
+        self.by_month = {}
+        self.by_year = {}
+        for ordinal, record in entries:
+            self._add_to_buckets(date.fromordinal(ordinal), record)
+
+    def add(self, record):
+        """Insert a single record, keeping the ordinal array sorted"""
+        record_date = self._record_date(record)
+        if not record_date:
+            return
+        ordinal = record_date.toordinal()
+        if not self.ordinals or ordinal >= self.ordinals[-1]:
+            self.ordinals.append(ordinal)
+            self.records.append(record)
+        else:
+            position = bisect.bisect_right(self.ordinals, ordinal)
+            self.ordinals.insert(position, ordinal)
+            self.records.insert(position, record)
+        self._add_to_buckets(record_date, record)
+
+    def range(self, start_date, end_date):
+        """Return records dated from start_date through end_date inclusive"""
+        low = bisect.bisect_left(self.ordinals, start_date.toordinal())
+        high = bisect.bisect_right(self.ordinals, end_date.toordinal())
+        return self.records[low:high]
+
+    def day(self, target_date):
+        """Return records for a single day"""
+        return self.range(target_date, target_date)
+
+    def month(self, year, month):
+        """Return records for a calendar month"""
+        return self.by_month.get((year, month), [])
+
+    def year(self, year):
+        """Return records for a calendar year"""
+        return self.by_year.get(year, [])
+
+    def _add_to_buckets(self, record_date, record):
+        self.by_month.setdefault((record_date.year, record_date.month), []).append(record)
+        self.by_year.setdefault(record_date.year, []).append(record)
+
+    @staticmethod
+    def _record_date(record):
+        value = record.get('Tanggal')
+        if not value:
+            return None
+        try:
+            return date.fromisoformat(str(value)[:10])
+        except ValueError:
+            return None
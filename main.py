@@ -1,11 +1,13 @@
 import os
+import hmac
 import logging
+import random
+import threading
 from flask import Flask, request, jsonify, render_template
-from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters
-import asyncio
-from bot_handlers import BotHandlers
+from app_factory import create_application
 from config import Config
+from dispatcher import UpdateDispatcher, payload_chat_id, payload_type
+from update_dedup import UpdateDeduplicator
 
 # Configure logging
 logging.basicConfig(
@@ -19,74 +21,118 @@ app = Flask(__name__)
 # Initialize bot application
 bot_application = None
 bot_handlers = None
+update_dispatcher = None
+_dispatcher_lock = threading.Lock()
+update_deduplicator = UpdateDeduplicator(
+    max_entries=Config.UPDATE_DEDUP_MAX_ENTRIES,
+    window=Config.UPDATE_DEDUP_WINDOW,
+    path=Config.UPDATE_DEDUP_PATH or None
+)
 
 def create_bot_application():
     """Create and configure the Telegram bot application"""
     global bot_application, bot_handlers
     
-    # Initialize bot handlers
-    bot_handlers = BotHandlers()
-    
-    # Create application
-    bot_application = Application.builder().token(Config.TELEGRAM_BOT_TOKEN).build()
-    
-    # Add command handlers
-    bot_application.add_handler(CommandHandler("start", bot_handlers.start_command))
-    bot_application.add_handler(CommandHandler("help", bot_handlers.help_command))
-    bot_application.add_handler(CommandHandler("pengeluaran", bot_handlers.expense_command))
-    bot_application.add_handler(CommandHandler("pemasukan", bot_handlers.income_command))
-    bot_application.add_handler(CommandHandler("rekapharian", bot_handlers.daily_summary_command))
-    bot_application.add_handler(CommandHandler("rekapcustom", bot_handlers.custom_summary_command))
-    bot_application.add_handler(CommandHandler("rekapbulanan", bot_handlers.monthly_summary_command))
-    bot_application.add_handler(CommandHandler("rekaptahunan", bot_handlers.yearly_summary_command))
-    
-    # Add message handlers
-    bot_application.add_handler(MessageHandler(filters.PHOTO, bot_handlers.handle_photo))
-    bot_application.add_handler(MessageHandler(filters.VOICE, bot_handlers.handle_voice))
-    bot_application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot_handlers.handle_text))
-    
+    # Services warm up in the background while the dispatcher initializes the application
+    bot_application, bot_handlers = create_application()
     return bot_application
 
+def get_update_dispatcher():
+    """Create the bot application and start its dispatcher on first use"""
+    global update_dispatcher
+    if update_dispatcher is None:
+        with _dispatcher_lock:
+            if update_dispatcher is None:
+                application = bot_application or create_bot_application()
+                dispatcher = UpdateDispatcher(application)
+                dispatcher.start()
+                update_dispatcher = dispatcher
+    return update_dispatcher
+
 @app.route('/')
 def index():
     """Simple status page"""
     return render_template('index.html')
 
+def log_webhook_update(update_data):
+    """Log a sample of incoming updates as one short line, or every payload in debug mode"""
+    if Config.WEBHOOK_LOG_PAYLOADS:
+        logger.info(f"Received webhook update: {update_data}")
+    elif random.random() < Config.WEBHOOK_LOG_SAMPLE_RATE:
+        logger.info(
+            f"Received webhook update {update_data.get('update_id')}: type={payload_type(update_data)} "
+            f"chat={payload_chat_id(update_data)} size={request.content_length}"
+        )
+
+def has_valid_secret_token():
+    """Check the X-Telegram-Bot-Api-Secret-Token header when a secret is configured"""
+    if not Config.WEBHOOK_SECRET_TOKEN:
+        return True
+    token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    return hmac.compare_digest(token.encode(), Config.WEBHOOK_SECRET_TOKEN.encode())
+
 @app.route('/webhook', methods=['POST'])
 def webhook():
     """Handle incoming Telegram updates"""
+    if not has_valid_secret_token():
+        logger.warning(f"Rejected webhook request from {request.remote_addr}: bad secret token")
+        return jsonify({'status': 'error', 'message': 'invalid secret token'}), 403
+    
+    update_id = None
     try:
-        global bot_application
-        if bot_application is None:
-            bot_application = create_bot_application()
+        dispatcher = get_update_dispatcher()
             
         # Get the update from Telegram
         update_data = request.get_json()
-        logger.info(f"Received webhook update: {update_data}")
         
-        if update_data and bot_application:
-            update = Update.de_json(update_data, bot_application.bot)
+        if update_data:
+            log_webhook_update(update_data)
             
-            # Process the update in a new thread to avoid blocking
-            import threading
-            def process_update():
-                try:
-                    loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(loop)
-                    loop.run_until_complete(bot_application.process_update(update))
-                    loop.close()
-                except Exception as e:
-                    logger.error(f"Error in background processing: {e}")
+            # Telegram retries slow or failed deliveries; each update_id is dispatched once
+            update_id = update_data.get('update_id')
+            if update_deduplicator.is_duplicate(update_id):
+                return jsonify({'status': 'ok', 'duplicate': True})
             
-            thread = threading.Thread(target=process_update)
-            thread.daemon = True
-            thread.start()
+            # Hand off the raw dict; the worker builds the Update, so the request thread stays cheap.
+            # Reject early when the dispatcher is saturated
+            if not dispatcher.submit(update_data):
+                # Not dispatched, so the retry Telegram sends after the 429 must get through
+                update_deduplicator.forget(update_id)
+                if not dispatcher.running:
+                    return jsonify({'status': 'error', 'message': 'dispatcher not running'}), 503
+                response = jsonify({'status': 'busy', 'message': 'update queue is full'})
+                response.headers['Retry-After'] = '1'
+                return response, 429
         
         return jsonify({'status': 'ok'})
     except Exception as e:
         logger.error(f"Error processing webhook: {e}")
+        update_deduplicator.forget(update_id)
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@app.route('/metrics')
+def metrics():
+    """Expose webhook dedup, dispatcher, Sheets, parser and Gemini cache metrics"""
+    return jsonify({
+        'webhook_dedup': update_deduplicator.get_metrics(),
+        'dispatcher': update_dispatcher.get_metrics() if update_dispatcher else None,
+        'sheets': bot_handlers.sheets_service.get_metrics() if bot_handlers else None,
+        'handlers': bot_handlers.get_metrics() if bot_handlers else None,
+        'gemini': bot_handlers.gemini_service.get_metrics() if bot_handlers else None
+    })
+
+@app.route('/status')
+def status():
+    """Dependency health for incidents: dispatcher, Sheets and the Gemini circuit breaker"""
+    gemini = bot_handlers.gemini_service if bot_handlers else None
+    sheets = bot_handlers.sheets_service.get_metrics() if bot_handlers else None
+    return jsonify({
+        'dispatcher_running': bool(update_dispatcher and update_dispatcher.running),
+        'sheets_connected': sheets['connected'] if sheets else None,
+        'sheets_pending_rows': sheets['write_buffer']['pending'] if sheets else None,
+        'gemini_breaker': gemini.breaker.get_metrics() if gemini else None
+    })
+
 @app.route('/set_webhook', methods=['POST'])
 def set_webhook():
     """Set the webhook URL for the Telegram bot"""
@@ -99,15 +145,20 @@ def set_webhook():
         return jsonify({
             'message': 'Use Telegram Bot API to set webhook',
             'url': f'https://api.telegram.org/bot{Config.TELEGRAM_BOT_TOKEN}/setWebhook',
-            'webhook_url': webhook_url
+            'webhook_url': webhook_url,
+            # Pass WEBHOOK_SECRET_TOKEN as setWebhook's secret_token so /webhook accepts Telegram's calls
+            'secret_token_required': bool(Config.WEBHOOK_SECRET_TOKEN)
         })
     except Exception as e:
         logger.error(f"Error setting webhook: {e}")
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
-    # Initialize bot application
-    create_bot_application()
+    # Initialize bot application and its dispatcher loop
+    get_update_dispatcher()
     
     # Run Flask app
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    try:
+        app.run(host='0.0.0.0', port=5000, debug=False)
+    finally:
+        update_dispatcher.stop()
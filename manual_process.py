@@ -2,59 +2,70 @@
 """
 Manual process untuk memproses update yang tertunda
 """
-import json
+import argparse
 import asyncio
-from telegram import Update
 from telegram.ext import Application
-from bot_handlers import BotHandlers
+from app_factory import create_application
+from catch_up import CatchUp, OfflineRequest, UpdateCheckpoint, UpdateDump
 from config import Config
+from dispatcher import FAST_LANE, SLOW_LANE, UpdateDispatcher
 
-async def process_pending_updates():
-    """Process all pending updates"""
-    # Initialize bot handlers
-    bot_handlers = BotHandlers()
+def process_pending_updates(workers=None, checkpoint_path=None, dump_path=None, offline=False):
+    """Process all pending updates in parallel, skipping those a previous run already handled"""
+    builder = None
+    if offline:
+        # Replies and API calls go nowhere; handlers still write to the ledger
+        request = OfflineRequest()
+        builder = Application.builder().token(Config.TELEGRAM_BOT_TOKEN or '0:offline')
+        builder = builder.request(request).get_updates_request(request)
+    application, _ = create_application(builder=builder)
     
-    # Create application
-    application = Application.builder().token(Config.TELEGRAM_BOT_TOKEN).build()
+    # A backlog is old traffic: keep per-chat order but don't throttle it
+    dispatcher = UpdateDispatcher(
+        application,
+        workers=workers,
+        rate_limits={FAST_LANE: (0, 1), SLOW_LANE: (0, 1)},
+        max_pending_per_chat=Config.WEBHOOK_QUEUE_SIZE
+    )
+    dispatcher.start()
     
-    # Add handlers
-    from telegram.ext import CommandHandler, MessageHandler, filters
-    application.add_handler(CommandHandler("start", bot_handlers.start_command))
-    application.add_handler(CommandHandler("help", bot_handlers.help_command))
-    application.add_handler(CommandHandler("pengeluaran", bot_handlers.expense_command))
-    application.add_handler(CommandHandler("pemasukan", bot_handlers.income_command))
-    application.add_handler(CommandHandler("hari_ini", bot_handlers.daily_summary_command))
-    application.add_handler(CommandHandler("bulan_ini", bot_handlers.monthly_summary_command))
-    application.add_handler(CommandHandler("tahun_ini", bot_handlers.yearly_summary_command))
-    application.add_handler(MessageHandler(filters.PHOTO, bot_handlers.handle_photo))
-    application.add_handler(MessageHandler(filters.VOICE, bot_handlers.handle_voice))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot_handlers.handle_text))
-    
-    # Initialize the application
-    await application.initialize()
-    
-    # Get pending updates
-    updates = await application.bot.get_updates()
-    
-    print(f"Processing {len(updates)} pending updates...")
-    
-    for update_data in updates:
-        try:
-            print(f"Processing update {update_data.update_id}")
-            # Process each update
-            await application.process_update(update_data)
-            print(f"Processed update {update_data.update_id} successfully")
-        except Exception as e:
-            print(f"Error processing update {update_data.update_id}: {e}")
-    
-    # Clear processed updates
-    if updates:
-        last_update_id = updates[-1].update_id
-        await application.bot.get_updates(offset=last_update_id + 1)
-        print(f"Cleared updates up to {last_update_id}")
-    
-    await application.shutdown()
-    print("Processing completed!")
+    checkpoint = UpdateCheckpoint(checkpoint_path)
+    catch_up = CatchUp(dispatcher, checkpoint, UpdateDump(dump_path or Config.CATCH_UP_DUMP), skip_files=offline)
+    print(f"Catching up with {dispatcher.workers} workers, {len(checkpoint)} updates already handled...")
+    try:
+        future = asyncio.run_coroutine_threadsafe(catch_up.run(fetch=not offline), dispatcher.loop)
+        future.result()
+        print("Processing completed!")
+        if catch_up.skipped_files:
+            ids = ", ".join(str(update_id) for update_id in catch_up.skipped_files[:20])
+            more = f" and {len(catch_up.skipped_files) - 20} more" if len(catch_up.skipped_files) > 20 else ""
+            print(f"Skipped {len(catch_up.skipped_files)} updates with photos, voice notes or documents "
+                  f"(update_id {ids}{more}); run again without --offline to handle them")
+    except Exception as e:
+        print(f"Catch-up stopped: {e}; run again to continue where it left off")
+    finally:
+        dispatcher.stop()
+        checkpoint.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=Config.WEBHOOK_WORKERS)
+    parser.add_argument('--checkpoint', default=Config.CATCH_UP_CHECKPOINT,
+                        help='file of handled update_ids (default: %(default)s)')
+    parser.add_argument('--ignore-checkpoint', action='store_true',
+                        help='handle every update again, e.g. to rebuild a ledger from the dump')
+    parser.add_argument('--dump', default=Config.CATCH_UP_DUMP,
+                        help='JSON-lines file every fetched update is saved to (default: %(default)s)')
+    parser.add_argument('--offline', action='store_true',
+                        help='only replay the dump; no Telegram API calls, replies are discarded '
+                             'and updates that need a file download are skipped')
+    args = parser.parse_args()
+    process_pending_updates(
+        workers=args.workers,
+        checkpoint_path=None if args.ignore_checkpoint else args.checkpoint,
+        dump_path=args.dump,
+        offline=args.offline
+    )
 
 if __name__ == "__main__":
-    asyncio.run(process_pending_updates())
\ No newline at end of file
+    main()
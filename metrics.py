@@ -0,0 +1,64 @@
+import threading
+import time
+from collections import deque
+
+
+class LatencyStats:
+    """Thread-safe latency recorder keeping a bounded window of recent samples"""
+
+    def __init__(self, window=1000):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        """Record a single latency sample in seconds"""
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def time(self):
+        """Context manager that records the duration of its block"""
+        return _Timer(self)
+
+    def snapshot(self):
+        """Return count, mean, max and recent percentiles in milliseconds"""
+        with self._lock:
+            samples = sorted(self._samples)
+            count = self.count
+            total = self.total
+            maximum = self.max
+
+        def percentile(p):
+            if not samples:
+                return 0.0
+            index = min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))
+            return round(samples[index] * 1000, 3)
+
+        return {
+            'count': count,
+            'mean_ms': round(total / count * 1000, 3) if count else 0.0,
+            'max_ms': round(maximum * 1000, 3),
+            'p50_ms': percentile(50),
+            'p95_ms': percentile(95),
+            'p99_ms': percentile(99),
+        }
+
+
+class _Timer:
+    def __init__(self, stats):
+        self.stats = stats
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stats.record(time.perf_counter() - self.start)
+        return False
@@ -0,0 +1,65 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class MicroBatcher:
+    """Collect items submitted within a short window and process them together.
+
+    ``submit`` returns the item's own result once ``process_batch`` (an async
+    callable taking a list of items and returning a list of results in the same
+    order) has run. A batch is sent when ``max_batch`` items are waiting or
+    ``max_delay`` seconds after its first item arrived. Must be used from a
+    single event loop.
+    """
+
+    def __init__(self, process_batch, max_batch, max_delay):
+        self.process_batch = process_batch
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending = []
+        self._timer = None
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, item):
+        """Queue an item and wait for its result"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._flush)
+        return await future
+
+    def get_metrics(self):
+        """Return batch counters"""
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'mean_batch_size': round(self.items / self.batches, 2) if self.batches else 0,
+            'pending': len(self._pending),
+        }
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.get_running_loop().create_task(self._run(batch))
+
+    async def _run(self, batch):
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            results = await self.process_batch([item for item, _ in batch])
+        except Exception as e:
+            logger.error(f"Error processing batch of {len(batch)} items: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+"""
+Migrasi ledger lama ke ledger per chat: baris tanpa kolom Chat diberikan ke satu chat
+"""
+import argparse
+from sheets_service import SheetsService
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--chat-id', required=True, help='Telegram chat ID pemilik data lama')
+    parser.add_argument('--dry-run', action='store_true', help='hanya hitung baris yang akan dipindahkan')
+    args = parser.parse_args()
+
+    service = SheetsService()
+    sheet_rows, local_rows = service.migrate_legacy_rows(args.chat_id, dry_run=args.dry_run)
+    action = "akan dipindahkan" if args.dry_run else "dipindahkan"
+    print(f"{sheet_rows} baris Google Sheets {action} ke chat {args.chat_id}")
+    if service.local_storage and not args.dry_run:
+        print(f"{local_rows} baris {service.local_storage.name} {action} ke chat {args.chat_id}")
+    service.buffer.close()
+
+if __name__ == "__main__":
+    main()
@@ -5,15 +5,150 @@ import logging
 from google import genai
 from google.genai import types
 import asyncio
+import threading
+import time
 from config import Config
+from expense_parser import ExpenseParser
+from image_preprocess import detect_mime_type
+from metrics import LatencyStats
+from micro_batch import MicroBatcher
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from response_cache import ResponseCache
 
 logger = logging.getLogger(__name__)
 
 class GeminiService:
+    TEXT_SYSTEM_PROMPT = """You are an Indonesian expense tracking assistant. Analyze text to extract expense or income information.
+
+    Extract information and respond in JSON format:
+    {
+        "type": string ("pengeluaran" or "pemasukan"),
+        "amount": number (amount in rupiah, no decimal),
+        "category": string (one of: makanan, transportasi, belanja, kesehatan, hiburan, pendidikan, tagihan, gaji, bonus, investasi, lainnya),
+        "description": string (brief description in Indonesian)
+    }
+
+    Rules:
+    - Detect if it's expense (pengeluaran) or income (pemasukan)
+    - Convert text amounts to numbers (e.g., "25 ribu" = 25000, "2 juta" = 2000000)
+    - Choose appropriate category based on context
+    - If no clear amount is found, set amount to 0
+    - Description should be concise and descriptive
+    
+    Examples of expense indicators: beli, bayar, buat, spend, keluar
+    Examples of income indicators: dapat, terima, gaji, bonus, untung, masuk
+    """
+
     def __init__(self):
-        self.client = genai.Client(api_key=Config.GEMINI_API_KEY)
+        # Building the client sets up HTTP transports and TLS contexts; it is created on first use
+        self._client = None
+        self._client_lock = threading.Lock()
+        # Text extractions are cached under a normalized form of the message
+        self.normalizer = ExpenseParser()
+        self.text_cache = ResponseCache(
+            max_entries=Config.GEMINI_CACHE_MAX_ENTRIES,
+            max_bytes=Config.GEMINI_CACHE_MAX_BYTES,
+            ttl=Config.GEMINI_CACHE_TTL,
+            path=Config.GEMINI_CACHE_PATH or None
+        )
+        # Caps in-flight model requests; the rest wait without blocking the event loop
+        self.max_concurrency = Config.GEMINI_MAX_CONCURRENCY
+        self.timeout = Config.GEMINI_TIMEOUT
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.timeouts = 0
+        self.model_latency = LatencyStats()
+        self.breaker = CircuitBreaker('gemini')
+        # Optional micro-batching of text extractions into one request
+        self.text_batcher = None
+        self.batch_fallbacks = 0
+        if Config.GEMINI_BATCH_ENABLED:
+            self.text_batcher = MicroBatcher(
+                self._generate_expense_batch,
+                max_batch=Config.GEMINI_BATCH_MAX,
+                max_delay=Config.GEMINI_BATCH_WINDOW
+            )
+    
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = genai.Client(api_key=Config.GEMINI_API_KEY)
+        return self._client
+    
+    @client.setter
+    def client(self, client):
+        self._client = client
+    
+    def warm_up(self):
+        """Create the Gemini client ahead of the first request (blocking)"""
+        return self.client
+    
+    def get_metrics(self):
+        """Return model concurrency, latency and text cache counters"""
+        return {
+            'max_concurrency': self.max_concurrency,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'timeouts': self.timeouts,
+            'latency': self.model_latency.snapshot(),
+            'breaker': self.breaker.get_metrics(),
+            'text_cache': self.text_cache.get_metrics(),
+            'text_batching': dict(
+                self.text_batcher.get_metrics(), fallbacks=self.batch_fallbacks
+            ) if self.text_batcher else None
+        }
+    
+    @property
+    def available(self):
+        """False while the circuit breaker is open and model calls fail fast"""
+        return self.breaker.state != CircuitBreaker.OPEN
+    
+    async def _generate_content(self, timeout=None, **kwargs):
+        """Call the async Gemini client behind the circuit breaker and concurrency limit.
+        
+        Raises CircuitOpenError without calling the model while the circuit is
+        open, and asyncio.TimeoutError when the deadline passes; the request is
+        cancelled, as it is when the calling task is cancelled.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError("Gemini circuit is open")
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        except asyncio.CancelledError:
+            self.breaker.record_cancelled()
+            raise
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(
+                self.client.aio.models.generate_content(**kwargs),
+                timeout or self.timeout
+            )
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self.breaker.record_failure()
+            raise
+        except asyncio.CancelledError:
+            self.breaker.record_cancelled()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+        elapsed = time.perf_counter() - started
+        self.model_latency.record(elapsed)
+        self.breaker.record_success(elapsed)
+        return response
     
-    async def extract_expense_from_image(self, image_data):
+    async def extract_expense_from_image(self, image_data, mime_type=None):
         """Extract expense information from receipt image using Gemini Vision"""
         try:
             system_prompt = """You are an Indonesian receipt OCR expert. Analyze receipt images and extract expense information.
@@ -33,12 +168,13 @@ class GeminiService:
             - Extract text carefully, handle Indonesian currency format
             """
 
-            response = self.client.models.generate_content(
+            response = await self._generate_content(
+                timeout=Config.GEMINI_IMAGE_TIMEOUT,
                 model="gemini-2.5-flash",
                 contents=[
                     types.Part.from_bytes(
                         data=image_data,
-                        mime_type="image/jpeg",
+                        mime_type=mime_type or detect_mime_type(image_data),
                     ),
                     "Analyze this receipt image and extract expense information in JSON format."
                 ],
@@ -62,6 +198,11 @@ class GeminiService:
             
             return None
                 
+        except CircuitOpenError:
+            raise
+        except asyncio.TimeoutError:
+            logger.error("Timed out extracting expense from image")
+            return None
         except Exception as e:
             logger.error(f"Error extracting expense from image: {e}")
             return None
@@ -77,52 +218,105 @@ class GeminiService:
             return None
     
     async def extract_expense_from_text(self, text):
+        """Extract expense/income information from text, using the response cache when possible"""
+        key = self.normalizer.normalize(text)
+        cached = self.text_cache.get(key)
+        if cached is not None:
+            return dict(cached)
+        
+        if self.text_batcher:
+            result = await self.text_batcher.submit(text)
+        else:
+            result = await self._generate_expense_from_text(text)
+        if result:
+            self.text_cache.put(key, result)
+        return result
+    
+    async def extract_expenses_from_texts(self, texts):
+        """Extract one transaction per text with a single model request for the uncached ones"""
+        keys = [self.normalizer.normalize(text) for text in texts]
+        results = [self.text_cache.get(key) for key in keys]
+        results = [dict(result) if result is not None else None for result in results]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            generated = await self._generate_expense_batch([texts[i] for i in missing])
+            for i, result in zip(missing, generated):
+                results[i] = result
+                if result:
+                    self.text_cache.put(keys[i], result)
+        return results
+    
+    async def _generate_expense_from_text(self, text):
         """Extract expense/income information from text using Gemini"""
         try:
-            system_prompt = """You are an Indonesian expense tracking assistant. Analyze text to extract expense or income information.
-
-            Extract information and respond in JSON format:
-            {
-                "type": string ("pengeluaran" or "pemasukan"),
-                "amount": number (amount in rupiah, no decimal),
-                "category": string (one of: makanan, transportasi, belanja, kesehatan, hiburan, pendidikan, tagihan, gaji, bonus, investasi, lainnya),
-                "description": string (brief description in Indonesian)
-            }
-
-            Rules:
-            - Detect if it's expense (pengeluaran) or income (pemasukan)
-            - Convert text amounts to numbers (e.g., "25 ribu" = 25000, "2 juta" = 2000000)
-            - Choose appropriate category based on context
-            - If no clear amount is found, set amount to 0
-            - Description should be concise and descriptive
-            
-            Examples of expense indicators: beli, bayar, buat, spend, keluar
-            Examples of income indicators: dapat, terima, gaji, bonus, untung, masuk
-            """
-
-            response = self.client.models.generate_content(
+            response = await self._generate_content(
                 model="gemini-2.5-flash",
                 contents=f"Analyze this text for expense/income information: \"{text}\"",
                 config=types.GenerateContentConfig(
-                    system_instruction=system_prompt,
+                    system_instruction=self.TEXT_SYSTEM_PROMPT,
                     response_mime_type="application/json",
                 ),
             )
             
             if response.text:
-                result = json.loads(response.text)
-                
-                # Validate result
-                if result.get('amount', 0) > 0:
-                    return {
-                        'type': result.get('type', 'pengeluaran'),
-                        'amount': float(result['amount']),
-                        'category': result.get('category', 'lainnya'),
-                        'description': result.get('description', 'Transaksi')
-                    }
+                return self._text_result(json.loads(response.text))
             
             return None
                 
+        except CircuitOpenError:
+            raise
+        except asyncio.TimeoutError:
+            logger.error("Timed out extracting expense from text")
+            return None
         except Exception as e:
             logger.error(f"Error extracting expense from text: {e}")
             return None
+    
+    async def _generate_expense_batch(self, texts):
+        """Extract several messages with one request, falling back to single calls if the reply is malformed"""
+        if len(texts) == 1:
+            return [await self._generate_expense_from_text(texts[0])]
+        messages = "\n".join(f"{i + 1}. \"{text}\"" for i, text in enumerate(texts))
+        try:
+            response = await self._generate_content(
+                model="gemini-2.5-flash",
+                contents=(
+                    f"Analyze each of these {len(texts)} messages for expense/income information. "
+                    f"Respond with a JSON array of exactly {len(texts)} objects, one per message, "
+                    f"in the same order:\n{messages}"
+                ),
+                config=types.GenerateContentConfig(
+                    system_instruction=self.TEXT_SYSTEM_PROMPT,
+                    response_mime_type="application/json",
+                ),
+            )
+        except CircuitOpenError:
+            raise
+        except asyncio.TimeoutError:
+            logger.error(f"Timed out extracting expenses from a batch of {len(texts)} messages")
+            return [None] * len(texts)
+        except Exception as e:
+            # A failing API counts once on the breaker; retrying each message would multiply the load
+            logger.error(f"Error extracting expenses from a batch of {len(texts)} messages: {e}")
+            return [None] * len(texts)
+        try:
+            results = json.loads(response.text or 'null')
+            if not isinstance(results, list) or len(results) != len(texts):
+                raise ValueError(f"expected {len(texts)} results, got {results!r:.200}")
+            return [self._text_result(result) if isinstance(result, dict) else None for result in results]
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Malformed batch reply, falling back to single calls: {e}")
+            self.batch_fallbacks += 1
+            return await asyncio.gather(*(self._generate_expense_from_text(text) for text in texts))
+    
+    @staticmethod
+    def _text_result(result):
+        """Validate one model extraction; None when no amount was found"""
+        if result.get('amount', 0) > 0:
+            return {
+                'type': result.get('type', 'pengeluaran'),
+                'amount': float(result['amount']),
+                'category': result.get('category', 'lainnya'),
+                'description': result.get('description', 'Transaksi')
+            }
+        return None
@@ -0,0 +1,151 @@
+import hashlib
+import io
+import logging
+import threading
+import time
+from collections import OrderedDict
+from config import Config
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+class PhotoDedupCache:
+    """Remember receipt photos that were already recorded, per chat.
+
+    Photos are matched first on Telegram's ``file_unique_id`` (resends and
+    forwards, before downloading anything), then on a fingerprint of the
+    image bytes: a 64-bit difference hash when Pillow is installed, so
+    re-encoded or resized copies still match within ``max_distance`` bits,
+    otherwise an exact SHA-256. Receipts are mostly white paper in a shop's
+    fixed layout, so two different receipts can hash within a few bits too: an
+    image match also needs the extracted amount to be the same. Entries expire
+    after ``ttl`` seconds and the least recently used are evicted past
+    ``max_entries``.
+    """
+
+    def __init__(self, max_entries=None, ttl=None, max_distance=None):
+        self.max_entries = max_entries or Config.PHOTO_CACHE_MAX_ENTRIES
+        self.ttl = ttl or Config.PHOTO_CACHE_TTL
+        self.max_distance = Config.PHOTO_HASH_DISTANCE if max_distance is None else max_distance
+        self._entries = OrderedDict()
+        self._by_file_id = {}
+        self._lock = threading.Lock()
+        self.file_id_hits = 0
+        self.hash_hits = 0
+        self.amount_mismatches = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup_file(self, chat_id, file_unique_id):
+        """Return the entry recorded for this Telegram file, or None"""
+        with self._lock:
+            self._expire()
+            key = self._by_file_id.get((chat_id, file_unique_id))
+            if key is None:
+                return None
+            if self._expired(self._entries[key]):
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            self.file_id_hits += 1
+            return self._entries[key]
+
+    def lookup_image(self, chat_id, fingerprint, expense_data):
+        """Return the entry whose image matches the fingerprint and whose amount matches ``expense_data``, or None"""
+        with self._lock:
+            self._expire()
+            for key, entry in reversed(self._entries.items()):
+                if key[0] != chat_id or not self._matches(fingerprint, key[1]) or self._expired(entry):
+                    continue
+                if not self._same_amount(entry['expense'], expense_data):
+                    # Looks alike but says something else: another receipt from the same template
+                    self.amount_mismatches += 1
+                    continue
+                self._entries.move_to_end(key)
+                self.hash_hits += 1
+                return entry
+            self.misses += 1
+            return None
+
+    def add(self, chat_id, file_unique_id, fingerprint, expense_data):
+        """Record an extracted and saved photo"""
+        # Same-template receipts can share a fingerprint, so each file keeps its own entry
+        key = (chat_id, fingerprint, file_unique_id)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = {
+                'expense': dict(expense_data),
+                'recorded_at': time.time(),
+                'file_unique_id': file_unique_id,
+            }
+            self._by_file_id[(chat_id, file_unique_id)] = key
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_metrics(self):
+        """Return hit/miss counters and the current size"""
+        with self._lock:
+            lookups = self.file_id_hits + self.hash_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hash': 'dhash' if Image else 'sha256',
+                'file_id_hits': self.file_id_hits,
+                'hash_hits': self.hash_hits,
+                'amount_mismatches': self.amount_mismatches,
+                'misses': self.misses,
+                'hit_rate': round((self.file_id_hits + self.hash_hits) / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+            }
+
+    @staticmethod
+    def fingerprint(image_bytes):
+        """Return a perceptual hash (int) of the image, or a SHA-256 hex digest without Pillow"""
+        if Image is not None:
+            try:
+                with Image.open(io.BytesIO(image_bytes)) as image:
+                    pixels = list(image.convert('L').resize((9, 8)).getdata())
+                value = 0
+                for row in range(8):
+                    for col in range(8):
+                        left = pixels[row * 9 + col]
+                        right = pixels[row * 9 + col + 1]
+                        value = (value << 1) | (left > right)
+                return value
+            except Exception as e:
+                logger.warning(f"Could not hash image, falling back to SHA-256: {e}")
+        return hashlib.sha256(image_bytes).hexdigest()
+
+    def _matches(self, fingerprint, other):
+        if isinstance(fingerprint, int) and isinstance(other, int):
+            return bin(fingerprint ^ other).count('1') <= self.max_distance
+        return fingerprint == other
+
+    @staticmethod
+    def _same_amount(expense, other):
+        try:
+            return abs(float(expense['amount']) - float(other['amount'])) < 0.5
+        except (KeyError, TypeError, ValueError):
+            return False
+
+    def _expired(self, entry):
+        return time.time() - entry['recorded_at'] > self.ttl
+
+    def _expire(self):
+        # Trim from the LRU end; recently used but expired entries are skipped on lookup
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if not self._expired(entry):
+                break
+            self._remove(key)
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        file_key = (key[0], entry['file_unique_id'])
+        if self._by_file_id.get(file_key) == key:
+            del self._by_file_id[file_key]
@@ -0,0 +1,272 @@
+import asyncio
+import logging
+import signal
+import time
+from collections import deque
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from telegram import Update
+from telegram.error import RetryAfter
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class PollingRunner:
+    """Long-poll Telegram for updates and hand them to an ``UpdateDispatcher``.
+
+    Each ``getUpdates`` call fetches up to ``batch_size`` updates. The dispatcher
+    handles different chats concurrently and each chat in order. Telegram forgets
+    every update below the ``offset`` of the next ``getUpdates`` call, so the
+    offset only moves past the oldest update that is still being handled; if the
+    process dies, unfinished updates are delivered again. Updates Telegram sends
+    again while they are still in flight are skipped.
+
+    A slow update at the head (e.g. an OCR call near its timeout) pins the offset,
+    and polls keep returning the same window. Once ``REFETCH_LIMIT`` polls in a
+    row bring nothing new, fetching moves past it so later traffic gets through;
+    that update is then no longer redelivered if the process dies.
+
+    Updates that piled up while the bot was down are old traffic: everything
+    fetched up to the first poll that returns less than a full batch is the
+    startup backlog, and until it is handled per-chat throttling is lifted
+    (per-chat order is kept), so it drains at worker speed. Later traffic doesn't
+    delay that. An update the dispatcher has no room for waits for a completion
+    instead of being resubmitted on every iteration.
+
+    On SIGTERM or SIGINT polling stops, in-flight updates are drained for up to
+    ``drain_timeout`` seconds and the final offset is committed.
+    """
+
+    PROGRESS_LOG_INTERVAL = 10
+    # Polls in a row that may return only in-flight updates before fetching skips past the offset
+    REFETCH_LIMIT = 3
+
+    def __init__(self, dispatcher, batch_size=None, poll_timeout=None, max_in_flight=None, drain_timeout=None):
+        self.dispatcher = dispatcher
+        self.batch_size = batch_size or Config.POLLING_BATCH_SIZE
+        self.poll_timeout = Config.POLLING_TIMEOUT if poll_timeout is None else poll_timeout
+        self.max_in_flight = max_in_flight or Config.POLLING_MAX_IN_FLIGHT
+        self.drain_timeout = Config.POLLING_DRAIN_TIMEOUT if drain_timeout is None else drain_timeout
+        self._unfinished = set()
+        self._backlog = deque()
+        self._next_offset = None
+        self._progress = None
+        self._request = None
+        self._stopping = False
+        self._future = None
+        self._last_log = 0.0
+        self._backlog_fetched = False
+        self._startup_backlog = set()
+        self._held_offset = None
+        self._held_polls = 0
+        self.catching_up = False
+        self.started_at = None
+        self.polls = 0
+        self.fetched = 0
+        self.refetched = 0
+        self.handled = 0
+        self.poll_errors = 0
+
+    @property
+    def offset(self):
+        """Lowest update_id not handled yet; Telegram may forget everything below it"""
+        if self._unfinished:
+            return min(self._unfinished)
+        return self._next_offset
+
+    @property
+    def fetch_offset(self):
+        """Offset for the next getUpdates: ``offset``, or past it once a slow update has held it too long"""
+        if self._held_polls >= self.REFETCH_LIMIT:
+            return self._next_offset
+        return self.offset
+
+    def run(self, install_signal_handlers=True):
+        """Poll until SIGTERM/SIGINT or ``stop()``, then drain and stop the dispatcher (blocking)"""
+        if install_signal_handlers:
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, self._handle_signal)
+        self.started_at = time.perf_counter()
+        self._future = asyncio.run_coroutine_threadsafe(self._poll_loop(), self.dispatcher.loop)
+        try:
+            while True:
+                try:
+                    # Short waits keep the main thread responsive to signals
+                    self._future.result(timeout=1)
+                    break
+                except FutureTimeoutError:
+                    continue
+        except Exception as e:
+            logger.error(f"Polling stopped with an error: {e}")
+        finally:
+            self.dispatcher.stop()
+            logger.info(f"Polling stopped: {self.handled} updates handled, next offset {self.offset}")
+
+    def stop(self):
+        """Ask the polling loop to stop from any thread"""
+        self.dispatcher.loop.call_soon_threadsafe(self._request_stop)
+
+    def get_metrics(self):
+        elapsed = time.perf_counter() - self.started_at if self.started_at else 0.0
+        return {
+            'polls': self.polls,
+            'fetched': self.fetched,
+            'refetched': self.refetched,
+            'startup_backlog': len(self._startup_backlog),
+            'handled': self.handled,
+            'handled_per_second': round(self.handled / elapsed, 1) if elapsed else 0.0,
+            'in_flight': len(self._unfinished),
+            'catching_up': self.catching_up,
+            'poll_errors': self.poll_errors,
+            'offset': self.offset,
+        }
+
+    def _handle_signal(self, signum, frame):
+        logger.info(f"Received signal {signum}, draining in-flight updates")
+        self.stop()
+
+    def _request_stop(self):
+        self._stopping = True
+        if self._request is not None:
+            self._request.cancel()
+        if self._progress is not None:
+            self._progress.set()
+
+    async def _poll_loop(self):
+        self._progress = asyncio.Event()
+        bot = self.dispatcher.application.bot
+        await bot.delete_webhook()
+        self.catching_up = True
+        self.dispatcher.drain()
+        error_delay = 1
+        while not self._stopping:
+            self._submit_backlog()
+            if self._backlog or len(self._unfinished) >= self.max_in_flight:
+                await self._wait_for_progress(1)
+                if not self.dispatcher.running:
+                    break
+                continue
+            try:
+                self._request = asyncio.ensure_future(bot.get_updates(
+                    offset=self.fetch_offset,
+                    limit=self.batch_size,
+                    timeout=self.poll_timeout,
+                    allowed_updates=Update.ALL_TYPES
+                ))
+                updates = await self._request
+            except asyncio.CancelledError:
+                if self._stopping:
+                    break
+                raise
+            except Exception as e:
+                self.poll_errors += 1
+                delay = e.retry_after if isinstance(e, RetryAfter) else error_delay
+                if hasattr(delay, 'total_seconds'):
+                    delay = delay.total_seconds()
+                logger.warning(f"getUpdates failed ({e}), retrying in {delay}s")
+                error_delay = min(error_delay * 2, 60)
+                await self._wait_for_progress(delay)
+                continue
+            finally:
+                self._request = None
+            error_delay = 1
+            self.polls += 1
+            fresh = self._add_updates(updates)
+            self._track_held_offset(bool(updates) and not fresh)
+            if len(updates) < self.batch_size:
+                self._backlog_fetched = True
+                self._check_caught_up()
+            self._submit_backlog()
+            if updates and not fresh:
+                # Everything returned is still in flight; polling again right away would spin
+                await self._wait_for_progress(self.poll_timeout or 1)
+            self._log_progress()
+        await self._drain(bot)
+
+    def _add_updates(self, updates):
+        """Queue updates not seen before; returns how many there were"""
+        fresh = 0
+        for update in updates:
+            update_id = update.update_id
+            if update_id in self._unfinished or (self._next_offset is not None and update_id < self._next_offset):
+                self.refetched += 1
+                continue
+            self._unfinished.add(update_id)
+            if not self._backlog_fetched:
+                self._startup_backlog.add(update_id)
+            self._backlog.append(update)
+            fresh += 1
+        self.fetched += fresh
+        if updates:
+            self._next_offset = max(self._next_offset or 0, updates[-1].update_id + 1)
+        return fresh
+
+    def _track_held_offset(self, only_refetched):
+        offset = self.offset
+        if offset != self._held_offset or offset == self._next_offset:
+            # The head finished (or nothing is in flight): count from scratch
+            self._held_offset, self._held_polls = offset, 0
+        if self._held_polls >= self.REFETCH_LIMIT:
+            return
+        if not only_refetched:
+            self._held_polls = 0
+            return
+        self._held_polls += 1
+        if self._held_polls == self.REFETCH_LIMIT:
+            logger.info(f"Update {offset} is still in flight after {self._held_polls} polls that brought nothing new; "
+                           f"fetching past it, so it won't be redelivered if the process dies")
+
+    def _submit_backlog(self):
+        # Stop at the first update without room so a chat's later updates never overtake it.
+        # Checking first keeps the dispatcher's rejected/rate_limited counters for real overload
+        while self._backlog:
+            update = self._backlog[0]
+            if not self.dispatcher.has_room(update) or not self.dispatcher.submit(update, on_done=self._handled):
+                break
+            self._backlog.popleft()
+
+    def _handled(self, update):
+        self._unfinished.discard(update.update_id)
+        self._startup_backlog.discard(update.update_id)
+        self.handled += 1
+        self._check_caught_up()
+        self._progress.set()
+
+    def _check_caught_up(self):
+        if self.catching_up and self._backlog_fetched and not self._startup_backlog and not self._stopping:
+            self.catching_up = False
+            self.dispatcher.resume_throttling()
+            logger.info(f"Caught up after {self.handled} updates, per-chat throttling resumed")
+
+    async def _wait_for_progress(self, timeout):
+        self._progress.clear()
+        try:
+            await asyncio.wait_for(self._progress.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _drain(self, bot):
+        self.dispatcher.drain()
+        # Updates the dispatcher never accepted are left for Telegram to deliver again
+        waiting = {update.update_id for update in self._backlog}
+        deadline = time.monotonic() + self.drain_timeout
+        while self._unfinished - waiting and time.monotonic() < deadline:
+            await self._wait_for_progress(deadline - time.monotonic())
+        unfinished = len(self._unfinished)
+        if self._next_offset is not None:
+            try:
+                # Confirms everything below the offset without waiting for new updates
+                await bot.get_updates(offset=self.offset, limit=1, timeout=0)
+            except Exception as e:
+                logger.warning(f"Could not commit polling offset {self.offset}: {e}")
+        logger.info(f"Drained polling runner, {unfinished} updates left for redelivery")
+
+    def _log_progress(self):
+        now = time.monotonic()
+        if now - self._last_log < self.PROGRESS_LOG_INTERVAL:
+            return
+        self._last_log = now
+        metrics = self.get_metrics()
+        logger.info(
+            f"Polling: {metrics['handled']} handled ({metrics['handled_per_second']}/s), "
+            f"{metrics['in_flight']} in flight, offset {metrics['offset']}"
+        )
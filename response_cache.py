@@ -0,0 +1,125 @@
+import atexit
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from json_file import AtomicJsonFile, PeriodicSaver
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """LRU cache with TTL and entry/byte limits for JSON-serializable values.
+
+    With a ``path`` the cache is loaded at startup and, when it changed, written
+    back (atomically) every ``persist_interval`` seconds by a background thread
+    and on interpreter exit, so entries survive restarts without ``put`` ever
+    serializing the cache on the caller's thread.
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=1_000_000, ttl=86400, path=None, persist_interval=60):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.path = path
+        self.persist_interval = persist_interval
+        self._file = AtomicJsonFile(path, ensure_ascii=False) if path else None
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._saver = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.path:
+            self._load()
+            self._saver = PeriodicSaver(self.save, persist_interval, name="response-cache-saver")
+            atexit.register(self.save)
+
+    def get(self, key):
+        """Return the cached value or None, counting a hit or miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, stored_at, size = entry
+            if time.time() - stored_at > self.ttl:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Store a value, evicting least recently used entries past the limits"""
+        size = len(key) + len(json.dumps(value, ensure_ascii=False))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.time(), size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+            self._dirty = True
+
+    def get_metrics(self):
+        """Return hit/miss/eviction counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+            }
+
+    def save(self):
+        """Write the cache to disk if it changed since the last save"""
+        if not self._file:
+            return
+        try:
+            self._file.save(self._snapshot)
+        except Exception as e:
+            logger.error(f"Error saving response cache to {self.path}: {e}")
+            with self._lock:
+                # Let the next round try again
+                self._dirty = True
+
+    def _snapshot(self):
+        with self._lock:
+            if not self._dirty:
+                return None
+            self._dirty = False
+            return [[key, value, stored_at] for key, (value, stored_at, _) in self._entries.items()]
+
+    def _load(self):
+        try:
+            snapshot = self._file.load()
+        except Exception as e:
+            logger.error(f"Error loading response cache from {self.path}: {e}")
+            return
+        if snapshot is None:
+            return
+        now = time.time()
+        for key, value, stored_at in snapshot:
+            if now - stored_at <= self.ttl:
+                size = len(key) + len(json.dumps(value, ensure_ascii=False))
+                self._entries[key] = (value, stored_at, size)
+                self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+        logger.info(f"Loaded {len(self._entries)} cached responses from {self.path}")
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
@@ -0,0 +1,123 @@
+import logging
+from datetime import date
+
+logger = logging.getLogger(__name__)
+
+class RollupStore:
+    """Running totals per (date, type, category) with month and year rollups.
+
+    Each table maps a period key to ``{type: {category: total}}`` so a monthly or
+    yearly summary is a single dict lookup. Totals are updated as records are
+    added; ``rebuild`` recomputes everything from a record list.
+    """
+
+    def __init__(self, records=None):
+        self.daily = {}
+        self.monthly = {}
+        self.yearly = {}
+        if records:
+            self.rebuild(records)
+
+    def rebuild(self, records):
+        """Recompute all rollups from scratch"""
+        self.daily = {}
+        self.monthly = {}
+        self.yearly = {}
+        for record in records:
+            self.add(record)
+
+    def add(self, record):
+        """Fold one ledger record into the daily, monthly and yearly totals"""
+        entry = _parse_record(record)
+        if not entry:
+            return
+        record_date, type, category, amount = entry
+        for table, key in (
+            (self.daily, record_date.toordinal()),
+            (self.monthly, (record_date.year, record_date.month)),
+            (self.yearly, record_date.year),
+        ):
+            by_category = table.setdefault(key, {}).setdefault(type, {})
+            by_category[category] = by_category.get(category, 0) + amount
+
+    def day_totals(self, target_date):
+        """Return {type: {category: total}} for one day"""
+        return _copy_totals(self.daily.get(target_date.toordinal()))
+
+    def month_totals(self, year, month):
+        """Return {type: {category: total}} for a calendar month"""
+        return _copy_totals(self.monthly.get((year, month)))
+
+    def year_totals(self, year):
+        """Return {type: {category: total}} for a calendar year"""
+        return _copy_totals(self.yearly.get(year))
+
+    def verify(self, records):
+        """Compare month and year rollups against a full recomputation.
+
+        Returns a list of human-readable mismatch descriptions; empty means consistent.
+        """
+        expected = RollupStore(records)
+        mismatches = []
+        for name, actual_table, expected_table in (
+            ('bulan', self.monthly, expected.monthly),
+            ('tahun', self.yearly, expected.yearly),
+        ):
+            for key in sorted(set(actual_table) | set(expected_table), key=str):
+                actual = actual_table.get(key, {})
+                wanted = expected_table.get(key, {})
+                if not _totals_equal(actual, wanted):
+                    mismatches.append(f"{name} {key}: rollup {actual} != hitung ulang {wanted}")
+        return mismatches
+
+
+def summarize_records(records):
+    """Compute {type: {category: total}} for an arbitrary list of ledger records"""
+    totals = {}
+    for record in records:
+        entry = _parse_record(record)
+        if not entry:
+            continue
+        _, type, category, amount = entry
+        by_category = totals.setdefault(type, {})
+        by_category[category] = by_category.get(category, 0) + amount
+    return totals
+
+
+def add_totals(totals, more):
+    """Add one {type: {category: total}} dict into another in place"""
+    for type, by_category in more.items():
+        target = totals.setdefault(type, {})
+        for category, amount in by_category.items():
+            target[category] = target.get(category, 0) + amount
+    return totals
+
+
+def _parse_record(record):
+    value = record.get('Tanggal')
+    if not value:
+        return None
+    try:
+        record_date = date.fromisoformat(str(value)[:10])
+        amount = float(record.get('Jumlah') or 0)
+    except (TypeError, ValueError):
+        return None
+    return record_date, record.get('Tipe'), record.get('Kategori'), amount
+
+
+def _copy_totals(totals):
+    if not totals:
+        return {}
+    return {type: dict(by_category) for type, by_category in totals.items()}
+
+
+def _totals_equal(left, right, tolerance=0.005):
+    if set(left) != set(right):
+        return False
+    for type in left:
+        if set(left[type]) != set(right[type]):
+            return False
+        for category in left[type]:
+            if abs(left[type][category] - right[type][category]) > tolerance:
+                return False
+    return True
@@ -4,26 +4,111 @@ from datetime import datetime, timedelta
 import requests
 import json
 import asyncio
+import functools
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from config import Config
 import gspread
+from gspread.utils import rowcol_to_a1
 from google.oauth2.service_account import Credentials
+from ledger_cache import LedgerCache
+from journal import TransactionJournal
+from ledger_export import write_export
+from ledger_index import tenant_key
+from storage import SheetsStorage, SQLiteStorage
+from write_buffer import WriteBehindBuffer
 
 logger = logging.getLogger(__name__)
 
+SHEET_HEADERS = ['Tanggal', 'Tipe', 'Jumlah', 'Kategori', 'Keterangan', 'Timestamp', 'ID', 'Chat']
+
 class SheetsService:
-    def __init__(self):
+    def __init__(self, worksheet=None, journal=None, storage=None, connect=True):
         self.sheet_url = "https://docs.google.com/spreadsheets/d/1q4g3gQb-8N6MEOi9rxtzf6U-izyQtss9tTn6xBlOCTg/edit?usp=drivesdk"
         self.sheet_id = "1q4g3gQb-8N6MEOi9rxtzf6U-izyQtss9tTn6xBlOCTg"
         self.sheet = None
         self.gc = None
-        self._init_sheets()
+        self.cache = None
+        self.sheets_storage = None
+        # A local backend, when configured, answers queries and Sheets becomes a mirror
+        if storage is None and Config.STORAGE_BACKEND == 'sqlite':
+            storage = SQLiteStorage()
+        self.local_storage = storage
+        self.journal = journal or TransactionJournal()
+        self._connect_lock = threading.Lock()
+        self._warm_lock = threading.Lock()
+        self._warmed = False
+        self._seed_lock = threading.Lock()
+        self._seeded = False
+        self._next_seed_attempt = 0.0
+        # gspread is synchronous; its calls run here so handlers don't block the event loop
+        self._executor = ThreadPoolExecutor(
+            max_workers=Config.SHEETS_MAX_WORKERS,
+            thread_name_prefix="sheets"
+        )
+        # Journal and local-storage writes are local disk I/O and never queue behind Sheets
+        self._local_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="ledger-local")
+        if worksheet is not None:
+            self._attach_sheet(worksheet)
+        # Every transaction goes through the journal; the buffer replays it into Sheets
+        self.buffer = WriteBehindBuffer(self.journal, self._append_rows, self._drop_existing)
+        # connect=False defers the network round trips to warm_up(), e.g. on a background thread
+        if connect:
+            self.warm_up()
+    
+    def warm_up(self):
+        """Connect to Google Sheets and seed the local backend once (blocking, idempotent)"""
+        with self._warm_lock:
+            if self._warmed:
+                return
+            if not self.sheet:
+                with self._connect_lock:
+                    if not self.sheet:
+                        self._init_sheets()
+            self._seed_local_storage()
+            self._warmed = True
+    
+    async def _ready_storage(self):
+        """Backend that answers queries, waiting for a pending warm-up off the event loop"""
+        if not self._warmed:
+            await self._run_blocking(self.warm_up)
+        elif self.local_storage and not self._seeded and time.monotonic() >= self._next_seed_attempt:
+            # Sheets was down at warm-up; reconnecting seeds the local backend, off the request path
+            self._next_seed_attempt = time.monotonic() + Config.SHEETS_RETRY_MAX
+            self._executor.submit(self._try_connect)
+        return self.storage
+    
+    @property
+    def storage(self):
+        """Backend that answers queries, or None while Sheets-only mode is offline"""
+        return self.local_storage or self.sheets_storage
+    
+    @property
+    def mirrors_to_sheets(self):
+        return self.local_storage is None or Config.SHEETS_MIRROR
+    
+    async def _run_blocking(self, func, *args, timeout=None):
+        """Run a blocking gspread call on the Sheets thread pool with a deadline"""
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, functools.partial(func, *args))
+        # A timed-out call keeps running in its thread; only the caller stops waiting
+        return await asyncio.wait_for(future, timeout or Config.SHEETS_TIMEOUT)
+    
+    async def _run_local(self, func, *args):
+        """Run a blocking journal or local-storage write on its own small thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._local_executor, functools.partial(func, *args))
     
     def _init_sheets(self):
         """Initialize Google Sheets connection using public link with read access"""
         try:
             # Initialize gspread with anonymous access for public sheets
             self.gc = gspread.Client()
-            self.sheet = self.gc.open_by_key(self.sheet_id).sheet1
+            # gspread waits forever by default; a hung request would hold a pool thread for good
+            self.gc.set_timeout(Config.SHEETS_TIMEOUT)
+            self._attach_sheet(self.gc.open_by_key(self.sheet_id).sheet1)
             
             # Create headers if sheet is empty
             self._ensure_headers()
@@ -31,86 +116,180 @@ class SheetsService:
             logger.info(f"Google Sheets connected successfully: {self.sheet_id[:10]}...")
         except Exception as e:
             logger.error(f"Error initializing Google Sheets: {e}")
-            # Fallback to logging mode
-            logger.info("Running in logging mode - data will be logged only")
+            self.sheet = None
+            self.sheets_storage = None
+            # Fallback to journal-only mode until the replayer reconnects
+            logger.info("Running in offline mode - data will be journaled and replayed later")
+    
+    def _attach_sheet(self, sheet):
+        """Wire a worksheet into the ledger cache and the Sheets backend"""
+        self.sheet = sheet
+        self.cache = LedgerCache(sheet)
+        self.sheets_storage = SheetsStorage(sheet, self.cache, self._unsent_entries)
+    
+    def _seed_local_storage(self):
+        """Copy existing sheet rows into the local backend once per process, skipping rows it already holds"""
+        if self._seeded or not self.local_storage or not self.sheets_storage:
+            return
+        with self._seed_lock:
+            if self._seeded:
+                return
+            try:
+                # Local writes may land before warm-up, so an empty table can't mean "not seeded yet"
+                records = self.cache.get_records()
+                before = self.local_storage.row_count()
+                self.local_storage.import_records(records)
+                added = self.local_storage.row_count() - before
+                self._seeded = True
+                logger.info(f"Seeded {self.local_storage.name} storage with {added} of {len(records)} rows from Google Sheets")
+            except Exception as e:
+                logger.error(f"Error seeding local storage from Google Sheets: {e}")
     
     def _ensure_headers(self):
         """Create headers in the sheet if they don't exist"""
         try:
             # Check if headers exist
-            headers = ['Tanggal', 'Tipe', 'Jumlah', 'Kategori', 'Keterangan', 'Timestamp']
+            headers = SHEET_HEADERS
             
             if self.sheet:
                 existing_headers = self.sheet.row_values(1)
-                if not existing_headers or existing_headers != headers:
+                if not existing_headers:
                     # Add headers
-                    self.sheet.clear()
                     self.sheet.append_row(headers)
                     logger.info("Headers created in Google Sheets")
+                elif existing_headers == headers[:len(existing_headers)] and existing_headers != headers:
+                    # Older layout: extend the header row without touching data
+                    self.sheet.update([headers], 'A1')
+                    logger.info("Headers extended in Google Sheets")
+                elif existing_headers != headers:
+                    logger.warning(f"Unexpected headers in Google Sheets, leaving them as is: {existing_headers}")
                 else:
                     logger.info("Headers already exist in Google Sheets")
                     
         except Exception as e:
             logger.error(f"Error ensuring headers: {e}")
     
-    async def add_expense(self, date, amount, category, description, type="pengeluaran"):
+    def _connect(self):
+        """Reconnect to Google Sheets if the service is offline (blocking)"""
+        with self._connect_lock:
+            if not self.sheet:
+                self._init_sheets()
+        if not self.sheet:
+            raise ConnectionError("Google Sheets is not connected")
+        # Sheets may have been down at warm-up; the first connection that works seeds the local backend
+        self._seed_local_storage()
+    
+    def _try_connect(self):
+        """Reconnect in the background, logging instead of raising (blocking)"""
+        try:
+            self._connect()
+        except ConnectionError as e:
+            logger.info(f"Google Sheets still unreachable: {e}")
+    
+    def _append_rows(self, rows):
+        """Append a batch of rows to the sheet and mirror them into the cache (blocking)"""
+        self._connect()
+        self.sheets_storage.add_rows(rows)
+    
+    def _drop_existing(self, entries):
+        """Filter out journal entries whose transaction ID is already in the sheet (blocking)"""
+        self._connect()
+        existing = self.cache.existing_ids([entry_id for entry_id, _ in entries])
+        return [(entry_id, row) for entry_id, row in entries if entry_id not in existing]
+    
+    def _unsent_entries(self):
+        """Journaled rows the sheet doesn't have yet, so Sheets-backed reads include them"""
+        return self.buffer.pending_entries()
+    
+    async def _query(self, storage, func, *args, timeout=None):
+        """Run a storage query off the loop"""
+        return await self._run_blocking(func, *args, timeout=timeout)
+    
+    def get_metrics(self):
+        """Return write-behind and cache counters"""
+        metrics = {
+            'backend': self.local_storage.name if self.local_storage else 'sheets',
+            'connected': bool(self.sheet),
+            'warmed_up': self._warmed,
+            'seeded': self._seeded if self.local_storage else None,
+            'write_buffer': self.buffer.get_metrics(),
+        }
+        if self.cache:
+            metrics['cache'] = {
+                'rows': len(self.cache.records),
+                'full_reloads': self.cache.full_reloads,
+                'incremental_syncs': self.cache.incremental_syncs,
+                'chats': self.cache.tenant_count,
+            }
+        return metrics
+    
+    async def add_expense(self, date, amount, category, description, type="pengeluaran", chat_id=None):
         """Add expense/income to Google Sheets"""
+        result = await self.add_expenses([{
+            'date': date,
+            'amount': amount,
+            'category': category,
+            'description': description,
+            'type': type,
+            'chat_id': chat_id
+        }])
+        if result:
+            logger.info(f"Recorded {type}: Rp {amount:,.0f} - {description} [{category}]")
+        return result
+    
+    async def add_expenses(self, entries):
+        """Add several transactions (dicts with date, amount, category, description, type, chat_id) in one batch"""
         try:
-            # Format data for the sheet
-            row_data = [
-                date.strftime('%Y-%m-%d'),  # Tanggal
-                type,                       # Tipe
-                amount,                     # Jumlah
-                category,                   # Kategori
-                description,                # Keterangan
-                datetime.now().isoformat() # Timestamp
-            ]
-            
-            # Try to add to Google Sheets
-            if self.sheet:
-                try:
-                    self.sheet.append_row(row_data)
-                    logger.info(f"Added to Google Sheets - {type}: Rp {amount:,.0f} - {description} [{category}]")
-                    return True
-                except Exception as sheet_error:
-                    logger.error(f"Failed to write to Google Sheets: {sheet_error}")
-                    # Fall back to logging
-                    logger.info(f"LOGGED {type}: Rp {amount:,.0f} - {description} [{category}]")
-                    return True
-            else:
-                # Log only mode
-                logger.info(f"LOGGED {type}: Rp {amount:,.0f} - {description} [{category}]")
+            now = datetime.now().isoformat()
+            rows = []
+            for entry in entries:
+                # Format data for the sheet
+                rows.append([
+                    entry['date'].strftime('%Y-%m-%d'),    # Tanggal
+                    entry.get('type', 'pengeluaran'),      # Tipe
+                    entry['amount'],                       # Jumlah
+                    entry['category'],                     # Kategori
+                    entry['description'],                  # Keterangan
+                    now,                                   # Timestamp
+                    uuid.uuid4().hex,                      # ID
+                    tenant_key(entry.get('chat_id'))       # Chat
+                ])
+            if not rows:
                 return True
             
+            if self.local_storage:
+                await self._run_local(self.local_storage.add_rows, rows)
+            
         except Exception as e:
-            logger.error(f"Error adding expense: {e}")
+            logger.error(f"Error adding expenses: {e}")
             return False
+        
+        # Journal the rows; the write-behind buffer batches them into Google Sheets
+        if self.mirrors_to_sheets:
+            try:
+                await self._run_local(self.buffer.add_many, [(row[6], row) for row in rows])
+                if not self.sheet:
+                    logger.info(f"Journaled {len(rows)} rows while offline")
+            except Exception as e:
+                if not self.local_storage:
+                    logger.error(f"Error adding expenses: {e}")
+                    return False
+                # The rows are committed locally; failing here would make the user's retry a duplicate
+                logger.error(f"Stored {len(rows)} rows locally but could not journal them for Google Sheets: {e}")
+        return True
     
-    async def get_daily_summary(self, date):
-        """Get daily summary from Google Sheets"""
+    async def get_daily_summary(self, date, chat_id=None):
+        """Get daily summary from the ledger storage backend"""
         try:
-            if not self.sheet:
+            storage = await self._ready_storage()
+            if not storage:
                 return {
                     'expenses': [],
                     'income': [],
                     'message': f'Silakan cek Google Sheets untuk data {date.strftime("%Y-%m-%d")}'
                 }
             
-            # Get all records
-            records = self.sheet.get_all_records()
-            
-            # Filter by date
-            target_date = date.strftime('%Y-%m-%d')
-            daily_records = [r for r in records if r.get('Tanggal') == target_date]
-            
-            # Group by type
-            expenses = [r for r in daily_records if r.get('Tipe') == 'pengeluaran']
-            income = [r for r in daily_records if r.get('Tipe') == 'pemasukan']
-            
-            return {
-                'expenses': [{'amount': r['Jumlah'], 'category': r['Kategori'], 'description': r['Keterangan']} for r in expenses],
-                'income': [{'amount': r['Jumlah'], 'category': r['Kategori'], 'description': r['Keterangan']} for r in income]
-            }
+            return {'totals': await self._query(storage, storage.get_totals, chat_id, date, date)}
             
         except Exception as e:
             logger.error(f"Error getting daily summary: {e}")
@@ -120,37 +299,18 @@ class SheetsService:
                 'message': f'Error mengambil data: {str(e)}'
             }
     
-    async def get_custom_summary(self, start_date, end_date):
-        """Get custom date range summary from Google Sheets"""
+    async def get_custom_summary(self, start_date, end_date, chat_id=None):
+        """Get custom date range summary from the ledger storage backend"""
         try:
-            if not self.sheet:
+            storage = await self._ready_storage()
+            if not storage:
                 return {
                     'expenses': [],
                     'income': [],
                     'message': f'Silakan cek Google Sheets untuk data {start_date.strftime("%Y-%m-%d")} - {end_date.strftime("%Y-%m-%d")}'
                 }
             
-            # Get all records
-            records = self.sheet.get_all_records()
-            
-            # Filter by date range
-            start_str = start_date.strftime('%Y-%m-%d')
-            end_str = end_date.strftime('%Y-%m-%d')
-            
-            range_records = []
-            for r in records:
-                record_date = r.get('Tanggal')
-                if record_date and start_str <= record_date <= end_str:
-                    range_records.append(r)
-            
-            # Group by type
-            expenses = [r for r in range_records if r.get('Tipe') == 'pengeluaran']
-            income = [r for r in range_records if r.get('Tipe') == 'pemasukan']
-            
-            return {
-                'expenses': [{'amount': r['Jumlah'], 'category': r['Kategori'], 'description': r['Keterangan']} for r in expenses],
-                'income': [{'amount': r['Jumlah'], 'category': r['Kategori'], 'description': r['Keterangan']} for r in income]
-            }
+            return {'totals': await self._query(storage, storage.get_totals, chat_id, start_date, end_date)}
             
         except Exception as e:
             logger.error(f"Error getting custom summary: {e}")
@@ -160,35 +320,18 @@ class SheetsService:
                 'message': f'Error mengambil data: {str(e)}'
             }
     
-    async def get_monthly_summary(self, date):
-        """Get monthly summary from Google Sheets"""
+    async def get_monthly_summary(self, date, chat_id=None):
+        """Get monthly summary from the ledger storage backend"""
         try:
-            if not self.sheet:
+            storage = await self._ready_storage()
+            if not storage:
                 return {
                     'expenses': [],
                     'income': [],
                     'message': f'Silakan cek Google Sheets untuk data bulan {date.strftime("%B %Y")}'
                 }
             
-            # Get all records
-            records = self.sheet.get_all_records()
-            
-            # Filter by month and year
-            target_month = date.strftime('%Y-%m')
-            monthly_records = []
-            for r in records:
-                record_date = r.get('Tanggal')
-                if record_date and record_date.startswith(target_month):
-                    monthly_records.append(r)
-            
-            # Group by type
-            expenses = [r for r in monthly_records if r.get('Tipe') == 'pengeluaran']
-            income = [r for r in monthly_records if r.get('Tipe') == 'pemasukan']
-            
-            return {
-                'expenses': [{'amount': r['Jumlah'], 'category': r['Kategori'], 'description': r['Keterangan']} for r in expenses],
-                'income': [{'amount': r['Jumlah'], 'category': r['Kategori'], 'description': r['Keterangan']} for r in income]
-            }
+            return {'totals': await self._query(storage, storage.get_month_totals, chat_id, date.year, date.month)}
             
         except Exception as e:
             logger.error(f"Error getting monthly summary: {e}")
@@ -198,35 +341,18 @@ class SheetsService:
                 'message': f'Error mengambil data: {str(e)}'
             }
     
-    async def get_yearly_summary(self, year):
-        """Get yearly summary from Google Sheets"""
+    async def get_yearly_summary(self, year, chat_id=None):
+        """Get yearly summary from the ledger storage backend"""
         try:
-            if not self.sheet:
+            storage = await self._ready_storage()
+            if not storage:
                 return {
                     'expenses': [],
                     'income': [],
                     'message': f'Silakan cek Google Sheets untuk data tahun {year}'
                 }
             
-            # Get all records
-            records = self.sheet.get_all_records()
-            
-            # Filter by year
-            target_year = str(year)
-            yearly_records = []
-            for r in records:
-                record_date = r.get('Tanggal')
-                if record_date and record_date.startswith(target_year):
-                    yearly_records.append(r)
-            
-            # Group by type
-            expenses = [r for r in yearly_records if r.get('Tipe') == 'pengeluaran']
-            income = [r for r in yearly_records if r.get('Tipe') == 'pemasukan']
-            
-            return {
-                'expenses': [{'amount': r['Jumlah'], 'category': r['Kategori'], 'description': r['Keterangan']} for r in expenses],
-                'income': [{'amount': r['Jumlah'], 'category': r['Kategori'], 'description': r['Keterangan']} for r in income]
-            }
+            return {'totals': await self._query(storage, storage.get_year_totals, chat_id, int(year))}
             
         except Exception as e:
             logger.error(f"Error getting yearly summary: {e}")
@@ -234,4 +360,69 @@ class SheetsService:
                 'expenses': [],
                 'income': [],
                 'message': f'Error mengambil data: {str(e)}'
-            }
\ No newline at end of file
+            }
+    
+    async def export_records(self, start_date, end_date, path, format='csv', chat_id=None):
+        """Stream ledger rows in a date range into a CSV/XLSX file; returns row count and seconds taken"""
+        storage = await self._ready_storage()
+        if not storage:
+            return None
+        
+        def export():
+            started = time.perf_counter()
+            rows = write_export(storage.iter_records(chat_id, start_date, end_date), path, format)
+            return rows, time.perf_counter() - started
+        
+        rows, elapsed = await self._query(storage, export, timeout=Config.EXPORT_TIMEOUT)
+        logger.info(f"Exported {rows} rows to {format} in {elapsed:.2f}s ({rows / max(elapsed, 1e-9):,.0f} rows/s)")
+        return rows, elapsed
+    
+    def migrate_legacy_rows(self, chat_id, dry_run=False):
+        """Assign rows without a Chat value to ``chat_id`` in the sheet and local store (blocking).
+        
+        Returns the number of sheet rows and local rows that were (or would be) moved.
+        """
+        chat = tenant_key(chat_id)
+        self._connect()
+        self.buffer.flush()
+        self._ensure_headers()
+        self.cache.sync(force=True)
+        column = self.cache.header.index('Chat') + 1
+        
+        # Contiguous runs of blank Chat cells become one range each
+        runs = []
+        for row_number, record in enumerate(self.cache.records, start=2):
+            if record.get('Tanggal') and record.get('Chat') in (None, ''):
+                if runs and runs[-1][1] == row_number - 1:
+                    runs[-1][1] = row_number
+                else:
+                    runs.append([row_number, row_number])
+        sheet_rows = sum(last - first + 1 for first, last in runs)
+        
+        if not dry_run:
+            for start in range(0, len(runs), 500):
+                self.sheet.batch_update([
+                    {
+                        'range': f"{rowcol_to_a1(first, column)}:{rowcol_to_a1(last, column)}",
+                        'values': [[chat]] * (last - first + 1)
+                    }
+                    for first, last in runs[start:start + 500]
+                ])
+            self.cache.invalidate()
+        
+        local_rows = 0
+        if self.local_storage and not dry_run:
+            local_rows = self.local_storage.assign_tenant(chat)
+        logger.info(f"Assigned {sheet_rows} sheet rows and {local_rows} local rows to chat {chat}")
+        return sheet_rows, local_rows
+    
+    async def rebuild_rollups(self, chat_id=None):
+        """Check one chat's derived totals against a full recomputation, then rebuild them from the source.
+        
+        Returns None while no backend is connected; ``rebuilt`` is False when the
+        backend keeps no derived totals.
+        """
+        storage = await self._ready_storage()
+        if not storage:
+            return None
+        return await self._query(storage, storage.rebuild, chat_id)
@@ -0,0 +1,269 @@
+import logging
+import os
+import sqlite3
+import threading
+from collections import Counter
+from datetime import date, timedelta
+from config import Config
+from ledger_index import tenant_key
+from rollups import summarize_records
+
+logger = logging.getLogger(__name__)
+
+class LedgerStorage:
+    """Storage backend interface used by SheetsService.
+
+    Rows are lists in sheet column order (Tanggal, Tipe, Jumlah, Kategori,
+    Keterangan, Timestamp, ID, Chat); records come back as header-keyed dicts
+    and totals as ``{type: {category: total}}``. Every query is scoped to one
+    chat (tenant). All methods are blocking.
+    """
+
+    name = None
+
+    def add_rows(self, rows):
+        raise NotImplementedError
+
+    def get_records(self, chat_id, start_date, end_date):
+        raise NotImplementedError
+
+    def get_totals(self, chat_id, start_date, end_date):
+        raise NotImplementedError
+
+    def iter_records(self, chat_id, start_date, end_date):
+        """Yield records in date order without materializing the whole range"""
+        yield from self.get_records(chat_id, start_date, end_date)
+
+    def get_month_totals(self, chat_id, year, month):
+        raise NotImplementedError
+
+    def get_year_totals(self, chat_id, year):
+        raise NotImplementedError
+
+    def row_count(self):
+        raise NotImplementedError
+
+    def rebuild(self, chat_id):
+        """Check one chat's derived totals against the source and rebuild them.
+
+        Returns ``{'rebuilt', 'mismatches', 'rows'}`` for the chat. Backends that
+        aggregate on every query keep no derived totals and report ``rebuilt`` False.
+        """
+        raise NotImplementedError
+
+
+class SheetsStorage(LedgerStorage):
+    """Google Sheets backend answering queries from the in-memory ledger cache"""
+
+    name = 'sheets'
+
+    def __init__(self, sheet, cache, unsent=None):
+        self.sheet = sheet
+        self.cache = cache
+        # Returns (id, row) pairs journaled but not in the sheet yet; reads count them too
+        self.unsent = unsent or tuple
+
+    def add_rows(self, rows):
+        response = self.sheet.append_rows(rows)
+        self.cache.append(rows, response)
+
+    def get_records(self, chat_id, start_date, end_date):
+        return self.cache.get_range(chat_id, start_date, end_date, self.unsent())
+
+    def get_totals(self, chat_id, start_date, end_date):
+        return summarize_records(self.get_records(chat_id, start_date, end_date))
+
+    def iter_records(self, chat_id, start_date, end_date):
+        # The cache already holds every row; the range slice only copies references
+        yield from self.get_records(chat_id, start_date, end_date)
+
+    def get_month_totals(self, chat_id, year, month):
+        return self.cache.get_month_totals(chat_id, year, month, self.unsent())
+
+    def get_year_totals(self, chat_id, year):
+        return self.cache.get_year_totals(chat_id, year, self.unsent())
+
+    def row_count(self):
+        self.cache.sync()
+        return len(self.cache.records)
+
+    def rebuild(self, chat_id):
+        mismatches, rows = self.cache.verify_rollups(chat_id)
+        if mismatches:
+            logger.warning(f"Rollup mismatches for chat {tenant_key(chat_id)} before rebuild: {mismatches}")
+        return {'rebuilt': True, 'mismatches': mismatches, 'rows': rows}
+
+
+class SQLiteStorage(LedgerStorage):
+    """Local SQLite backend partitioned by chat, with indexed dates and SQL aggregation"""
+
+    name = 'sqlite'
+    COLUMNS = ('tanggal', 'tipe', 'jumlah', 'kategori', 'keterangan', 'timestamp', 'id', 'chat_id')
+    HEADERS = ('Tanggal', 'Tipe', 'Jumlah', 'Kategori', 'Keterangan', 'Timestamp', 'ID', 'Chat')
+
+    def __init__(self, path=None):
+        self.path = path or Config.SQLITE_PATH
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ledger ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " tanggal TEXT NOT NULL,"
+            " tipe TEXT NOT NULL,"
+            " jumlah REAL NOT NULL,"
+            " kategori TEXT,"
+            " keterangan TEXT,"
+            " timestamp TEXT,"
+            " id TEXT UNIQUE,"
+            " chat_id TEXT NOT NULL DEFAULT '')"
+        )
+        self._migrate_tenants()
+        # Covering index per chat: range scans and GROUP BY never touch the table itself
+        self._conn.execute("DROP INDEX IF EXISTS ledger_by_date")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ledger_by_chat_date"
+            " ON ledger (chat_id, tanggal, tipe, kategori, jumlah)"
+        )
+        self._conn.commit()
+
+    def _migrate_tenants(self):
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(ledger)")]
+        if 'chat_id' not in columns:
+            logger.info("Adding chat_id column to the SQLite ledger")
+            self._conn.execute("ALTER TABLE ledger ADD COLUMN chat_id TEXT NOT NULL DEFAULT ''")
+        if Config.LEGACY_CHAT_ID:
+            self.assign_tenant(Config.LEGACY_CHAT_ID, commit=False)
+
+    def assign_tenant(self, chat_id, commit=True):
+        """Move rows without a chat into the given chat's partition; returns the number moved"""
+        with self._lock:
+            moved = self._conn.execute(
+                "UPDATE ledger SET chat_id = ? WHERE chat_id = ''", (tenant_key(chat_id),)
+            ).rowcount
+            if commit:
+                self._conn.commit()
+        if moved:
+            logger.info(f"Assigned {moved} SQLite ledger rows to chat {chat_id}")
+        return moved
+
+    def _values(self, rows):
+        values = []
+        for row in rows:
+            row = list(row) + [None] * (len(self.COLUMNS) - len(row))
+            try:
+                amount = float(row[2] or 0)
+            except (TypeError, ValueError):
+                logger.warning(f"Skipping ledger row with invalid amount: {row}")
+                continue
+            values.append((str(row[0])[:10], row[1], amount, row[3], row[4], row[5], row[6] or None, tenant_key(row[7])))
+        return values
+
+    def _insert(self, values):
+        self._conn.executemany(
+            f"INSERT OR IGNORE INTO ledger ({', '.join(self.COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            values
+        )
+
+    def add_rows(self, rows):
+        values = self._values(rows)
+        with self._lock:
+            self._insert(values)
+            self._conn.commit()
+
+    def get_records(self, chat_id, start_date, end_date):
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM ledger"
+                " WHERE chat_id = ? AND tanggal BETWEEN ? AND ? ORDER BY tanggal, seq",
+                (tenant_key(chat_id), self._day(start_date), self._day(end_date))
+            ).fetchall()
+        return [dict(zip(self.HEADERS, row)) for row in rows]
+
+    def iter_records(self, chat_id, start_date, end_date, batch_size=1000):
+        # A separate read connection streams the cursor without holding the write lock (WAL)
+        conn = sqlite3.connect(self.path)
+        try:
+            cursor = conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM ledger"
+                " WHERE chat_id = ? AND tanggal BETWEEN ? AND ? ORDER BY tanggal, seq",
+                (tenant_key(chat_id), self._day(start_date), self._day(end_date))
+            )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(zip(self.HEADERS, row))
+        finally:
+            conn.close()
+
+    def get_totals(self, chat_id, start_date, end_date):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT tipe, kategori, SUM(jumlah) FROM ledger"
+                " WHERE chat_id = ? AND tanggal BETWEEN ? AND ? GROUP BY tipe, kategori",
+                (tenant_key(chat_id), self._day(start_date), self._day(end_date))
+            ).fetchall()
+        totals = {}
+        for type, category, amount in rows:
+            totals.setdefault(type, {})[category] = amount
+        return totals
+
+    def get_month_totals(self, chat_id, year, month):
+        first = date(year, month, 1)
+        last = (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        return self.get_totals(chat_id, first, last)
+
+    def get_year_totals(self, chat_id, year):
+        return self.get_totals(chat_id, date(year, 1, 1), date(year, 12, 31))
+
+    def row_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM ledger").fetchone()[0]
+
+    def rebuild(self, chat_id):
+        # Totals are aggregated in SQL on every query, so there is nothing that could drift
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT COUNT(*) FROM ledger WHERE chat_id = ?", (tenant_key(chat_id),)
+            ).fetchone()[0]
+        return {'rebuilt': False, 'mismatches': [], 'rows': rows}
+
+    def import_records(self, records):
+        """Load header-keyed records, e.g. from the sheet cache; importing the same records twice is a no-op.
+
+        Rows with an ID are skipped when that ID is stored. Rows without one (older
+        sheets) are matched on their content, so only copies not stored yet are added.
+        """
+        values = self._values(
+            [record.get(header) for header in self.HEADERS]
+            for record in records
+            if record.get('Tanggal')
+        )
+        keyed = [value for value in values if value[6] is not None]
+        unkeyed = Counter(value[:6] + value[7:] for value in values if value[6] is None)
+        with self._lock:
+            self._insert(keyed)
+            if unkeyed:
+                stored = Counter({
+                    tuple(row[:-1]): row[-1]
+                    for row in self._conn.execute(
+                        "SELECT tanggal, tipe, jumlah, kategori, keterangan, timestamp, chat_id, COUNT(*)"
+                        " FROM ledger WHERE id IS NULL"
+                        " GROUP BY tanggal, tipe, jumlah, kategori, keterangan, timestamp, chat_id"
+                    )
+                })
+                self._insert([
+                    key[:6] + (None,) + key[6:]
+                    for key, count in unkeyed.items()
+                    for _ in range(count - stored[key])
+                ])
+            self._conn.commit()
+
+    @staticmethod
+    def _day(value):
+        return value.strftime('%Y-%m-%d')
@@ -0,0 +1,120 @@
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from json_file import AtomicJsonFile, PeriodicSaver
+
+logger = logging.getLogger(__name__)
+
+class UpdateDeduplicator:
+    """Bounded, time-windowed memory of the Telegram update_ids already dispatched.
+
+    A deque of ``(update_id, seen_at)`` in arrival order works as a ring buffer
+    next to a dict for O(1) lookups; ids fall out after ``window`` seconds or
+    once more than ``max_entries`` are held. A window or size of 0 disables it.
+    With a ``path`` the ids are written back (atomically) by a background thread
+    every ``persist_interval`` seconds when they changed, and on interpreter exit,
+    so a restart doesn't forget updates Telegram may still retry. Webhook
+    requests never serialize them.
+    """
+
+    def __init__(self, max_entries=10000, window=3600, path=None, persist_interval=5):
+        self.max_entries = max_entries
+        self.window = window
+        self.path = path
+        self.persist_interval = persist_interval
+        self._file = AtomicJsonFile(path) if path else None
+        self._order = deque()
+        self._seen = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._saver = None
+        self.checked = 0
+        self.duplicates = 0
+        self.forgotten = 0
+
+        if self.path:
+            self._load()
+            self._saver = PeriodicSaver(self.save, persist_interval, name="update-dedup-saver")
+            atexit.register(self.save)
+
+    @property
+    def enabled(self):
+        return self.window > 0 and self.max_entries > 0
+
+    def is_duplicate(self, update_id):
+        """Return True if ``update_id`` was seen within the window; otherwise remember it"""
+        if not self.enabled or update_id is None:
+            return False
+        now = time.time()
+        with self._lock:
+            self.checked += 1
+            self._expire(now)
+            if update_id in self._seen:
+                self.duplicates += 1
+                return True
+            self._seen[update_id] = now
+            self._order.append((update_id, now))
+            self._dirty = True
+        return False
+
+    def forget(self, update_id):
+        """Drop an id that was not dispatched after all (e.g. answered 429), so its retry is accepted"""
+        with self._lock:
+            if self._seen.pop(update_id, None) is not None:
+                self.forgotten += 1
+                self._dirty = True
+
+    def get_metrics(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._seen),
+                'max_entries': self.max_entries,
+                'window': self.window,
+                'checked': self.checked,
+                'duplicates': self.duplicates,
+                'forgotten': self.forgotten,
+            }
+
+    def save(self):
+        """Write the remembered ids to disk if they changed since the last save"""
+        if not self._file:
+            return
+        try:
+            self._file.save(self._snapshot)
+        except Exception as e:
+            logger.error(f"Error saving seen update ids to {self.path}: {e}")
+            with self._lock:
+                # Let the next round try again
+                self._dirty = True
+
+    def _snapshot(self):
+        with self._lock:
+            if not self._dirty:
+                return None
+            self._dirty = False
+            return [[update_id, seen_at] for update_id, seen_at in self._order
+                    if self._seen.get(update_id) == seen_at]
+
+    def _load(self):
+        try:
+            snapshot = self._file.load()
+        except Exception as e:
+            logger.error(f"Error loading seen update ids from {self.path}: {e}")
+            return
+        if snapshot is None:
+            return
+        for update_id, seen_at in snapshot:
+            self._seen[update_id] = seen_at
+            self._order.append((update_id, seen_at))
+        self._expire(time.time())
+        logger.info(f"Loaded {len(self._seen)} seen update ids from {self.path}")
+
+    def _expire(self, now):
+        while self._order and (len(self._order) > self.max_entries or now - self._order[0][1] > self.window):
+            update_id, seen_at = self._order.popleft()
+            # A forgotten and re-added id has a newer entry further back
+            if self._seen.get(update_id) == seen_at:
+                del self._seen[update_id]
@@ -0,0 +1,178 @@
+import atexit
+import logging
+import random
+import threading
+import time
+from config import Config
+from metrics import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+class WriteBehindBuffer:
+    """Coalesce journaled ledger rows and write them to Sheets in batches.
+
+    ``add`` journals a row and returns as soon as it is on disk. A background
+    thread flushes pending rows with a single ``write_rows`` call once
+    ``max_batch`` rows are waiting or the oldest has waited ``max_delay``
+    seconds. Rows that fail to flush stay pending in the journal and are retried
+    with exponential backoff, which also makes the buffer the replayer that
+    drains the journal once Sheets is reachable again.
+
+    Replays must not duplicate rows: after a failure (the write may have landed
+    anyway) or a restart, the next batch is passed through ``drop_existing``,
+    which returns only the entries whose IDs are not in the sheet yet.
+    """
+
+    def __init__(self, journal, write_rows, drop_existing=None, max_batch=None, max_delay=None,
+                 retry_base=None, retry_max=None):
+        self.journal = journal
+        self.write_rows = write_rows
+        self.drop_existing = drop_existing
+        self.max_batch = max_batch or Config.SHEETS_BATCH_SIZE
+        self.max_delay = Config.SHEETS_BATCH_DELAY if max_delay is None else max_delay
+        self.retry_base = retry_base or Config.SHEETS_RETRY_BASE
+        self.retry_max = retry_max or Config.SHEETS_RETRY_MAX
+        self.consecutive_failures = 0
+        self._verify_next = False
+        self._pending = []
+        self._oldest = None
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self.batches = 0
+        self.rows_flushed = 0
+        self.max_batch_seen = 0
+        self.failures = 0
+        self.flush_latency = LatencyStats()
+
+        # Rows acknowledged before a crash or restart go out with the first batch
+        for entry_id, row in self.journal.pending():
+            self._pending.append((entry_id, row))
+        if self._pending:
+            self._oldest = time.monotonic()
+            self._verify_next = True
+            logger.info(f"Recovered {len(self._pending)} unsent rows from journal")
+
+        self._thread = threading.Thread(target=self._run, name="sheets-write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @property
+    def pending_count(self):
+        with self._condition:
+            return len(self._pending)
+
+    def add(self, entry_id, row):
+        """Journal a row under its transaction ID and queue it for the next batch"""
+        self.add_many([(entry_id, row)])
+
+    def add_many(self, entries):
+        """Journal several (id, row) pairs in one transaction and queue them together"""
+        if not entries:
+            return
+        self.journal.append(entries)
+        with self._condition:
+            self._pending.extend(entries)
+            if self._oldest is None:
+                # Wake the flusher so it starts timing this batch
+                self._oldest = time.monotonic()
+                self._condition.notify()
+            elif len(self._pending) >= self.max_batch:
+                self._condition.notify()
+
+    def pending_entries(self):
+        """Snapshot of the (id, row) pairs not confirmed in Sheets yet, including a batch being written"""
+        with self._condition:
+            return list(self._pending)
+
+    def flush(self):
+        """Write every pending row now; returns False if the write failed"""
+        with self._flush_lock:
+            while True:
+                with self._condition:
+                    batch = self._pending[:self.max_batch]
+                if not batch:
+                    return True
+                if not self._write_batch(batch):
+                    return False
+
+    def close(self):
+        """Stop the background thread after a final flush"""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify()
+        self._thread.join(timeout=30)
+        self.flush()
+
+    def get_metrics(self):
+        """Return pending count, batch counters and flush latency"""
+        with self._condition:
+            pending = len(self._pending)
+        return {
+            'pending': pending,
+            'batches': self.batches,
+            'rows_flushed': self.rows_flushed,
+            'mean_batch_size': round(self.rows_flushed / self.batches, 2) if self.batches else 0,
+            'max_batch_size': self.max_batch_seen,
+            'failures': self.failures,
+            'consecutive_failures': self.consecutive_failures,
+            'flush_latency': self.flush_latency.snapshot(),
+        }
+
+    def _write_batch(self, batch):
+        started = time.perf_counter()
+        try:
+            to_write = batch
+            if self._verify_next and self.drop_existing:
+                to_write = self.drop_existing(batch)
+                if len(to_write) < len(batch):
+                    logger.info(f"Skipping {len(batch) - len(to_write)} rows already in Google Sheets")
+            if to_write:
+                self.write_rows([row for _, row in to_write])
+        except Exception as e:
+            self.failures += 1
+            self._verify_next = True
+            logger.error(f"Failed to flush {len(batch)} rows to Google Sheets: {e}")
+            return False
+        self._verify_next = False
+        self.flush_latency.record(time.perf_counter() - started)
+        self.journal.mark_sent([entry_id for entry_id, _ in batch])
+        with self._condition:
+            del self._pending[:len(batch)]
+            self._oldest = time.monotonic() if self._pending else None
+        self.batches += 1
+        self.rows_flushed += len(batch)
+        self.max_batch_seen = max(self.max_batch_seen, len(batch))
+        logger.info(f"Flushed {len(batch)} rows to Google Sheets")
+        return True
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed and not self._due():
+                    timeout = None
+                    if self._oldest is not None:
+                        timeout = max(self._oldest + self.max_delay - time.monotonic(), 0)
+                    self._condition.wait(timeout)
+                if self._closed:
+                    return
+            if self.flush():
+                self.consecutive_failures = 0
+                continue
+            self.consecutive_failures += 1
+            delay = min(self.retry_base * 2 ** (self.consecutive_failures - 1), self.retry_max)
+            delay *= random.uniform(0.8, 1.2)
+            logger.info(f"Retrying Google Sheets flush in {delay:.1f}s")
+            deadline = time.monotonic() + delay
+            with self._condition:
+                while not self._closed and time.monotonic() < deadline:
+                    self._condition.wait(deadline - time.monotonic())
+
+    def _due(self):
+        if not self._pending:
+            return False
+        if len(self._pending) >= self.max_batch:
+            return True
+        return time.monotonic() - self._oldest >= self.max_delay